@@ -0,0 +1,77 @@
+"""
+Anonymization throughput benchmark.
+Anonymizes a generated column of repeated user names with the former per value sha256 and with
+TextCleaner.anonymize (distinct values, LRU and batch hashing) for every anonymizer, and prints the throughput.
+
+    python benchmarks/anonymize_benchmark.py --rows 10000000 --distinct 50000
+"""
+import argparse
+import os
+import sys
+from hashlib import sha256
+from time import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.anonymizer import create_anonymizer  # noqa: E402
+from src.cleaner import TextCleaner  # noqa: E402
+
+
+def generate_column(rows, distinct, seed=0):
+    rnd = np.random.default_rng(seed)
+    names = np.array([f'user.{i}@example.com' for i in range(distinct)], dtype=object)
+    # a few very active users and a long tail, like sys_created_by
+    return names[np.minimum(rnd.zipf(1.3, rows) - 1, distinct - 1)]
+
+
+def legacy_anonymize(column):
+    return [sha256(str(x).encode('utf-8')).hexdigest() for x in column]
+
+
+def measure(name, anonymize, column):
+    t0 = time()
+    results = anonymize(column)
+    elapsed = time() - t0
+    print(f'{name}: {len(column) / elapsed:,.0f} rows/s ({elapsed:.1f} s)')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--distinct', type=int, default=50000)
+    parser.add_argument('--chunk', type=int, default=100000, help='rows of a masking chunk')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    column = generate_column(args.rows, args.distinct, args.seed)
+    print(f'Anonymizing {len(column):,} rows with {len(set(column)):,} distinct values')
+
+    legacy = measure('per value sha256', legacy_anonymize, column)
+
+    anonymizers = [('sha256', create_anonymizer()),
+                   ('keyed blake2b', create_anonymizer('benchmark key')),
+                   ('hmac-sha256', create_anonymizer('benchmark key', use_hmac=True))]
+    mismatches = 0
+    for name, anonymizer in anonymizers:
+        cleaner = TextCleaner([], anonymizer=anonymizer)
+
+        def anonymize_chunks(data):
+            results = []
+            for i in range(0, len(data), args.chunk):
+                results.extend(cleaner.anonymize(data[i:i + args.chunk]))
+            return results
+
+        results = measure(f'distinct values {name}', anonymize_chunks, column)
+        if name == 'sha256':
+            mismatches = sum(1 for a, b in zip(legacy, results) if a != b)
+        print(f'    {cleaner.anonymize_summary()}')
+
+    print(f'Output mismatches: {mismatches}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
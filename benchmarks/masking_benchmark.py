@@ -0,0 +1,85 @@
+"""
+Masking throughput benchmark.
+Masks generated ticket descriptions with TextCleaner and with the former per word detectors chain,
+checks that both produce the same output and prints the throughput of each.
+
+    python benchmarks/masking_benchmark.py --records 2000000
+"""
+import argparse
+import os
+import random
+import re
+import sys
+from time import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.cleaner import TextCleaner, WORDS_REGEX, WORD_DETECTORS, PHONE_REGEX  # noqa: E402
+
+WORDS = ['printer', 'is', 'not', 'working', 'after', 'the', 'update', 'please', 'reset', 'my', 'password',
+         'vpn', 'disconnects', 'every', 'few', 'minutes', 'laptop', 'screen', 'flickers', 'outlook', 'crashes',
+         'when', 'opening', 'attachments', 'user', 'cannot', 'login', 'to', 'portal', 'error', 'code']
+DETAILS = ['call me at +1 555 123 4567', 'contact john.doe@example.com', 'server 10.20.30.40 unreachable',
+           'see www.example.com/kb/123', 'ticket INC0012345 reopened', 'card 1234-5678-9012-3456',
+           'employee id 987654321', 'ssn 123-45-6789', 'build 2.4.1 on host-12', 'room 42b']
+
+
+def generate_descriptions(count, seed=0):
+    rnd = random.Random(seed)
+    for _ in range(count):
+        words = rnd.choices(WORDS, k=rnd.randint(8, 40))
+        if rnd.random() < 0.6:
+            words.insert(rnd.randrange(len(words)), rnd.choice(DETAILS))
+        yield ' '.join(words)
+
+
+class LegacyCleaner:
+    """
+    Former word masking, every word runs through the detectors one search at a time
+    """
+
+    def __init__(self):
+        self.phone = re.compile(PHONE_REGEX)
+        self.words = re.compile(WORDS_REGEX)
+        self.detectors = [(re.compile(regex), replacement) for _, regex, replacement in WORD_DETECTORS]
+
+    def replace_word(self, match):
+        src = match.group()
+        x = src.strip()
+        for detector, replacement in self.detectors:
+            if detector.search(x):
+                return replacement
+        return src
+
+    def clean(self, x):
+        x = self.phone.sub('<#P>', str(x))
+        return self.words.sub(self.replace_word, x).strip()
+
+
+def measure(name, clean, descriptions):
+    t0 = time()
+    results = [clean(x) for x in descriptions]
+    elapsed = time() - t0
+    print(f'{name}: {len(descriptions) / elapsed:,.0f} records/s ({elapsed:.1f} s)')
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--records', type=int, default=2000000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    descriptions = list(generate_descriptions(args.records, args.seed))
+    print(f'Masking {len(descriptions):,} descriptions')
+
+    legacy = measure('per word detectors', LegacyCleaner().clean, descriptions)
+    current = measure('single pass detectors', TextCleaner([]).clean_custom_tokens_chunk, descriptions)
+
+    mismatches = sum(1 for a, b in zip(legacy, current) if a != b)
+    print(f'Output mismatches: {mismatches}')
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -9,12 +9,23 @@ class Help:
     proccess: str = 'Process extracted data'
     stop_limit: str = 'Maximum total records count that can be extracted'
     file_limit: str = 'Maximum amount of entires in the single file'
+    file_size_limit: str = 'Maximum size in MB of the single extracted file before compression, 0 for no limit'
     interval: str = 'Hours for single extraction iteration'
     batch_size: str = 'Amount of records for single download'
     thread_id: str = ''
     extension: str = ''
     parallel: str = 'Specification of the number or extract rest API requests that will be invoked \
-in parallel. The provided interval value is split based on this specification for achieving the concurrency.'
+in parallel. The period is queued in interval windows and every idle thread takes the next window.'
+    page_concurrency: str = 'Number of pages requested concurrently inside a single extraction interval. \
+Pages are still saved in their original order.'
+    async_engine: str = 'Extract using asyncio engine with a shared http connection pool instead of threads'
+    max_connections: str = 'Maximum amount of concurrent requests when --async_engine is used'
+    adaptive_windows: str = 'Split or merge extraction intervals according to the amount of records in them. \
+The records are counted before the extraction and the intervals are shared between --parallel threads.'
+    window_target: str = 'Target amount of records in a single extraction interval when --adaptive_windows is used'
+    resume: str = 'Continue the extraction journaled in the output_dir checkpoint, skipping completed windows'
+    cursor_pagination: str = 'Paginate every interval by the last (date column, sys_id) of the previous page \
+instead of sysparm_offset'
     username: str = 'ServiceNow acout username'
     password: str = 'ServiceNow acout password'
     token: str = 'ServiceNow acout token'
@@ -24,7 +35,10 @@ in parallel. The provided interval value is split based on this specification fo
     start_date: str = 'Extraction start date in format YYYY-mm-dd'
     end_date: str = 'Extraction end date in format YYYY-mm-dd'
     url: str = 'Specification of ServiceNow table and filter in RestAPI terminology'
-    output_format: str = 'Format of the created files'
+    output_format: str = 'Format of the created files, jsonl writes a json record per line. \
+Parquet and arrow (IPC stream) require the pyarrow package'
+    columnar_compression: str = 'Compression of parquet (snappy, gzip, brotli, zstd, lz4, none) \
+or arrow (none, lz4, zstd) files, snappy for parquet and none for arrow by default'
     id_list_path: str = 'Path to filtering file in csv format'
     id_field_name: str = 'Name of field in the filtering file'
     data_id_name: str = 'Name of field in the source data'
@@ -35,12 +49,25 @@ in parallel. The provided interval value is split based on this specification fo
     custom_token_dir: str = 'Directory that contains files with custom names for masking'
     important_token_file: str = 'Path to file with names/tokens that will not be masked'
     compress: str = 'Use this flag for applying compression on the files in outpu_dir (during their creation)'
+    compress_codec: str = 'Codec of --compress, gzip or zstd (requires the zstandard package)'
+    compress_level: str = 'Level of --compress (gzip 1-9, zstd 1-22), 0 for the codec default (gzip 6, zstd 3)'
+    compress_workers: str = 'Threads compressing blocks of the --compress files in parallel, 0 for all the cores'
     input_sources: str = 'coma separated filenames or directories containing json'
     input_encoding: str = 'Encoding of the input data'
     white_list:str = 'List of columns for output. If not specified all the columns will be used for output'
-    input_dir: str = 'Directory that contains files for masking. The files should not be compressed.'
+    input_dir: str = 'Directory that contains csv, json, json lines (.jsonl, .ndjson) and parquet files for masking. \
+Csv, json and json lines files can be gzip (.gz) or zstd (.zst) compressed'
     input_file: str = 'Specific file name inside input_dir. If specified this is the only file that will be masked.'
-    csv_chunk_size:str = 'Performance parameter, used to set maximum chunk size for csv file masking'
+    csv_chunk_size:str = 'Performance parameter, used to set maximum chunk size for csv and json file masking'
+    workers: str = 'Number of processes masking file chunks in parallel, chunks are written in their original order'
+    parallel_files: str = 'Mask whole files in parallel on the --workers processes, largest files first. \
+Requires --workers > 1'
+    mask_cache: str = 'Memory in MB for reusing the masking of repeated text values across chunks, 0 disables it'
+    anonymize_key: str = 'Key of the anonymization hash (keyed BLAKE2b), can be set by SWISH_ANONYMIZE_KEY. \
+Without a key values are anonymized with sha256'
+    anonymize_hmac: str = 'Anonymize with HMAC-SHA256 of --anonymize_key instead of keyed BLAKE2b'
+    anonymize_digest_size: str = 'Digest size in bytes of the keyed anonymization \
+(1-64, up to 32 with --anonymize_hmac)'
     output_dir: str = 'Directory that contains files that were created as part of --maks of --extract operation'
     pattern:str = 'Custom pattern for replacements'
     version: str = 'Prints current version'
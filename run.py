@@ -17,21 +17,31 @@ parentdir = os.path.dirname(currentdir)
 sys.path.insert(0, parentdir)
 
 import json
-import threading
+import multiprocessing
+import queue
 import traceback
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from datetime import datetime, timedelta
 from cli_util import DipException, dip_option, setup_cli
 from dip_help import Help
 from src.data_filter import ColumnFilter
-from src.extractor_resource import CsvFromJson, DefaultDataProccessor, Extractor
+from src.extractor_resource import CsvFromJson, DefaultDataProccessor, Extractor, WindowPlanner, iterate_date_windows
 from types import SimpleNamespace
 from src.settings import Settings
 from src.file import File
+from src.async_extractor import AsyncExtractor
+from src.checkpoint import ExtractionCheckpoint
 import pandas as pd
 from pandas.io.parsers import TextFileReader
 from pandas.errors import EmptyDataError
 from pandas import read_csv, read_excel, DataFrame
+from src.anonymizer import create_anonymizer
+from src.writers import COLUMNAR_FORMATS
+from src.compression import Compression, open_input
 from src.cleaner import Masker, TextCleaner, CustomUserFile
+from src.readers import INPUT_EXTENSIONS, JSON_LINES_EXTENSIONS, CarriageReturnFixer, JsonChunksReader, \
+    JsonLinesReader, ParquetChunksReader, input_extension, scan_columns, sniff_encoding
 from time import time
 
 try:
@@ -82,13 +92,30 @@ def manual_override(val, current_groups, kwargs):
 @dip_option('--proccess', '-w', is_flag=True, help=Help.proccess, ns="processing")
 @dip_option('--stop_limit', '-l', help=Help.stop_limit, default=1000000000, groups=['extracting'])
 @dip_option('--file_limit', '-f', help=Help.file_limit, default=40000000, groups=['extracting'])
+@dip_option('--file_size_limit', '-fs', type=click.IntRange(0, sys.maxsize),
+            help=Help.file_size_limit, default=0, groups=['extracting'])
 @dip_option('--interval', '-i', type=click.IntRange(1, sys.maxsize),
             help=Help.interval, default=24, groups=['extracting'])
 @dip_option('--batch_size', '-b', help=Help.batch_size, default=1000, groups=['extracting'])
 @dip_option('--parallel', '-x', map_to='parallelism_level', help=Help.parallel, default=1, groups=['extracting'])
+@dip_option('--page_concurrency', '-pc', type=click.IntRange(1, sys.maxsize),
+            help=Help.page_concurrency, default=1, groups=['extracting'])
+@dip_option('--async_engine', '-ae', is_flag=True, help=Help.async_engine, groups=['extracting'])
+@dip_option('--max_connections', '-mc', type=click.IntRange(1, sys.maxsize),
+            help=Help.max_connections, default=10, groups=['extracting'])
+@dip_option('--adaptive_windows', '-aw', is_flag=True, help=Help.adaptive_windows, groups=['extracting'])
+@dip_option('--window_target', '-wt', type=click.IntRange(1, sys.maxsize),
+            help=Help.window_target, default=100000, groups=['extracting'])
+@dip_option('--cursor_pagination', '-cp', is_flag=True, help=Help.cursor_pagination, groups=['extracting'])
+@dip_option('--resume', '-rs', is_flag=True, help=Help.resume, groups=['extracting'])
 @dip_option('--thread_id', '-t', help=Help.thread_id, default=0, groups=['extracting'])
 @dip_option('--extension', '-y', help=Help.extension, default='json', groups=['extracting'])
 @dip_option('--compress', '-c', help=Help.compress, default=False, groups=['extracting', 'masking'])
+@dip_option('--compress_codec', '-cc', help=Help.compress_codec, default='gzip', groups=['extracting', 'masking'])
+@dip_option('--compress_level', '-cl', help=Help.compress_level, default=0, type=click.IntRange(0, 22),
+            groups=['extracting', 'masking'])
+@dip_option('--compress_workers', '-cw', help=Help.compress_workers, default=0, type=click.IntRange(0),
+            groups=['extracting', 'masking'])
 @dip_option('--username', '-u', help=Help.username, default='', groups=['extracting', 'token_get'])
 @dip_option('--password', '-p', help=Help.password, default='', groups=['extracting', 'token_get'])
 @dip_option('--token', '-tk', help=Help.token, default='', groups=['extracting'])
@@ -101,7 +128,9 @@ def manual_override(val, current_groups, kwargs):
             groups=['extracting'], swish_default='-')
 @dip_option('--url', '-j', help=Help.url, default=None, groups=['extracting'])
 @dip_option('--output_format', '-of', help=Help.output_format, default='csv',
-            choices=['json', 'csv'], groups=['extracting', 'masking'])
+            choices=['json', 'jsonl', 'csv', 'parquet', 'arrow'], groups=['extracting', 'masking'])
+@dip_option('--columnar_compression', '-cz', help=Help.columnar_compression, default='',
+            groups=['extracting', 'masking'])
 @dip_option('--date_column', '-dc', help=Help.date_column, default='', groups=['extracting'])
 @dip_option('--id_list_path', '-q', help=Help.id_list_path, default='', groups=['extracting'])
 @dip_option('--id_field_name', '-r', help=Help.id_field_name, default='sys_id', groups=['extracting'])
@@ -114,6 +143,16 @@ def manual_override(val, current_groups, kwargs):
 @dip_option('--input_file', '-if', help=Help.input_file, default='', groups=['masking'])
 @dip_option('--csv_chunk_size', '-cs', help=Help.csv_chunk_size, default=10000, groups=['masking'])
 @dip_option('--mapping_path', '-mp', help=Help.mapping_path, default=None, groups=['masking'])
+@dip_option('--workers', '-wk', type=click.IntRange(1, sys.maxsize),
+            help=Help.workers, default=1, groups=['masking'])
+@dip_option('--parallel_files', '-pf', is_flag=True, help=Help.parallel_files, groups=['masking'])
+@dip_option('--mask_cache', '-mk', type=click.IntRange(0, sys.maxsize),
+            help=Help.mask_cache, default=0, groups=['masking'])
+@dip_option('--anonymize_key', '-ak', help=Help.anonymize_key, default='', envvar='SWISH_ANONYMIZE_KEY',
+            groups=['masking'])
+@dip_option('--anonymize_hmac', '-ah', is_flag=True, help=Help.anonymize_hmac, groups=['masking'])
+@dip_option('--anonymize_digest_size', '-as', type=click.IntRange(1, 64),
+            help=Help.anonymize_digest_size, default=32, groups=['masking'])
 @dip_option('--custom_token_dir', '-ct', help=Help.custom_token_dir, default='', groups=['masking'])
 @dip_option('--important_token_file', '-it', help=Help.important_token_file, default=None, groups=['masking'])
 @dip_option('--input_sources', '-is', help=Help.input_sources, default='', groups=['processing'])
@@ -219,30 +258,6 @@ def exec(params):
     message = f'Script has FINISHED'
     click.echo(message)
 
-def read_in_chunks(file_object, chunk_size=1024):
-    while True:
-        data = file_object.read(chunk_size)
-        if not data:
-            break
-        yield data
-
-def copy_to_fixed_file(file_path, encoding=None):
-    out_file_path = f'{file_path}.temp_swish'
-    if os.path.isfile(out_file_path):
-        os.remove(out_file_path)
-    elcodings = get_encodings_list(encoding)
-    for enc in elcodings:
-        try:
-            with open(file_path, mode='r', encoding=enc) as f:
-                with open(out_file_path, mode='a', encoding="utf-8") as of:
-                    for piece in read_in_chunks(f):
-                        of.write(piece.replace('\r', '<#__swish_r>'))
-            return out_file_path
-        except UnicodeDecodeError:
-            print(f"Faild to open using encoding {enc}")
-    raise DipException(f'Failed to read file {file_path}')
-
-
 def create_masker(mapping_params):
     important_token_file = None
     encodings = get_encodings_list(mapping_params.input_encoding)
@@ -251,7 +266,11 @@ def create_masker(mapping_params):
         important_token_file = CustomUserFile(mapping_params.important_token_file, encodings=encodings)
     cleaner = TextCleaner(mapping_params.data.custom_tokens_filename_list, important_token_file,
                           encodings=encodings, patterns=mapping_params.pattern,
-                          preprocess_patterns=mapping_params.preprocess_patterns)
+                          preprocess_patterns=mapping_params.preprocess_patterns,
+                          mask_cache_size=mapping_params.mask_cache * 1024 * 1024,
+                          anonymizer=create_anonymizer(mapping_params.anonymize_key,
+                                                       mapping_params.anonymize_digest_size,
+                                                       mapping_params.anonymize_hmac))
     custom_token_dir = mapping_params.custom_token_dir
     directory = mapping_params.custom_token_dir
     custom_tokens_filename_list = []
@@ -285,18 +304,15 @@ def extracting_execute(params, app_settings, filter_by_column, data_proccessor,
         app_settings.logger.info(message)
         click.echo(message)
 
-        if params.extracting.parallelism_level > 1:
-            extracting_multithreading_execution(params, app_settings, filter_by_column, data_proccessor, mask_results)
-        else:
-            api_resource = Extractor(params.extracting.start_date, params.extracting.end_date, 0,
-                                     app_settings, filter_by_column=filter_by_column,
-                                     data_proccessor=data_proccessor, mask_results=mask_results,
-                                     all_dates=params.extracting.all_dates, date_column=params.extracting.date_column)
-            api_resource.api_extract(params)
+        checkpoint = open_checkpoint(params, app_settings)
+        work_queue = plan_windows_queue(params, app_settings, checkpoint)
 
-            message = f'Total Added: {api_resource.total_added}, Total Failed Approximated: {api_resource.total_failed}'
-            app_settings.logger.info(message)
-            click.echo(click.style(message, fg="bright_magenta", underline=True))
+        if params.extracting.async_engine:
+            extracting_async_execution(params, app_settings, filter_by_column, data_proccessor, mask_results,
+                                       work_queue, checkpoint)
+        else:
+            extracting_pool_execution(params, app_settings, filter_by_column, data_proccessor, mask_results,
+                                      work_queue, checkpoint)
 
     except Exception as error:
         message = f'Execution Error: {error}'
@@ -323,48 +339,129 @@ def processing_execute(params, app_settings):
     app_settings.logger.info(f"Created csv file with {data_proccessor.size()} entities")
 
 
-def extracting_multithreading_execution(params, app_settings, filter_by_column, data_proccessor, mask_results):
-
-    thread_list = list()
-    total_period = params.extracting.end_date - params.extracting.start_date
-    single_period = total_period.total_seconds() / params.extracting.parallelism_level
-    batch_start_date = params.extracting.start_date
-    batch_end_date = batch_start_date + timedelta(seconds=single_period)
-
-    resources = [None] * params.extracting.parallelism_level
-    for thread_id in range(params.extracting.parallelism_level):
-        thread_params = params
-        thread_params.extracting.start_date = batch_start_date
-        thread_params.extracting.end_date = batch_end_date
-        thread_params.extracting.thread_id = thread_id
-
-        resources[thread_id] = Extractor(batch_start_date, batch_end_date, thread_id, Settings(str(thread_id)),
-                                         filter_by_column=filter_by_column,
-                                         data_proccessor=data_proccessor, mask_results=mask_results)
+def open_checkpoint(params, app_settings):
+    """
+    Journal of the extraction progress in the output directory, loaded back with --resume.
+    """
+    run = {
+        'url': params.extracting.url,
+        'start_date': str(params.extracting.start_date),
+        'end_date': str(params.extracting.end_date),
+        'date_column': params.extracting.date_column,
+        'cursor_pagination': params.extracting.cursor_pagination,
+    }
+    checkpoint = ExtractionCheckpoint(params.extracting.output_dir, run)
+    if params.extracting.resume:
+        if checkpoint.exists():
+            checkpoint.load()
+            return checkpoint
+        message = f'No checkpoint found in {params.extracting.output_dir}, starting a new extraction'
+        app_settings.logger.info(message)
+        click.echo(click.style(message, fg="yellow"))
+    return checkpoint
+
+
+def plan_windows_queue(params, app_settings, checkpoint):
+    """
+    Queues the extraction windows, every idle extracting thread takes the next window.
+    A resumed extraction queues the windows of the checkpoint that are not completed yet.
+    """
+    if checkpoint.resumed:
+        windows = checkpoint.remaining_windows()
+        message = f'Resuming extraction, {len(windows)} windows left, {len(checkpoint.state["completed"])} completed'
+        app_settings.logger.info(message)
+        click.echo(message)
+    else:
+        windows = plan_windows(params, app_settings)
+        checkpoint.start(windows)
+
+    work_queue = queue.Queue()
+    for window in windows:
+        work_queue.put(window)
+    return work_queue
+
+
+def plan_windows(params, app_settings):
+    start_date, end_date = params.extracting.start_date, params.extracting.end_date
+    if (start_date == '-' or end_date == '-') and not params.extracting.all_dates:
+        raise DipException('If --start_date or --end_date is not provides --all_date should be specified')
+    if params.extracting.all_dates:
+        now = datetime.now()
+        return [(now if start_date == '-' else start_date, now if end_date == '-' else end_date)]
+    if params.extracting.adaptive_windows:
+        return plan_adaptive_windows(params, app_settings)
+
+    # Periods shorter than parallel intervals are split to equal windows so every thread gets one
+    interval = params.extracting.interval
+    if params.extracting.parallelism_level > 1 and not params.extracting.async_engine:
+        total_period = end_date - start_date
+        single_period = total_period.total_seconds() / 3600 / params.extracting.parallelism_level
+        if 0 < single_period < interval:
+            interval = single_period
+    return list(iterate_date_windows(start_date, end_date, interval))
+
+
+def plan_adaptive_windows(params, app_settings):
+    """
+    Plans windows by records density, densest windows first so the last windows taken by the threads are the short ones.
+    """
+    planner_resource = Extractor(params.extracting.start_date, params.extracting.end_date, 0, app_settings,
+                                 date_column=params.extracting.date_column)
+    planner_resource.setup_request(params)
+    planner = WindowPlanner(planner_resource, params, params.extracting.window_target)
+    windows = planner.plan(params.extracting.start_date, params.extracting.end_date, params.extracting.interval)
+
+    message = f'Planned {len(windows)} extraction windows using {planner.probes} count requests'
+    app_settings.logger.info(message)
+    click.echo(message)
 
-        batch_start_date = batch_start_date + timedelta(seconds=single_period)
-        batch_end_date = batch_end_date + timedelta(seconds=single_period)
+    return [(batch_start_date, batch_end_date)
+            for batch_start_date, batch_end_date, _ in sorted(windows, key=lambda w: w[2] or 0, reverse=True)]
 
-    for thread_id in range(params.extracting.parallelism_level):
-        #
-        thread_params = params
-        thread = threading.Thread(target=resources[thread_id].api_extract, args=(thread_params,))
 
-        thread.start()
-        thread_list.append(thread)
+def extracting_async_execution(params, app_settings, filter_by_column, data_proccessor, mask_results,
+                               work_queue, checkpoint=None):
+    """
+    Extracts all the windows on a single asyncio loop, --max_connections bounds the requests in flight.
+    """
+    api_resource = AsyncExtractor(params.extracting.start_date, params.extracting.end_date, 0,
+                                  app_settings, filter_by_column=filter_by_column,
+                                  data_proccessor=data_proccessor, mask_results=mask_results,
+                                  all_dates=params.extracting.all_dates, date_column=params.extracting.date_column,
+                                  cursor_pagination=params.extracting.cursor_pagination, checkpoint=checkpoint)
+    api_resource.api_extract(params, work_queue)
 
-        batch_start_date = batch_start_date + timedelta(seconds=single_period)
-        batch_end_date = batch_end_date + timedelta(seconds=single_period)
+    message = f'Total Added: {api_resource.total_added}, Total Failed Approximated: {api_resource.total_failed}'
+    app_settings.logger.info(message)
+    click.echo(click.style(message, fg="bright_magenta", underline=True))
 
-    total_added = 0
-    total_failed = 0
-    for index, thread in enumerate(thread_list):
-        click.echo(f"Main    : before joining thread {index}")
-        thread.join()
-        click.echo(f"Main    : thread {index} done")
-        total_added += resources[index].total_added
-        total_failed += resources[index].total_failed
 
+def extracting_pool_execution(params, app_settings, filter_by_column, data_proccessor, mask_results,
+                              work_queue, checkpoint=None):
+    """
+    Runs --parallel extracting threads over the shared windows queue.
+    Every thread keeps a single Extractor (and its http session) for all the windows it takes.
+    """
+    # --all_dates extracts a single window
+    parallelism_level = 1 if params.extracting.all_dates else params.extracting.parallelism_level
+    resources = []
+    for thread_id in range(parallelism_level):
+        settings = app_settings if parallelism_level == 1 else Settings(str(thread_id))
+        resources.append(Extractor(params.extracting.start_date, params.extracting.end_date, thread_id, settings,
+                                   filter_by_column=filter_by_column,
+                                   data_proccessor=data_proccessor, mask_results=mask_results,
+                                   all_dates=params.extracting.all_dates, date_column=params.extracting.date_column,
+                                   cursor_pagination=params.extracting.cursor_pagination, checkpoint=checkpoint))
+
+    with ThreadPoolExecutor(max_workers=parallelism_level) as executor:
+        futures = [executor.submit(resource.api_extract, params, work_queue) for resource in resources]
+        for index, future in enumerate(futures):
+            click.echo(f"Main    : before joining thread {index}")
+            future.result()
+            click.echo(f"Main    : thread {index} done")
+
+    total_added = sum(resource.total_added for resource in resources)
+    total_failed = sum(resource.total_failed for resource in resources)
     message = f'Total Added: {total_added}, Total Failed Approximated: {total_failed}'
     app_settings.logger.info(message)
     click.echo(click.style(message, fg="bright_magenta", underline=True))
@@ -410,32 +507,147 @@ def masking_execute(params, app_settings):
     mask_results = create_masker(params)
     input_files = []
     get_all_files(params, input_files)
-    for f in input_files:
-        input_file = cli_file_read(f, params.input_encoding,
-                                                csv_chunk=params.csv_chunk_size,
-                                                fix_data=params.fix_data,
-                                                set_dtype=params.set_dtype,
-                                                skip_bad_lines=params.skip_bad_lines)
-        if input_file.ext == 'csv' and params.output_format != 'csv':
-            click.echo(click.style(NOT_CSV_FILE_WARNING, fg="yellow"))
-        params.data.file_objects.append(input_file)
-        cli_file_process(input_file, mask_results, params, app_settings)
-    
-    remove_swish_temps(params)
+    pool = None
+    if params.parallel_files and params.workers <= 1:
+        message = '--parallel_files requires --workers > 1, masking the files one by one'
+        app_settings.logger.info(message)
+        click.echo(click.style(message, fg="yellow"))
+    if params.workers > 1:
+        pool = ProcessPoolExecutor(max_workers=params.workers, initializer=init_masking_worker,
+                                   initargs=(masking_worker_params(params),))
+    f0 = time()
+    try:
+        if pool is not None and params.parallel_files:
+            timings = mask_files_in_pool(input_files, pool, mask_results)
+        else:
+            timings = []
+            for f in input_files:
+                f1 = time()
+                input_file = read_masking_input(f, params)
+                params.data.file_objects.append(input_file)
+                cli_file_process(input_file, mask_results, params, app_settings, pool)
+                timings.append((f, time() - f1))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    report_file_timings(timings, time() - f0, app_settings)
+    report_anonymize_cache(mask_results, app_settings)
+
+
+def read_masking_input(filename, params):
+    input_file = cli_file_read(filename, params.input_encoding,
+                               csv_chunk=params.csv_chunk_size,
+                               fix_data=params.fix_data,
+                               # csv chunks infer their own types, columnar output keeps the csv text
+                               set_dtype=params.set_dtype or params.output_format in COLUMNAR_FORMATS,
+                               skip_bad_lines=params.skip_bad_lines)
+    if input_file.ext == 'csv' and params.output_format == 'json':
+        click.echo(click.style(NOT_CSV_FILE_WARNING, fg="yellow"))
+    return input_file
+
+
+def mask_files_in_pool(input_files, pool, masker):
+    """
+    Masks whole files in the masking processes, largest files are scheduled first
+    so a big file does not start last and hold the whole run
+    :return: list of (filename, masking time)
+    """
+    input_files = sorted(input_files, key=os.path.getsize, reverse=True)
+    futures = [pool.submit(mask_file_in_worker, f) for f in input_files]
+    timings = []
+    try:
+        for future in as_completed(futures):
+            filename, elapsed, anonymize_stats = future.result()
+            masker.cleaner.anonymize_stats.update(anonymize_stats)
+            click.echo(f'Masked {filename} in {elapsed:.2f} s ({len(timings) + 1}/{len(futures)})')
+            timings.append((filename, elapsed))
+    finally:
+        for future in futures:
+            future.cancel()
+    return timings
+
+
+def report_file_timings(timings, elapsed, app_settings):
+    if not timings:
+        return
+    total = sum(t for _, t in timings)
+    message = f'Masked {len(timings)} files in {elapsed:.2f} s, ' \
+              f'files time: total {total:.2f} s, average {total / len(timings):.2f} s'
+    click.echo(click.style(message, fg="bright_magenta"))
+    app_settings.logger.info(message)
+    for filename, file_time in sorted(timings, key=lambda t: t[1], reverse=True)[:10]:
+        message = f'    {file_time:8.2f} s  {filename}'
+        click.echo(message)
+        app_settings.logger.info(message)
 
 
-def remove_swish_temps(params, cur_dir=None):
-    if cur_dir is None:
-        cur_dir = ''
-    
-    files = os.listdir(os.path.join(params.input_dir, cur_dir))
-    for f in files:
-        p = os.path.join(params.input_dir, cur_dir, f)
-        if os.path.isfile(p) and f.lower().endswith('.temp_swish'):
-            click.echo(f'Removing temp file {f}')
-            os.remove(os.path.join(params.input_dir, cur_dir, f))
-        if os.path.isdir(p):
-            remove_swish_temps(params, os.path.join(cur_dir, f))
+def report_anonymize_cache(masker, app_settings):
+    message = masker.cleaner.anonymize_summary()
+    if message:
+        click.echo(click.style(message, fg="bright_magenta"))
+        app_settings.logger.info(message)
+
+
+def masking_worker_params(params):
+    """
+    Masking params without the loaded files, sent to the masking processes to build their masker
+    """
+    worker_params = SimpleNamespace(**vars(params))
+    worker_params.data = SimpleNamespace(custom_tokens_filename_list=list(params.data.custom_tokens_filename_list),
+                                         destination_folder=params.data.destination_folder)
+    return worker_params
+
+
+worker_masker = None
+worker_params = None
+worker_settings = None
+
+
+def init_masking_worker(params):
+    global worker_masker, worker_params, worker_settings
+    worker_masker = create_masker(params)
+    worker_params = params
+    worker_settings = Settings(f'masking_{os.getpid()}')
+
+
+def mask_file_in_worker(filename):
+    f0 = time()
+    input_file = read_masking_input(filename, worker_params)
+    cli_file_process(input_file, worker_masker, worker_params, worker_settings)
+    return filename, time() - f0, worker_masker.cleaner.take_anonymize_stats()
+
+
+def mask_chunk_in_worker(chunk):
+    return mask_chunk(chunk, worker_masker), worker_masker.cleaner.take_anonymize_stats()
+
+
+def mask_chunk(chunk, masker):
+    chunk.fillna(chunk.dtypes.replace({'float64': 0.0, 'O': 'NULL'}), downcast='infer', inplace=True)
+    return masker(chunk, no_pd=True, no_output_json=True)
+
+
+def mask_chunks_in_pool(chunks, pool, workers, masker):
+    """
+    Masks the chunks in the masking processes and yields them in their original order.
+    At most two chunks per process are read ahead, so memory stays bounded on big files.
+    """
+    def masked_chunk(future):
+        chunk, anonymize_stats = future.result()
+        masker.cleaner.anonymize_stats.update(anonymize_stats)
+        return chunk
+
+    pending = deque()
+    try:
+        for chunk in chunks:
+            if len(pending) >= 2 * workers:
+                yield masked_chunk(pending.popleft())
+            pending.append(pool.submit(mask_chunk_in_worker, chunk))
+        while pending:
+            yield masked_chunk(pending.popleft())
+    finally:
+        for future in pending:
+            future.cancel()
 
 
 def get_all_files(params, out_res, cur_dir=None):
@@ -449,14 +661,43 @@ def get_all_files(params, out_res, cur_dir=None):
     for f in files:
         p = os.path.join(params.input_dir, cur_dir, f)
         if os.path.isfile(p):
-            if f.lower().endswith('.json') or f.lower().endswith('.csv'):
+            if f.startswith(ExtractionCheckpoint.FILENAME):
+                # the extraction journal, the extraction output is the masking input of export and mask runs
+                continue
+            if f.lower().endswith(INPUT_EXTENSIONS):
                 out_res.append(os.path.join(params.input_dir, cur_dir, f))
             else:
                 click.echo(f'unsupported file {f}')
         if os.path.isdir(p):
             get_all_files(params, out_res, os.path.join(cur_dir, f))
 
-def cli_file_process(input_file, masker, params, app_settings):
+def align_chunks(chunks, filename, dtypes=None):
+    """
+    Reindexes the chunks to a single list of columns, as csv output has a single header.
+    Json records can list their keys in any order or leave keys out.
+    :param dtypes: column to its dtype from scan_columns(), the columns of the first chunk when None
+    """
+    columns = None if dtypes is None else list(dtypes)
+    for chunk in chunks:
+        if columns is None:
+            columns = list(chunk.columns)
+            dtypes = chunk.dtypes
+        elif list(chunk.columns) != columns:
+            known = set(columns)
+            new_columns = [column for column in chunk.columns if column not in known]
+            if new_columns:
+                raise DipException(f'Columns {new_columns} of {filename} are not in its csv header, '
+                                   f'use --output_format json')
+            missing = [column for column in columns if column not in chunk.columns]
+            chunk = chunk.reindex(columns=columns)
+            for column in missing:
+                if dtypes[column] == object:
+                    # filled like the missing values of text columns
+                    chunk[column] = chunk[column].astype(object)
+        yield chunk
+
+
+def cli_file_process(input_file, masker, params, app_settings, pool=None):
     click.echo(f'Starting file processing {input_file.filename}')
     f0 = time()
     if input_file.data is not None:
@@ -466,11 +707,23 @@ def cli_file_process(input_file, masker, params, app_settings):
                 data = [data.read()]
             else:    
                 data = [data]
-        for chunk in data:
-            chunk.fillna(chunk.dtypes.replace({'float64': 0.0, 'O': 'NULL'}), downcast='infer', inplace=True)
-
-            output_data = masker(chunk, no_pd=True, no_output_json=True)
-            output_filename = input_file.save_data_to_file(output_data, params.data.destination_folder, params)
+        elif params.output_format == 'csv':
+            # csv and parquet inputs have the same columns in every chunk
+            dtypes = scan_columns(data) if isinstance(data, (JsonChunksReader, JsonLinesReader)) else None
+            data = align_chunks(data, input_file.filename, dtypes)
+        if pool is not None and input_file.chunked:
+            masked_chunks = mask_chunks_in_pool(data, pool, params.workers, masker)
+        else:
+            masked_chunks = (mask_chunk(chunk, masker) for chunk in data)
+        output_filename = None
+        try:
+            for output_data in masked_chunks:
+                output_filename = input_file.save_data_to_file(output_data, params.data.destination_folder, params)
+            if output_filename is None:
+                # an input without records, e.g. [] or {"records": []}, is saved as an empty output
+                output_filename = input_file.save_data_to_file(DataFrame(), params.data.destination_folder, params)
+        finally:
+            input_file.close_output()
         message = f'File processing COMPLETED into: {output_filename} with time:{time() - f0}'
         click.echo(message)
         app_settings.logger.info(message)
@@ -478,13 +731,63 @@ def cli_file_process(input_file, masker, params, app_settings):
         click.echo(click.style(f"File {input_file.filename} can not be processed", fg="red"))
 
 
-def load_json_to_file_obj(file_object, encodings):
+def load_json_chunks_to_file_obj(file_object, encodings, chunk_size, compression=None):
+    for enc in encodings:
+        reader = JsonChunksReader(file_object.filename, encoding=enc, chunk_size=chunk_size, compression=compression)
+        try:
+            if not reader.probe():
+                click.echo(click.style(f"File {file_object.filename} doesn't contain data", fg="red"))
+                return
+        except Exception as e:
+            click.echo(click.style(f"Failed to read file {file_object.filename}" +
+                                   f" using encoding {enc}. Error: {e}", fg="yellow"))
+            continue
+        file_object.data = reader
+        file_object.chunked = True
+        file_object.encoding = enc
+        return
+
+    click.echo(click.style(f"Failed to read file {file_object.filename}", fg="red"))
+
+
+def load_json_lines_to_file_obj(file_object, encodings, chunk_size, compression=None):
+    for enc in encodings:
+        reader = JsonLinesReader(file_object.filename, encoding=enc, chunk_size=chunk_size or 10000,
+                                 compression=compression)
+        try:
+            reader.probe()
+        except Exception as e:
+            click.echo(click.style(f"Failed to read file {file_object.filename}" +
+                                   f" using encoding {enc}. Error: {e}", fg="yellow"))
+            continue
+        file_object.encoding = enc
+        load_chunks_to_file_obj(file_object, reader, chunked=chunk_size is not None)
+        return
+
+    click.echo(click.style(f"Failed to read file {file_object.filename}", fg="red"))
+
+
+def load_chunks_to_file_obj(file_object, reader, chunked):
+    """
+    Sets a chunks reader as the data of the file, or all its chunks as one DataFrame when not chunked
+    """
+    if not reader.probe():
+        click.echo(click.style(f"File {file_object.filename} doesn't contain data", fg="red"))
+        return
+    if chunked:
+        file_object.data = reader
+        file_object.chunked = True
+    else:
+        file_object.data = pd.concat(list(reader), ignore_index=True)
+
+
+def load_json_to_file_obj(file_object, encodings, compression=None):
     encoding = None
     for enc in encodings:
         try:
-            f = open(file_object.filename, "r", encoding=enc)
-            # Reading from file
-            txt = f.read()
+            with open_input(file_object.filename, compression, 'rt', enc) as f:
+                # Reading from file
+                txt = f.read()
             if len(txt) < 1000:
                 txt = txt.strip()
             if not txt:
@@ -494,6 +797,7 @@ def load_json_to_file_obj(file_object, encodings):
                 txt = txt.encode(encoding)
             data = json.loads(txt)
             encoding = enc
+            file_object.encoding = enc
             break
         except Exception as e:
             click.echo(click.style(f"Failed to read file {file_object.filename}" +
@@ -529,10 +833,11 @@ def cli_file_read(filename, encoding=None, csv_chunk=None, fix_data=False,
     dtype = 'unicode' if set_dtype else None
     on_bad_lines = 'skip' if skip_bad_lines else None
     view_name = os.path.split(filename)[-1]
+    ext, compression = input_extension(filename)
     obj = {
         "selected": True,
         "filename": filename,
-        "ext": filename.split('.')[-1].lower(),
+        "ext": ext,
         "view_name": view_name,
         "is_cli": True
         }
@@ -545,16 +850,28 @@ def cli_file_read(filename, encoding=None, csv_chunk=None, fix_data=False,
         
 
         encodings = get_encodings_list(encoding)
-        supported_extensions = ['csv', 'json']
-        if file_object.ext.lower() not in supported_extensions:
+        supported_extensions = ['csv', 'json', 'parquet', 'jsonl', 'ndjson']
+        if file_object.ext not in supported_extensions:
             raise DipException(f'Unsupported file extension {file_object.ext}. Only {supported_extensions} supported')
+        if compression:
+            if file_object.ext == 'parquet':
+                raise DipException(f'Unsupported compressed file {view_name}, parquet files are compressed internally')
+            Compression(compression).validate()
+        if file_object.ext != 'parquet':
+            # the sniffed encoding is tried first, the others only if the file fails to read with it
+            sniffed = sniff_encoding(filename, encodings, compression=compression)
+            if sniffed is not None:
+                encodings = [sniffed] + [enc for enc in encodings if enc != sniffed]
         try:
 
             if file_object.ext == 'csv':
-                csv_file_name = file_object.filename
-                if fix_data:
-                    csv_file_name = copy_to_fixed_file(file_object.filename, encoding)
                 for enc in encodings:
+                    csv_file_name = file_object.filename
+                    if fix_data:
+                        csv_file_name = CarriageReturnFixer(file_object.filename, encoding=enc, compression=compression)
+                    elif compression:
+                        # older pandas versions do not decompress zstd files
+                        csv_file_name = open_input(file_object.filename, compression, 'rt', enc)
                     try:
                         if 'on_bad_lines' in inspect.getfullargspec(read_csv).args:
                             if csv_chunk is None:
@@ -570,17 +887,28 @@ def cli_file_read(filename, encoding=None, csv_chunk=None, fix_data=False,
                             else:
                                 file_object.data = read_csv(csv_file_name, encoding=enc, chunksize=csv_chunk, dtype=dtype)
                                 file_object.chunked = True
+                        file_object.encoding = enc
                         break
                     except EmptyDataError:
                         click.echo(click.style(f"File {file_object.filename} doesn't contain data", fg="yellow"))
                         return file_object
                     except Exception as e:
+                        if fix_data or compression:
+                            csv_file_name.close()
                         click.echo(click.style(f"Failed to read file {file_object.filename}" +
                                                f" using encoding {enc}, Exception {e}", fg="yellow"))
                 if file_object.data is None:
                     click.echo(click.style(f"Failed to read file {file_object.filename}", fg="red"))
             if file_object.ext == 'json':
-                load_json_to_file_obj(file_object, encodings)
+                if csv_chunk is None:
+                    load_json_to_file_obj(file_object, encodings, compression)
+                else:
+                    load_json_chunks_to_file_obj(file_object, encodings, csv_chunk, compression)
+            if file_object.ext in JSON_LINES_EXTENSIONS:
+                load_json_lines_to_file_obj(file_object, encodings, csv_chunk, compression)
+            if file_object.ext == 'parquet':
+                load_chunks_to_file_obj(file_object, ParquetChunksReader(filename, chunk_size=csv_chunk or 10000),
+                                        chunked=csv_chunk is not None)
 
         except Exception as e:
             click.echo(e.__str__())
@@ -604,6 +932,8 @@ def main(args):
 
 def cli_exec():
     global original_input
+    # masking processes of frozen executables start through the executable itself
+    multiprocessing.freeze_support()
     original_input['args'] = sys.argv
     if len(sys.argv) == 1:
         cli.main(['--help'])
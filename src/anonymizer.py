@@ -0,0 +1,74 @@
+import hashlib
+import hmac
+
+from cli_util import DipException
+
+# Longest key of keyed BLAKE2b, longer keys are hashed to this size first
+BLAKE2B_MAX_KEY_SIZE = 64
+
+
+class Sha256Anonymizer:
+    """
+    Unkeyed sha256 hex digest of the value text, the same value gives the same text for every customer
+    """
+    name = 'sha256'
+
+    def digest(self, data: bytes) -> str:
+        return hashlib.sha256(data).hexdigest()
+
+    def hash_text(self, text: str) -> str:
+        return self.digest(text.encode('utf-8', 'surrogatepass'))
+
+    def hash_many(self, texts) -> list:
+        digest = self.digest
+        return [digest(text.encode('utf-8', 'surrogatepass')) for text in texts]
+
+    def __call__(self, x) -> str:
+        return self.hash_text(str(x))
+
+
+class Blake2bAnonymizer(Sha256Anonymizer):
+    """
+    Keyed BLAKE2b hex digest, values can not be linked without the key
+    """
+    name = 'blake2b'
+
+    def __init__(self, key: bytes, digest_size=32):
+        if len(key) > BLAKE2B_MAX_KEY_SIZE:
+            key = hashlib.blake2b(key).digest()
+        self.key = key
+        self.digest_size = digest_size
+
+    def digest(self, data: bytes) -> str:
+        return hashlib.blake2b(data, key=self.key, digest_size=self.digest_size).hexdigest()
+
+
+class HmacAnonymizer(Sha256Anonymizer):
+    """
+    HMAC-SHA256 hex digest truncated to digest_size bytes
+    """
+    name = 'hmac-sha256'
+
+    def __init__(self, key: bytes, digest_size=32):
+        self.key = key
+        self.digest_size = digest_size
+
+    def digest(self, data: bytes) -> str:
+        return hmac.digest(self.key, data, 'sha256')[:self.digest_size].hex()
+
+
+def create_anonymizer(key='', digest_size=32, use_hmac=False):
+    """
+    :param key: anonymization key, without a key values are hashed with unkeyed sha256
+    :param digest_size: digest bytes of the keyed anonymizers
+    :param use_hmac: HMAC-SHA256 instead of keyed BLAKE2b
+    """
+    if not key:
+        return Sha256Anonymizer()
+    if not 1 <= digest_size <= (32 if use_hmac else 64):
+        raise DipException(f'Bad anonymization digest size {digest_size}, '
+                           f'HMAC-SHA256 supports 1-32 bytes and BLAKE2b 1-64 bytes')
+    key = key.encode('utf-8')
+    if use_hmac:
+        return HmacAnonymizer(key, digest_size)
+    return Blake2bAnonymizer(key, digest_size)
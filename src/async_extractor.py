@@ -0,0 +1,166 @@
+import asyncio
+import json
+from collections import deque
+from time import time
+
+import click
+
+from cli_util import DipAuthException, DipException
+from src.extractor_resource import Extractor
+
+try:
+    import aiohttp
+except ImportError:  # NOSONAR
+    aiohttp = None
+
+
+class AsyncExtractor(Extractor):
+    """
+    Extractor running all the windows on a single asyncio loop.
+    Requests share one aiohttp connection pool and the amount of requests in flight
+    is bounded by --max_connections for the whole extraction.
+    """
+
+    def __init__(self, start_date, end_date, thread_id, app_settings=None,
+                 filter_by_column=None, data_proccessor=None, mask_results=None,
+                 all_dates=False, date_column='', cursor_pagination=False, checkpoint=None):
+        if aiohttp is None:
+            raise DipException('aiohttp package is required for --async_engine')
+        super().__init__(start_date, end_date, thread_id, app_settings,
+                         filter_by_column=filter_by_column, data_proccessor=data_proccessor,
+                         mask_results=mask_results, all_dates=all_dates, date_column=date_column,
+                         cursor_pagination=cursor_pagination, checkpoint=checkpoint)
+        self.semaphore = None
+        # records of the pages in flight in all the windows, they count towards the stop_limit
+        self.records_in_flight = 0
+
+    def extract_windows(self, params, use_user_url, windows):
+        asyncio.run(self.__extract_windows(params, use_user_url, iter(windows)))
+
+    async def __extract_windows(self, params, use_user_url, windows):
+        max_connections = params.extracting.max_connections
+        self.semaphore = asyncio.Semaphore(max_connections)
+        auth = None
+        if not params.extracting.token:
+            auth = aiohttp.BasicAuth(params.extracting.auth.username, params.extracting.auth.password)
+        connector = aiohttp.TCPConnector(limit=max_connections)
+
+        async with aiohttp.ClientSession(connector=connector, headers=params.extracting.headers,
+                                         auth=auth) as http:
+            workers_count = max(1, max_connections // params.extracting.page_concurrency)
+            workers = [self.__window_worker(http, params, use_user_url, windows) for _ in range(workers_count)]
+            await asyncio.gather(*workers)
+
+    async def __window_worker(self, http, params, use_user_url, windows):
+        # windows iterator is shared between the workers, next() is never interrupted by the loop
+        for batch_start_date, batch_end_date in windows:
+            if self.total_added >= params.extracting.stop_limit:
+                break
+            if await self.__extract_window(http, params, use_user_url, batch_start_date, batch_end_date):
+                self.track_progress(batch_start_date, batch_end_date, {'done': True})
+
+    async def __extract_window(self, http, params, use_user_url, batch_start_date, batch_end_date):
+        if self.cursor_pagination and not use_user_url:
+            return await self.__extract_cursor_window(http, params, batch_start_date, batch_end_date)
+
+        batch_size = params.extracting.batch_size
+        pending = deque()
+        offset = self.resume_point(batch_start_date, batch_end_date).get('offset', 0)
+        last_page = False
+
+        try:
+            while True:
+                while not last_page and len(pending) < params.extracting.page_concurrency and \
+                        self.total_added + self.records_in_flight < params.extracting.stop_limit:
+                    url = self.get_request_url(use_user_url, params, batch_start_date, batch_end_date, offset=offset)
+                    offset += batch_size
+                    pending.append((offset, asyncio.ensure_future(self.__fetch_page(http, params, url))))
+                    self.records_in_flight += batch_size
+
+                if not pending:
+                    break
+
+                next_offset, task = pending.popleft()
+                try:
+                    resp_body, response_time = await task
+                except DipException:
+                    self.total_failed += batch_size
+                    raise
+                finally:
+                    # the page is added to total_added before any other window runs
+                    self.records_in_flight -= batch_size
+
+                page_size = len(resp_body['result'])
+                progress = (batch_start_date, batch_end_date, {'offset': next_offset})
+                self.process_results(resp_body['result'], params, response_time, progress)
+                if page_size < batch_size:
+                    last_page = True
+
+        except DipAuthException as e:
+            raise e
+        except aiohttp.ClientConnectionError:
+            click.echo(click.style("Connection error", fg="red"))
+        except Exception:
+            # Trials exceeded for this interval, jump to next interval
+            pass
+        finally:
+            self.records_in_flight -= batch_size * len(pending)
+            for _, task in pending:
+                task.cancel()
+
+        return last_page
+
+    async def __extract_cursor_window(self, http, params, batch_start_date, batch_end_date):
+        # pages of a keyset paginated window depend on each other, only windows run concurrently
+        batch_size = params.extracting.batch_size
+        date_column = self.get_date_column(params)
+        cursor = self.resume_point(batch_start_date, batch_end_date).get('cursor')
+
+        try:
+            while self.total_added < params.extracting.stop_limit:
+                url = self.get_request_url(False, params, batch_start_date, batch_end_date, cursor=cursor)
+                try:
+                    resp_body, response_time = await self.__fetch_page(http, params, url)
+                except DipAuthException:
+                    raise
+                except DipException:
+                    self.total_failed += batch_size
+                    return False
+
+                results = resp_body['result']
+                if results:
+                    cursor = self.get_cursor(results[-1], date_column)
+                progress = (batch_start_date, batch_end_date, {'cursor': cursor})
+                self.process_results(results, params, response_time, progress)
+                if len(results) < batch_size:
+                    return True
+        except aiohttp.ClientConnectionError:
+            click.echo(click.style("Connection error", fg="red"))
+        return False
+
+    async def __fetch_page(self, http, params, url, trial_number=1):
+        async with self.semaphore:
+            t1 = time()
+            async with http.get(url) as resp:
+                if resp.status == 401:
+                    raise DipAuthException('Authentication failure')
+                status = resp.status
+                text = await resp.text()
+            response_time = round(time() - t1, 3)
+
+        try:
+            resp_body = json.loads(text)
+            if status != 200 or 'result' not in resp_body or 'error' in resp_body:
+                raise DipException(str(resp_body.get('error', resp_body)))
+            return resp_body, response_time
+        except Exception as error:
+            if trial_number < self.maximum_trials_number:
+                message = f"Error: Failed fetching from API. Trial: {trial_number} . Info: {error}"
+                self.settings.logger.error(message)
+                print(message)
+                return await self.__fetch_page(http, params, url, trial_number + 1)
+
+            message = f"Error: Totally Failed fetching from API. Trial: {trial_number} . Info: {error}"
+            self.settings.logger.error(message)
+            print(message)
+            raise DipException(message)
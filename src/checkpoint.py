@@ -0,0 +1,110 @@
+import datetime
+import json
+import os
+import threading
+
+from cli_util import DipException
+
+
+class ExtractionCheckpoint:
+    """
+    Journal of the extraction progress, kept in the output directory.
+    It holds the planned windows, the completed windows, the next offset (or cursor) of the
+    partially extracted windows and the written files.
+    Progress is journaled only once its records are written to a file, so a resumed run
+    never skips records that were still in the extractor buffer. Files still written are journaled
+    with their flushed size, a resumed run cuts them to that size, so they hold only journaled records.
+    """
+    FILENAME = 'extracting.checkpoint'
+
+    def __init__(self, output_dir, run):
+        self.path = os.path.join(output_dir, self.FILENAME)
+        self.lock = threading.Lock()
+        self.resumed = False
+        self.state = {'run': run, 'windows': [], 'completed': [], 'progress': {}, 'files': [],
+                      'open_files': {}}
+
+    @staticmethod
+    def window_key(batch_start_date, batch_end_date):
+        return f'{batch_start_date}|{batch_end_date}'
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        with open(self.path, 'r', encoding='utf-8') as f:
+            state = json.load(f)
+        if state.get('run') != self.state['run']:
+            raise DipException(f'Checkpoint {self.path} belongs to a different extraction (url, dates or '
+                               f'pagination changed), remove it or run without --resume')
+        self.state = state
+        self.resumed = True
+        self.close_open_files()
+
+    def close_open_files(self):
+        """
+        Cuts the files of a stopped extraction to their journaled size and finishes them with their
+        closing bytes (the end of a json array), the rest of their windows is extracted to new files
+        """
+        open_files = self.state.get('open_files', {})
+        for filename, journaled in open_files.items():
+            if os.path.isfile(filename):
+                with open(filename, 'r+b') as f:
+                    f.truncate(journaled['size'])
+                    f.seek(journaled['size'])
+                    f.write(bytes.fromhex(journaled['closing']))
+            self.state['files'].append(filename)
+        self.state['open_files'] = {}
+        if open_files:
+            self.save()
+
+    def start(self, windows):
+        self.state['windows'] = [[str(start), str(end)] for start, end in windows]
+        self.save()
+
+    def remaining_windows(self):
+        """
+        Windows that are not completed yet, partially extracted windows first
+        """
+        completed = set(self.state['completed'])
+        progress = self.state['progress']
+        windows = [(start, end) for start, end in self.state['windows']
+                   if self.window_key(start, end) not in completed]
+        windows.sort(key=lambda w: self.window_key(*w) not in progress)
+        return [(datetime.datetime.fromisoformat(start), datetime.datetime.fromisoformat(end))
+                for start, end in windows]
+
+    def window_progress(self, batch_start_date, batch_end_date):
+        with self.lock:
+            return dict(self.state['progress'].get(self.window_key(batch_start_date, batch_end_date), {}))
+
+    def commit(self, progress, filename=None, open_file=None):
+        """
+        :param progress: window key to {'offset': next offset} or {'cursor': [date, sys_id]} or {'done': True}
+        :param filename: closed file holding the records of this progress
+        :param open_file: (filename, flushed size, closing bytes) of the file still written, holding the records
+        of this progress
+        """
+        with self.lock:
+            for key, window_state in progress.items():
+                if window_state.get('done'):
+                    self.state['progress'].pop(key, None)
+                    if key not in self.state['completed']:
+                        self.state['completed'].append(key)
+                elif key not in self.state['completed']:
+                    self.state['progress'][key] = window_state
+            open_files = self.state.setdefault('open_files', {})
+            if open_file:
+                open_filename, size, closing = open_file
+                open_files[open_filename] = {'size': size, 'closing': closing.hex()}
+            if filename:
+                open_files.pop(filename, None)
+                self.state['files'].append(filename)
+            self.save()
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_path, self.path)
@@ -2,18 +2,58 @@ from dataclasses import dataclass
 import os
 import json
 import re
+import sys
+from collections import Counter, OrderedDict
 import click
+import numpy as np
 import pandas as pd
 from hashlib import sha256
+from types import MappingProxyType
 from pandas import read_csv, DataFrame
 from cli_util import DipException
 from src import settings
+from src.anonymizer import Sha256Anonymizer
 
 from flashtext import KeywordProcessor
 
 split_compiled = re.compile(r"\n|\s")
 
 WORDS_REGEX = r'([^(\s:)])+'
+# Words that contain one of these can be changed by the built-in detectors, other words are kept as is
+CANDIDATE_WORDS_REGEX = r'(?<![^(\s:)])[^(\s:)]*?(?:[\d@\x00-\x08\x0e-\x1b]|(?i:www\.))[^(\s:)]*'
+
+PHONE_REGEX = (
+    r'\+[0-9]{5,}|\+[0-9\.\ (\)-]{6,25}|\+[0-9(\)-]{1,6}[\ \.][0-9(\)\ \.-]{4,}|'
+    r'\d{3}-\d{2}-\d{5,7}|'
+    r'\+*\d{1,10}\ +\d{1,10}\S*|'
+    r'\+\d{2,4} \d{2,5} \d{2,7} \(?\d{2,4}\)?|'
+    r'\+\d{2,4} \d{1,5} \d{2,7} \d{1,7} (\d{1,7})?|'
+    r'\+\d{2,4} \d{1,5} \d{2,7}( \d{1,7})?( \d{1,7})?|'
+    r'\+?\(?\+?\d{1,3}\)?[-\s]\d{1,3}[-\s]\d{1,4}|'
+    r'\+?\(?\+?\d{1,3}\)?[-\s]\d{1,3}[-\s]\d{1,4}[-\s]\d{1,4}|'
+    r'\+\d{2,4} \(?\d{1,4}\)? \d{1,4}|'
+    r'\d{2,4}[-\s]\d{2,4}[-\s]\d{2,4}([-\s]\d{2,4})?')
+URL_REGEX = r'(http[s]?://(www\.)?|www\.)\S+'
+CC_REGEX = r'\d{3,4}-\d{3,4}-\d{3,4}-\d{3,4}'
+IP_REGEX = r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}'
+EMAIL_REGEX = r'[\w\-.]+@[\w\-.]+'
+SPECIAL_REGEX = r'[\x00-\x1f]'
+NUMBERS_REGEX = r'\b\d{6,}\b'
+SPACE_REGEX = r'\s+'
+SSN_REGEX = r'\b([a-z]*)(\d{3}[-_\.]\d{2}[-_\.]\d{4})([a-z]*)\b'
+
+# Built-in word detectors by precedence, the first detector found in the word sets its replacement
+WORD_DETECTORS = [
+    ('special', SPECIAL_REGEX, ''),
+    ('ssn', SSN_REGEX, '\1 <#SSN> \3'),
+    ('ip', IP_REGEX, ' <#I> '),
+    ('url', f'(?i:{URL_REGEX})', ' <#U> '),
+    ('cc', CC_REGEX, ' <#CC> '),
+    ('email', EMAIL_REGEX, ' <#M> '),
+    ('phone', PHONE_REGEX, ' <#P> '),
+    ('numbers', NUMBERS_REGEX, ' <#> '),
+    ('space', SPACE_REGEX, ' '),
+]
 MA_MARK = '<#MASKING_ERROR>'
 USER_CUSTOM = '<#USER_CUSTOM>'
 
@@ -22,6 +62,13 @@ ANONYMIZE: int = 1
 DROP: int = 3
 FILTER_BY_WHITE_LIST = 4
 
+# Distinct anonymized values kept across chunks and files
+ANONYMIZE_CACHE_SIZE = 2 ** 16
+# Columns of these types are anonymized per distinct value, equal values of them always have the same text
+FACTORIZE_DTYPES = ('string', 'integer', 'floating', 'boolean', 'empty')
+# Longer texts are rarely repeated, they are masked without the masking cache
+MASK_CACHE_MAX_ENTRY = 4096
+
 class UnsupportedFile(Exception):
     """Raised when CustomUserFile selected unsupported type"""
     pass
@@ -150,40 +197,49 @@ class TextCleaner:
     def __init__(self, custom_tokens_filename_list: None, 
                 important_token_file=None,
                 encodings=None, patterns=None,
-                preprocess_patterns=False):
+                preprocess_patterns=False, mask_cache_size=0, anonymizer=None):
         """
         Cleaner Class
         compiling regexes and custom tokens file.
+        :param mask_cache_size: bytes of masked texts kept between chunks, 0 disables the cache
+        :param anonymizer: hashes the anonymized values, unkeyed sha256 by default
         """
         self.user_patterns = self.create_user_patterns(patterns)
         self._custom_tokens_chunk = None
         self._flashtext_names = KeywordProcessor(case_sensitive=False)
         self.preprocess_patterns=preprocess_patterns
 
-        self.__phone = re.compile(
-            r'\+[0-9]{5,}|\+[0-9\.\ (\)-]{6,25}|\+[0-9(\)-]{1,6}[\ \.][0-9(\)\ \.-]{4,}|'
-            r'\d{3}-\d{2}-\d{5,7}|'
-            r'\+*\d{1,10}\ +\d{1,10}\S*|'
-            r'\+\d{2,4} \d{2,5} \d{2,7} \(?\d{2,4}\)?|'
-            r'\+\d{2,4} \d{1,5} \d{2,7} \d{1,7} (\d{1,7})?|'
-            r'\+\d{2,4} \d{1,5} \d{2,7}( \d{1,7})?( \d{1,7})?|'
-            r'\+?\(?\+?\d{1,3}\)?[-\s]\d{1,3}[-\s]\d{1,4}|'
-            r'\+?\(?\+?\d{1,3}\)?[-\s]\d{1,3}[-\s]\d{1,4}[-\s]\d{1,4}|'
-            r'\+\d{2,4} \(?\d{1,4}\)? \d{1,4}|'
-            r'\d{2,4}[-\s]\d{2,4}[-\s]\d{2,4}([-\s]\d{2,4})?')
-
-        self.__url = re.compile(r"(http[s]?://(www\.)?|www\.)\S+", re.IGNORECASE)
+        # every phone alternative starts with one of +(\d, the lookahead skips other positions at once
+        self.__phone = re.compile(rf'(?=[+(\d])(?:{PHONE_REGEX})')
+
+        self.__url = re.compile(URL_REGEX, re.IGNORECASE)
         # self.__catalog = re.compile(r'\b(\d+[a-zA-Z]|[a-zA-Z]+\d)[\w\-\_\!\?\.\#\$\%\^\&\*\.\(\)\\\/]+\b')
 
-        self.__cc = re.compile(r'\d{3,4}-\d{3,4}-\d{3,4}-\d{3,4}')
-        self.__ip = re.compile(r'\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}')
-        self.__email = re.compile(r'[\w\-.]+@[\w\-.]+', re.UNICODE)
-        self.__special = re.compile(r'[\x00-\x1f]', re.UNICODE)
-        self.__numbers = re.compile(r'\b\d{6,}\b')
-        self.__space = re.compile(r'\s+')
-        self.__ssn = re.compile(r'\b([a-z]*)(\d{3}[-_\.]\d{2}[-_\.]\d{4})([a-z]*)\b')
+        self.__cc = re.compile(CC_REGEX)
+        self.__ip = re.compile(IP_REGEX)
+        self.__email = re.compile(EMAIL_REGEX, re.UNICODE)
+        self.__special = re.compile(SPECIAL_REGEX, re.UNICODE)
+        self.__numbers = re.compile(NUMBERS_REGEX)
+        self.__space = re.compile(SPACE_REGEX)
+        self.__ssn = re.compile(SSN_REGEX)
+
+        # All the detectors in a single pass: every alternative looks ahead for its detector anywhere
+        # in the word and the alternatives are tried by precedence, so the match names the winning detector
+        self.__detectors = re.compile('|'.join(f'(?=.*?(?P<{name}>{regex}))' for name, regex, _ in WORD_DETECTORS),
+                                      re.DOTALL)
+        self.__replacements = {name: replacement for name, _, replacement in WORD_DETECTORS}
+        # User patterns can match any word, with them every word is a candidate
+        if self.user_patterns and not self.preprocess_patterns:
+            self.__words = re.compile(WORDS_REGEX)
+        else:
+            self.__words = re.compile(CANDIDATE_WORDS_REGEX)
 
-        self.__words = re.compile(WORDS_REGEX)
+        self.anonymizer = anonymizer or Sha256Anonymizer()
+        self.__anonymized = OrderedDict()
+        self.anonymize_stats = Counter()
+        self.mask_cache_size = mask_cache_size
+        self.__mask_cache = OrderedDict()
+        self.__mask_cache_bytes = 0
 
         self.__custom_tokens = None
         self.custom_tokens_list = set()
@@ -243,26 +299,9 @@ class TextCleaner:
         try:
             src = match.group()
             x = src.strip()
-            if self.__special.search(x):
-                return ''
-            if self.__ssn.search(x):
-                return '\1 <#SSN> \3'
-            if self.__ip.search(x):
-                return ' <#I> '
-            if self.__url.search(x):
-                return ' <#U> '
-            if self.__cc.search(x):
-                return ' <#CC> '
-            if self.__email.search(x):
-                return ' <#M> '
-            if self.__phone.search(x):
-                return ' <#P> '
-            # if self.__catalog.search(x):
-            #     return ' <#CG> '
-            if self.__numbers.search(x):
-                return ' <#> '
-            if self.__space.search(x):
-                return ' '
+            detected = self.__detectors.match(x)
+            if detected:
+                return self.__replacements[detected.lastgroup]
             if not self.preprocess_patterns:
                 for pattern, replace in self.user_patterns:
                     if pattern.search(x):
@@ -295,57 +334,162 @@ class TextCleaner:
 
     def transform(self, data: list) -> list:
         try:
-            return list(map(lambda x: self.clean_custom_tokens_chunk(x), data))
+            return self.__transform_distinct(data)
         except Exception as e:
             click.echo(click.style(f"There was an Error while masking {e}", fg="red"))
         return data
 
-    def __cond_masker(self, item):
-        d, method = item
-        if method == MASK:
-            return self.clean_custom_tokens_chunk(d)
-        if method == ANONYMIZE:
-            return sha256(str(d).encode('utf-8')).hexdigest()
-        if method == DROP:
-            return None
-        return d
-
-    def condition_clean(self, df, cond_methos, column):
-        data = []
-        for index, row in df.iterrows():
-            method = None
-            for xx in cond_methos:
-                cond_metho:MethodCondition = xx
-                if row.get(cond_metho.col_name) == cond_metho.val:
-                    method = cond_metho.method
-                    break
-            data.append((row[column], method))
+    def __transform_distinct(self, data, no_clean=None):
+        """
+        Masks every distinct text of the chunk once
+        """
+        texts = [str(x) for x in data]
+        if no_clean is None:
+            distinct = dict.fromkeys(texts)
+        else:
+            distinct = dict.fromkeys(x for x, skip in zip(texts, no_clean) if not skip)
+        clean = self.clean_custom_tokens_chunk if not self.mask_cache_size else self.__clean_cached
+        for x in distinct:
+            distinct[x] = clean(x)
 
-        return list(map(self.__cond_masker, data))
+        if no_clean is None:
+            return [distinct[x] for x in texts]
+        return [x if skip else distinct[x] for x, skip in zip(texts, no_clean)]
+
+    def __clean_cached(self, x):
+        if len(x) > MASK_CACHE_MAX_ENTRY:
+            return self.clean_custom_tokens_chunk(x)
+        cache = self.__mask_cache
+        if x in cache:
+            cache.move_to_end(x)
+            return cache[x]
+
+        masked = cache[x] = self.clean_custom_tokens_chunk(x)
+        self.__mask_cache_bytes += sys.getsizeof(x) + sys.getsizeof(masked)
+        while self.__mask_cache_bytes > self.mask_cache_size and cache:
+            key, value = cache.popitem(last=False)
+            self.__mask_cache_bytes -= sys.getsizeof(key) + sys.getsizeof(value)
+        return masked
 
-    @staticmethod
-    def anonymize_value(x):
+    def condition_clean(self, df, cond_methos, column):
+        """
+        Applies to every row the method of the first condition it matches.
+        Conditions are evaluated as boolean masks over the condition columns and every method
+        is applied once to its subset of rows, rows without a matching condition are kept as is
+        """
+        values = df[column].to_numpy(dtype=object)
+        row_methods = np.full(len(values), np.nan)
+        unresolved = np.ones(len(values), dtype=bool)
+        for cond_metho in cond_methos:
+            if not unresolved.any():
+                break
+            if cond_metho.col_name not in df:
+                continue
+            matched = unresolved & (df[cond_metho.col_name].to_numpy(dtype=object) == cond_metho.val)
+            row_methods[matched] = cond_metho.method
+            unresolved &= ~matched
+
+        result = values.copy()
+        cond_maskers = ((MASK, self.clean_custom_tokens_chunk),
+                        (ANONYMIZE, self.anonymize_value),
+                        (DROP, lambda d: None))
+        for method, cond_masker in cond_maskers:
+            rows = np.flatnonzero(row_methods == method)
+            if len(rows):
+                result[rows] = [cond_masker(d) for d in values[rows]]
+        return result.tolist()
+
+    def anonymize_value(self, x):
         try:
-            return sha256(str(x).encode('utf-8')).hexdigest()
+            return self.anonymizer(x)
         except Exception as e:
             click.echo(click.style(f"There was an Error while anonymizing {x}", fg="red"))
         return 'anonymizing_error'
 
     def anonymize(self, data: list, no_clean=None) -> list:
+        try:
+            if pd.api.types.infer_dtype(data, skipna=True) in FACTORIZE_DTYPES:
+                return self.__anonymize_distinct(data, no_clean)
+        except Exception as e:
+            click.echo(click.style(f"There was an Error while anonymizing {e}", fg="red"))
+            return data
+
         if no_clean is None:
-            return list(map(lambda x: TextCleaner.anonymize_value(x) if x and not pd.isna(x) and x != 'nan' else x, data))
+            return list(map(lambda x: self.anonymize_value(x) if x and not pd.isna(x) and x != 'nan' else x, data))
         try:
-            return list(map(lambda x: TextCleaner.anonymize_value(x[1]) if x[1] and not pd.isna(x[1]) and x[1] != 'nan' and not no_clean[x[0]] else x[1], enumerate(data)))
+            return list(map(lambda x: self.anonymize_value(x[1])
+                            if x[1] and not pd.isna(x[1]) and x[1] != 'nan' and not no_clean[x[0]] else x[1],
+                            enumerate(data)))
         except Exception as e:
             click.echo(click.style(f"There was an Error while anonymizing {e}", fg="red"))
 
         return data
 
+    def __anonymize_distinct(self, data, no_clean):
+        """
+        Hashes every distinct value of the column once, through the LRU shared by all the chunks
+        """
+        codes, uniques = pd.factorize(data)
+        rows = codes >= 0
+        if no_clean is not None:
+            rows &= ~np.asarray(no_clean, dtype=bool)
+
+        texts = {x: str(x) for x in uniques if x and x != 'nan'}
+        hashes = self.__anonymize_texts(set(texts.values()))
+        anonymized = np.empty(len(uniques), dtype=object)
+        anonymized[:] = [hashes[texts[x]] if x in texts else x for x in uniques]
+        self.anonymize_stats.update(values=int(rows.sum()))
+
+        result = np.asarray(data, dtype=object).copy()
+        result[rows] = anonymized[codes[rows]]
+        return result.tolist()
+
+    def __anonymize_texts(self, texts):
+        """
+        :return: text to hash for the given distinct texts, the texts missing from the LRU are hashed in one batch
+        """
+        cache = self.__anonymized
+        hashes = {}
+        missing = []
+        for text in texts:
+            if text in cache:
+                cache.move_to_end(text)
+                hashes[text] = cache[text]
+            else:
+                missing.append(text)
+        try:
+            hashed = self.anonymizer.hash_many(missing)
+        except Exception as e:
+            click.echo(click.style(f"There was an Error while anonymizing {e}", fg="red"))
+            hashed = [self.anonymize_value(text) for text in missing]
+
+        for text, value in zip(missing, hashed):
+            hashes[text] = cache[text] = value
+        while len(cache) > ANONYMIZE_CACHE_SIZE:
+            cache.popitem(last=False)
+        self.anonymize_stats.update(hits=len(hashes) - len(missing), misses=len(missing))
+        return hashes
+
+    def take_anonymize_stats(self):
+        """
+        Returns the anonymization counters collected since the last call
+        """
+        stats, self.anonymize_stats = self.anonymize_stats, Counter()
+        return stats
+
+    def anonymize_summary(self):
+        stats = self.anonymize_stats
+        lookups = stats['hits'] + stats['misses']
+        if not lookups:
+            return None
+        return f'Anonymized {stats["values"]} values, {lookups} distinct per chunk, ' \
+               f'cache hit rate {stats["hits"] / lookups:.1%}'
+
     def transform_with_condition(self, data, no_clean=None):
         if no_clean is None:
             return self.transform(data)
 
-        return [self.clean_custom_tokens_chunk(x, no_clean[i]) for i, x in enumerate(data)]
+        return self.__transform_distinct(data, no_clean)
 
     def is_custom_loaded(self) -> bool:
         return bool(self.__custom_tokens)
@@ -381,17 +525,48 @@ class MethodCondition:
     val:object
 
 
+@dataclass(frozen=True)
+class ColumnPlan:
+    """
+    Masking plan of a single column, compiled once from its mapping file row
+    """
+    method: object = None
+    cond_methods: tuple = ()
+    conditions: tuple = ()
+    white_list_values: tuple = None
+    error: str = None
+
+
+NO_COLUMN_PLAN = ColumnPlan()
+
+# Compiled mapping plans by mapping file hash, shared by all the maskers of the process
+MAPPING_PLANS = {}
+
+
 class Masker:
     def __init__(self, cleaner, params, mapping_file, custom_tokens_filename_list, anonymize_value, 
                  mask_value, drop_value):
         self.cleaner: TextCleaner = cleaner
-        self.mapping_file = self.__update_auto(mapping_file)
+        self.mapping_file = mapping_file
+        self.plan = self.__get_plan(mapping_file)
         self.custom_tokens_filename_list = custom_tokens_filename_list
         self.methods = {'ANONYMIZE': anonymize_value,
                         'MASK': mask_value,
                         'DROP': drop_value}
         self.params = params
-    
+
+    def __get_plan(self, mapping_file):
+        if mapping_file.filename == '' or \
+                mapping_file.data is None or \
+                'column' not in mapping_file.data:
+            return MappingProxyType({})
+
+        with open(mapping_file.filename, 'rb') as f:
+            key = sha256(f.read()).hexdigest()
+        if key not in MAPPING_PLANS:
+            MAPPING_PLANS[key] = self.__compile_plan(self.__update_auto(mapping_file).data)
+        return MAPPING_PLANS[key]
+
     def __update_auto(self, mapping_file):
         df = mapping_file.data
         auto_indices = []
@@ -407,11 +582,53 @@ class Masker:
             df.at[index,'method'] = auto_method
         return mapping_file
 
+    def __compile_plan(self, mapping):
+        """
+        Compiles the mapping rows into an immutable {column: ColumnPlan} mapping.
+        Bad rows are kept as plans with an error, raised only if the column is masked
+        """
+        has_condition = 'condition' in mapping
+        plan = {}
+        for column, rows in mapping.groupby('column', sort=False):
+            if len(rows) > 1:
+                plan[column] = ColumnPlan(error=f'Column {column} appears more than once in the mapping file')
+                continue
+            method = rows['method'].iloc[0]
+            if method is None:
+                continue
+            condition = rows['condition'].iloc[0] if has_condition else None
+            plan[column] = self.__compile_column(column, method, condition)
+        return MappingProxyType(plan)
+
+    def __compile_column(self, column, method, condition):
+        white_list_values = None
+        if method == FILTER_BY_WHITE_LIST:
+            if not isinstance(condition, str):
+                return ColumnPlan(error=f'Bad white list condition for column {column}')
+            white_list_values = tuple(condition.split(' '))
+            condition = None
+
+        cond_methods = ()
+        try:
+            method = float(method)
+        except:
+            try:
+                cond_methods = tuple(self.__get_condition_method(method, column))
+            except DipException as e:
+                return ColumnPlan(error=str(e))
+
+        conditions = ()
+        if condition and not pd.isna(condition) and condition != 'nan':
+            parts = [p.strip() for p in condition.split('|') if p.strip()]
+            conditions = tuple(tuple(part.split('=')) for part in parts)
+
+        return ColumnPlan(method=method, cond_methods=cond_methods, conditions=conditions,
+                          white_list_values=white_list_values)
+
     def __call__(self, items, no_pd=False, no_output_json=False):
         if not no_pd and not items:
             return items
 
-        mapping_file = self.mapping_file
         cleaner = self.cleaner
         if no_pd:
             output_data = items
@@ -419,41 +636,45 @@ class Masker:
             output_data = pd.json_normalize(items)
         methods = self.methods
 
-        output_data = self.__filter_rows(output_data, mapping_file)
+        output_data = self.__filter_rows(output_data)
 
         for column in output_data:
-            self.__process_col(output_data, mapping_file, column, methods, cleaner)
+            self.__process_col(output_data, column, methods, cleaner)
 
         if no_output_json:
             return output_data
 
         return output_data.to_dict(orient="records")
 
-    def __filter_rows(self, input_data, mapping_file):
-        if mapping_file.filename != '' and \
-                mapping_file.data is not None and \
-                'column' in mapping_file.data:
-            for column in input_data:
-                
-                if column in mapping_file.data['column'].to_list() and \
-                    mapping_file.data[mapping_file.data['column'] == column]['method'].item() is not None:
-
-                    data = mapping_file.data[mapping_file.data['column'] == column]
-                    
-                    method = data['method'].item()
-                    condition = data['condition'].item()
-                    if method == FILTER_BY_WHITE_LIST:
-                        values = condition.split(' ')
-                        cond = None
-                        for i, val in enumerate(values):
-                            if i == 0:
-                                cond = (input_data[column] == values[i])
-                            else:
-                                cond = cond | (input_data[column] == values[i])
-                        input_data = input_data[cond]
-                input_data[column] = input_data[column].apply(lambda x: int(x) if type(x) == float and int(x) == x else x)
+    def __filter_rows(self, input_data):
+        white_lists = [(column, self.plan[column].white_list_values) for column in input_data
+                       if self.plan.get(column, NO_COLUMN_PLAN).white_list_values is not None]
+        if white_lists:
+            keep = np.ones(len(input_data), dtype=bool)
+            for column, values in white_lists:
+                keep &= input_data[column].isin(values).to_numpy()
+            input_data = input_data[keep].copy()
+
+        for column in input_data:
+            input_data[column] = self.__normalize_integral_floats(input_data[column])
         return input_data
 
+    @staticmethod
+    def __normalize_integral_floats(values):
+        """
+        Integral floats (1.0) are written as ints, only float and mixed object columns can hold them
+        """
+        if pd.api.types.is_float_dtype(values.dtype):
+            # a float column is turned to ints only when all its values are integral
+            data = values.to_numpy()
+            if len(data) and (np.isfinite(data) & (np.floor(data) == data) & (np.abs(data) < 2 ** 63)).all():
+                return values.astype('int64')
+            return values
+        if values.dtype == object and \
+                pd.api.types.infer_dtype(values, skipna=True) not in ('string', 'integer', 'boolean', 'empty'):
+            return values.apply(lambda x: int(x) if type(x) == float and np.isfinite(x) and int(x) == x else x)
+        return values
+
     def __get_condition_method(self, m, col):
         if not m:
             raise DipException(f'Bad conditional method for column {col}')
@@ -466,38 +687,19 @@ class Masker:
                 res.append(MethodCondition(float(method), key, f))
         return res
 
-    def __process_col(self, output_data, mapping_file, column, methods, cleaner):
-        method = None
-        condition = None
-        if mapping_file.filename != '' and \
-                mapping_file.data is not None and \
-               'column' in mapping_file.data and \
-                column in mapping_file.data['column'].to_list() and \
-                mapping_file.data[mapping_file.data['column'] == column]['method'].item() is not None:
-
-            data = mapping_file.data[mapping_file.data['column'] == column]
-            method = mapping_file.data[mapping_file.data['column'] == column]['method'].item()
-            if method != FILTER_BY_WHITE_LIST and 'condition' in data:
-                condition = data['condition'].item()
-
-        cond_method = None
-        if method is not None:
-            try:
-                method = float(method)
-            except:
-                cond_method = self.__get_condition_method(method, column)
+    def __process_col(self, output_data, column, methods, cleaner):
+        plan = self.plan.get(column, NO_COLUMN_PLAN)
+        if plan.error:
+            raise DipException(plan.error)
+        method = plan.method
+        cond_method = plan.cond_methods
 
-        conditions = []
-        if condition and not pd.isna(condition) and condition != 'nan':
-            parts = [p.strip() for p in condition.split('|') if p.strip()]
-            for part in parts:
-                conditions.append(part.split('='))
         no_clean = None
-        if conditions:
+        if plan.conditions:
             all_column = output_data[column].values
             # if condition provided, set default to not applying it (no_clean) until we found that condition is truly
             no_clean = [True] * len(all_column)
-            for condition in conditions:
+            for condition in plan.conditions:
                 c_column, val = condition
                 val = str(val)
                 c_data = output_data[c_column].values
@@ -0,0 +1,184 @@
+import gzip
+import io
+import os
+import threading
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+from cli_util import DipException
+
+try:
+    import zstandard
+except ImportError:  # NOSONAR
+    zstandard = None
+
+COMPRESSION_EXTENSIONS = {'gzip': '.gz', 'zstd': '.zst'}
+# Codecs of the compressed input extensions
+INPUT_COMPRESSIONS = {'gz': 'gzip', 'zst': 'zstd'}
+# Level used when the level is 0
+DEFAULT_LEVELS = {'gzip': 6, 'zstd': 3}
+MAX_LEVELS = {'gzip': 9, 'zstd': 22}
+# Uncompressed bytes of a compressed member (gzip member or zstd frame)
+BLOCK_SIZE = 1 << 20
+
+
+@dataclass(frozen=True)
+class Compression:
+    """
+    Codec of the --compress output files
+    """
+    codec: str = 'gzip'
+    level: int = 0
+    workers: int = 0
+
+    @staticmethod
+    def from_params(params):
+        """
+        :return: the compression of the --compress, --compress_codec, --compress_level and
+        --compress_workers parameters, None without --compress
+        """
+        if not getattr(params, 'compress', False):
+            return None
+        compression = Compression(getattr(params, 'compress_codec', '') or 'gzip',
+                                  getattr(params, 'compress_level', 0) or 0,
+                                  getattr(params, 'compress_workers', 0) or 0)
+        compression.validate()
+        return compression
+
+    def validate(self):
+        if self.codec not in COMPRESSION_EXTENSIONS:
+            raise DipException(f'Unsupported compression codec {self.codec}. '
+                               f'Only {list(COMPRESSION_EXTENSIONS)} supported')
+        if self.codec == 'zstd' and zstandard is None:
+            raise DipException('zstandard package is required for zstd compression')
+        if not 0 <= self.level <= MAX_LEVELS[self.codec]:
+            raise DipException(f'Bad {self.codec} compression level {self.level}, '
+                               f'use 1-{MAX_LEVELS[self.codec]} or 0 for the default level')
+
+    @property
+    def extension(self):
+        return COMPRESSION_EXTENSIONS[self.codec]
+
+
+def as_compression(compress):
+    """
+    :param compress: a Compression, True for the default gzip compression or False
+    """
+    if isinstance(compress, Compression):
+        return compress
+    return Compression() if compress else None
+
+
+class BlockCompressor(io.RawIOBase):
+    """
+    Binary file that compresses blocks of BLOCK_SIZE bytes in parallel, each block is an independent
+    gzip member or zstd frame, so the file is a valid concatenation that every reader decompresses.
+    The blocks wait for compression in a bounded queue, so writing is decoupled from compressing
+    and only a few blocks are kept in memory. Blocks are written in their original order.
+    """
+
+    def __init__(self, filename, compression: Compression, block_size=BLOCK_SIZE):
+        super().__init__()
+        compression.validate()
+        self.name = filename
+        self.compression = compression
+        self.level = compression.level or DEFAULT_LEVELS[compression.codec]
+        self.block_size = block_size
+        workers = compression.workers or os.cpu_count() or 1
+        # zlib and zstandard release the GIL while compressing
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='compress')
+        self.max_pending = workers * 2
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.local = threading.local()
+        self.file = open(filename, 'wb')
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.__submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        """
+        Compresses the buffered bytes as a block and waits for all blocks to be written
+        """
+        if self.closed:
+            return
+        if self.buffer:
+            self.__submit(bytes(self.buffer))
+            self.buffer.clear()
+        while self.pending:
+            self.file.write(self.pending.popleft().result())
+        self.file.flush()
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            # flushes the last block
+            super().close()
+        finally:
+            self.executor.shutdown(wait=True)
+            self.file.close()
+
+    def __submit(self, block):
+        while len(self.pending) >= self.max_pending or (self.pending and self.pending[0].done()):
+            self.file.write(self.pending.popleft().result())
+        self.pending.append(self.executor.submit(self.__compress, block))
+
+    def __compress(self, block):
+        if self.compression.codec == 'zstd':
+            # zstd compressors are not thread safe, one per compressing thread
+            compressor = getattr(self.local, 'compressor', None)
+            if compressor is None:
+                compressor = self.local.compressor = zstandard.ZstdCompressor(level=self.level)
+            return compressor.compress(block)
+        return compress_block(block, self.compression)
+
+
+def compress_block(data, compression: Compression):
+    """
+    :return: data as a single gzip member or zstd frame, it can be appended to a compressed file
+    """
+    level = compression.level or DEFAULT_LEVELS[compression.codec]
+    if compression.codec == 'zstd':
+        return zstandard.ZstdCompressor(level=level).compress(data)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def open_compressed_output(filename, compression: Compression, encoding=None, newline=None):
+    """
+    :return: a parallel compressing binary file, or a text file when encoding is given
+    """
+    raw = BlockCompressor(filename, compression)
+    if encoding is None:
+        return raw
+    return io.TextIOWrapper(raw, encoding=encoding, newline=newline)
+
+
+def compressed_filename(filename, compression):
+    return filename + compression.extension if compression else filename
+
+
+def open_input(filename, compression=None, mode='rb', encoding=None):
+    """
+    Opens an input file, decompressing it while it is read
+    :param compression: gzip, zstd or None for an uncompressed file
+    """
+    if compression == 'gzip':
+        return gzip.open(filename, mode, encoding=encoding)
+    if compression == 'zstd':
+        if zstandard is None:
+            raise DipException(f'zstandard package is required for reading {filename}')
+        # reads across the frames of concatenated blocks
+        return zstandard.open(filename, mode, encoding=encoding)
+    return open(filename, mode, encoding=encoding)
+
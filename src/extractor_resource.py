@@ -1,26 +1,49 @@
 import click
 import re
-from urllib.parse import urlparse
-from urllib.parse import parse_qs
+from urllib.parse import urlparse, urlunparse, urlencode, quote
+from urllib.parse import parse_qs, parse_qsl
 import requests
+from requests.adapters import DEFAULT_POOLSIZE, HTTPAdapter
 import datetime
 import os
 import json
-import gzip
+import queue
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from zipfile import ZipFile
 from time import time
 from requests.auth import HTTPBasicAuth
 from requests.exceptions import ConnectionError
 import getpass
-import pandas as pd
 
 from cli_util import DipAuthException, DipException
+from src.compression import Compression, compressed_filename, open_input
+from src.readers import JSON_LINES_EXTENSIONS, input_extension
+from src.writers import COLUMNAR_FORMATS, ColumnarWriter, CsvStreamWriter, JsonArrayWriter, JsonLinesWriter
+
+# Seconds between journaling the pages of a file that is still written
+CHECKPOINT_INTERVAL = 10
+
+
+def iterate_date_windows(start_date, end_date, interval):
+    """
+    Splits the period into consecutive windows of interval hours, the last window ends at end_date.
+    An empty period produces a single empty window.
+    """
+    interval = datetime.timedelta(hours=interval)
+    batch_start_date = start_date
+    while True:
+        batch_end_date = min(batch_start_date + interval, end_date)
+        yield batch_start_date, batch_end_date
+        batch_start_date = batch_start_date + interval
+        if batch_start_date >= end_date:
+            break
 
 
 class Extractor:
     def __init__(self, start_date, end_date, thread_id, app_settings=None,
                  filter_by_column=None, data_proccessor=None, mask_results=None,
-                 all_dates=False, date_column=''):
+                 all_dates=False, date_column='', cursor_pagination=False, checkpoint=None):
 
         if (start_date == '-' or end_date == '-') and not all_dates:
             raise DipException('If --start_date or --end_date is not provides --all_date should be specified')
@@ -31,16 +54,22 @@ class Extractor:
             end_date = datetime.datetime.now()
         self.settings = app_settings
         self.session = requests.Session()
+        self.pool_size = DEFAULT_POOLSIZE
 
         self.total_added = 0
         self.total_failed = 0
         self.offset = 0
-        self.total_results = []
+        self.writer = None
         self.response_size = 0
         self.maximum_trials_number = 2
         self.thread_params = None
         self.all_dates = all_dates
         self.date_column = date_column
+        self.cursor_pagination = cursor_pagination
+        self.checkpoint = checkpoint
+        self.pending_progress = {}
+        self.checkpoint_interval = CHECKPOINT_INTERVAL
+        self.last_commit = time()
 
         self.start_date = start_date
         self.end_date = end_date
@@ -49,12 +78,11 @@ class Extractor:
         self.mask_results = mask_results
         self.data_proccessor = data_proccessor
 
-    def api_extract(self, params):
+    def api_extract(self, params, work_queue=None):
         """
-        :param url:
-        :param start_date:
-        :param end_date:
-        :param batch_size:
+        :param params:
+        :param work_queue: optional queue of (start_date, end_date) windows shared between extractors,
+            if not provided the extractor walks its own period in --interval hours windows
         :return:
         """
 
@@ -64,38 +92,19 @@ class Extractor:
             print(message)
             self.settings.logger.info(message)
 
-            params.extracting.headers = {
-                'Content-type': 'application/json'
-            }
-
-            if params.extracting.token:
-                token = params.extracting.token
-                params.extracting.headers['cookie'] = f'glide_user_activity={token}'
-
-            self.__setup_auth(params)
-
-            batch_start_date = self.start_date
-            batch_end_date = batch_start_date + datetime.timedelta(hours=params.extracting.interval)
-            formated_url = params.extracting.url.format(
-                start_date=f'{batch_start_date}',
-                end_date=f'{batch_end_date}',
-                custom=''
-            )
-            use_user_url = formated_url != params.extracting.url
-            while self.total_added < params.extracting.stop_limit and (batch_start_date < batch_end_date or self.all_dates):
-
-                if batch_end_date >= self.end_date:
-                    batch_end_date = self.end_date
+            self.setup_request(params)
+            use_user_url = self.__is_user_url(params)
+            if self.cursor_pagination and use_user_url:
+                message = 'Cursor pagination is not supported with user formatted url, using offset pagination'
+                self.settings.logger.info(message)
+                click.echo(click.style(message, fg="yellow"))
 
-                self.response_size = params.extracting.batch_size
-                self.offset = 0
+            if work_queue is None:
+                windows = self.__iterate_windows(params)
+            else:
+                windows = self.__iterate_queue(work_queue)
 
-                self.__do_step(params, use_user_url, batch_start_date, batch_end_date)
-                if self.all_dates:
-                    #  If no dates specifiyed do only one step
-                    break
-                batch_start_date = batch_start_date + datetime.timedelta(hours=params.extracting.interval)
-                batch_end_date = batch_end_date + datetime.timedelta(hours=params.extracting.interval)
+            self.extract_windows(params, use_user_url, windows)
         except DipAuthException as e:
             raise e
         except KeyboardInterrupt:
@@ -108,24 +117,124 @@ class Extractor:
             print(message)
         finally:
 
-            # Save to file if any data is in buffer
-            if len(self.total_results) > 0:
-                self.save_data_to_file(self.total_results, params)
+            # Close the file that is still written
+            self.close_output()
+            self.commit_progress()
 
             message = f"Thread {self.thread_id}: finishing"
             print(message)
             self.settings.logger.info(message)
 
+    def extract_windows(self, params, use_user_url, windows):
+        for batch_start_date, batch_end_date in windows:
+            if self.total_added >= params.extracting.stop_limit:
+                break
+
+            self.response_size = params.extracting.batch_size
+            self.offset = self.resume_point(batch_start_date, batch_end_date).get('offset', 0)
+
+            if self.__do_step(params, use_user_url, batch_start_date, batch_end_date):
+                self.track_progress(batch_start_date, batch_end_date, {'done': True})
+
+    def resume_point(self, batch_start_date, batch_end_date):
+        if self.checkpoint is None:
+            return {}
+        return self.checkpoint.window_progress(batch_start_date, batch_end_date)
+
+    def track_progress(self, batch_start_date, batch_end_date, window_state):
+        """
+        Remembers the window progress, it is journaled once its page is flushed to disk
+        """
+        if self.checkpoint is not None:
+            self.pending_progress[self.checkpoint.window_key(batch_start_date, batch_end_date)] = window_state
+
+    def commit_progress(self, filename=None, open_file=None):
+        if self.checkpoint is not None and (self.pending_progress or filename or open_file):
+            self.checkpoint.commit(self.pending_progress, filename, open_file)
+        self.pending_progress = {}
+
+    def commit_written(self):
+        """
+        Flushes the current file and journals the progress of its pages with the flushed size, at most once
+        in checkpoint_interval seconds, as a flush ends a compressed block and waits for the pending blocks.
+        A resumed run cuts the file to the journaled size, the later pages are extracted again.
+        Columnar files are journaled when they are closed.
+        """
+        if self.checkpoint is None or self.writer is None or not self.writer.resumable or \
+                time() - self.last_commit < self.checkpoint_interval:
+            return
+        self.writer.flush()
+        self.commit_progress(open_file=(self.writer.filename, os.path.getsize(self.writer.filename),
+                                        self.writer.closing_bytes()))
+        self.last_commit = time()
+
+    def setup_request(self, params):
+        params.extracting.headers = {
+            'Content-type': 'application/json'
+        }
+
+        if params.extracting.token:
+            token = params.extracting.token
+            params.extracting.headers['cookie'] = f'glide_user_activity={token}'
+
+        self.__setup_auth(params)
+
+    def __is_user_url(self, params):
+        formated_url = params.extracting.url.format(
+            start_date=f'{self.start_date}',
+            end_date=f'{self.end_date}',
+            custom=''
+        )
+        return formated_url != params.extracting.url
+
+    def __iterate_windows(self, params):
+        if self.all_dates:
+            #  If no dates specifiyed do only one step
+            yield self.start_date, self.end_date
+            return
+        yield from iterate_date_windows(self.start_date, self.end_date, params.extracting.interval)
+
+    def __iterate_queue(self, work_queue):
+        while True:
+            try:
+                yield work_queue.get_nowait()
+            except queue.Empty:
+                return
+
+    def count_records(self, params, batch_start_date, batch_end_date):
+        """
+        Number of records in the window as reported by the X-Total-Count header of a single record request
+        :return: records count or None if the header is not provided
+        """
+        use_user_url = self.__is_user_url(params)
+        url = self.get_request_url(use_user_url, params, batch_start_date, batch_end_date, offset=0, limit=1)
+        resp, _ = self.__send_request(params, url)
+        total_count = resp.headers.get('X-Total-Count')
+        if total_count is None or not str(total_count).isdigit():
+            return None
+        return int(total_count)
+
     def __do_step(self, params, use_user_url, batch_start_date, batch_end_date):
+        """
+        Extracts a single date interval
+        :return: True if the whole interval was extracted
+        """
+
+        if self.cursor_pagination and not use_user_url:
+            return self.__do_cursor_step(params, batch_start_date, batch_end_date)
+
+        if params.extracting.page_concurrency > 1:
+            return self.__do_pipelined_step(params, use_user_url, batch_start_date, batch_end_date)
 
         while self.response_size >= params.extracting.batch_size and self.total_added < params.extracting.stop_limit:
 
-            url = self.__get_request_url(use_user_url, params, batch_start_date, batch_end_date)
+            url = self.get_request_url(use_user_url, params, batch_start_date, batch_end_date)
             trial_number = 1
 
             try:
                 perv_offset = self.offset
-                self.handle_api_request(params, url, trial_number)
+                progress = (batch_start_date, batch_end_date, {'offset': perv_offset + params.extracting.batch_size})
+                self.handle_api_request(params, url, trial_number, progress)
                 if self.offset == perv_offset:
                     # no new records
                     break
@@ -134,27 +243,132 @@ class Extractor:
                 raise e
             except ConnectionError:
                 click.echo(click.style("Connection error", fg="red"))
-                break
+                return False
             except Exception:
                 # Trials exceeded for this interval, jump to next interval
-                break
+                return False
+
+        return self.total_added < params.extracting.stop_limit
+
+    def __do_pipelined_step(self, params, use_user_url, batch_start_date, batch_end_date):
+        """
+        Keeps up to page_concurrency offset requests in flight for a single date interval.
+        Pages are processed in offset order and no new requests are sent after a short page
+        or once the pages in flight can fill the stop_limit.
+        """
+        batch_size = params.extracting.batch_size
+        concurrency = params.extracting.page_concurrency
+        pending = deque()
+        next_offset = self.offset
+        last_page = False
+        self.size_connection_pool(concurrency)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            try:
+                while True:
+                    while not last_page and len(pending) < concurrency and \
+                            self.total_added + len(pending) * batch_size < params.extracting.stop_limit:
+                        url = self.get_request_url(use_user_url, params, batch_start_date, batch_end_date,
+                                                     offset=next_offset)
+                        pending.append(executor.submit(self.fetch_page, params, url))
+                        next_offset += batch_size
+
+                    if not pending:
+                        break
+
+                    try:
+                        resp, resp_body, response_time = pending.popleft().result()
+                    except DipException:
+                        self.total_failed += batch_size
+                        raise
+
+                    self.offset += batch_size
+                    page_size = len(resp_body['result'])
+                    progress = (batch_start_date, batch_end_date, {'offset': self.offset})
+                    self.__process_response(resp, resp_body, params, response_time, progress)
+                    if page_size < batch_size:
+                        last_page = True
+
+            except DipAuthException as e:
+                raise e
+            except ConnectionError:
+                click.echo(click.style("Connection error", fg="red"))
+            except Exception:
+                # Trials exceeded for this interval, jump to next interval
+                pass
+            finally:
+                for future in pending:
+                    future.cancel()
+
+        return last_page
+
+    def size_connection_pool(self, connections):
+        """
+        Keeps a pooled connection for every request in flight, requests pools only 10 connections per host
+        """
+        if connections > self.pool_size:
+            adapter = HTTPAdapter(pool_maxsize=connections)
+            self.session.mount('https://', adapter)
+            self.session.mount('http://', adapter)
+            self.pool_size = connections
+
+    def __do_cursor_step(self, params, batch_start_date, batch_end_date):
+        """
+        Keyset pagination of a single date interval, every page starts right after
+        the (date column, sys_id) of the last record of the previous page.
+        """
+        batch_size = params.extracting.batch_size
+        date_column = self.get_date_column(params)
+        cursor = self.resume_point(batch_start_date, batch_end_date).get('cursor')
+
+        while self.total_added < params.extracting.stop_limit:
+            url = self.get_request_url(False, params, batch_start_date, batch_end_date, cursor=cursor)
+            try:
+                resp, resp_body, response_time = self.fetch_page(params, url)
+            except DipAuthException as e:
+                raise e
+            except ConnectionError:
+                click.echo(click.style("Connection error", fg="red"))
+                return False
+            except DipException:
+                # Trials exceeded for this interval, jump to next interval
+                self.total_failed += batch_size
+                return False
+
+            results = resp_body['result']
+            page_size = len(results)
+            if page_size > 0:
+                cursor = self.get_cursor(results[-1], date_column)
+            progress = (batch_start_date, batch_end_date, {'cursor': cursor})
+            self.process_results(results, params, response_time, progress)
+            if page_size < batch_size:
+                return True
+
+        return False
+
+    @staticmethod
+    def get_cursor(record, date_column):
+        last_date = record.get(date_column)
+        last_sys_id = record.get('sys_id')
+        if not last_date or not last_sys_id:
+            raise DipException(f'Cursor pagination requires {date_column} and sys_id fields in the response')
+        return last_date, last_sys_id
 
     def __setup_auth(self, params):
         password = params.extracting.password
-        if not params.extracting.token:
+        if not params.extracting.token and getattr(params.extracting, 'auth', None) is None:
             if not password:
                 password = getpass.getpass(prompt='Password: ', stream=None)
 
             params.extracting.auth = HTTPBasicAuth(params.extracting.username, password)
 
-    def __get_request_url(self, use_user_url, params, batch_start_date, batch_end_date):
-        parsed_url = urlparse(params.extracting.url)
-        path = parsed_url.path
-        date_column = 'sys_updated_on'
-        if path.endswith('/sys_audit'):
-            date_column = 'sys_created_on'
-        if self.date_column:
-            date_column = self.date_column
+    def get_request_url(self, use_user_url, params, batch_start_date, batch_end_date, offset=None, limit=None,
+                        cursor=None):
+        if offset is None:
+            offset = self.offset
+        if limit is None:
+            limit = params.extracting.batch_size
+        date_column = self.get_date_column(params)
         # use user url, means that we are not constructing our sysparm_query
         # but using user provided url but we stil can replace some of its attributes such as
         # start_date and end_date
@@ -164,22 +378,24 @@ class Extractor:
                 start_date=f'{batch_start_date}',
                 end_date=f'{batch_end_date}',
             )
-            url += f'&sysparm_offset={self.offset}&sysparm_limit={params.extracting.batch_size}'
+            url += f'&sysparm_offset={offset}&sysparm_limit={limit}'
+        elif self.cursor_pagination:
+            url = self.__get_cursor_url(params, date_column, batch_start_date, batch_end_date, limit, cursor)
         else:
             url = params.extracting.url
             if 'sysparm_query=' in url:
                 if not self.all_dates:
-                    url += f'^{date_column}>{batch_start_date}^{date_column}<{batch_end_date}'
+                    url += f'^{date_column}>={batch_start_date}^{date_column}<{batch_end_date}'
             else:
                 if '?' not in url:
                     url += '?'
                 else:
                     url += '&'
                 if not self.all_dates:
-                    url += f'sysparm_query={date_column}>{batch_start_date}^{date_column}<{batch_end_date}'
+                    url += f'sysparm_query={date_column}>={batch_start_date}^{date_column}<{batch_end_date}'
             if not url.endswith('&') and not url.endswith('?'):
                 url += '&'
-            url += f'sysparm_offset={self.offset}&sysparm_limit={params.extracting.batch_size}'
+            url += f'sysparm_offset={offset}&sysparm_limit={limit}'
 
         message = f'Thread: {self.thread_id}, URL: {url}'
         print(message)
@@ -187,30 +403,49 @@ class Extractor:
 
         return url
 
-    def handle_api_request(self, params, url, trial_number):
+    # Former private name, kept for existing callers
+    __get_request_url = get_request_url
 
-        t1 = time()
-        if params.extracting.token:
-            resp = self.session.get(url, headers=params.extracting.headers)
-        else:
-            resp = self.session.get(url, headers=params.extracting.headers, auth=params.extracting.auth)
-        if resp.status_code == 401:
-            raise DipAuthException('Authentication failure')
+    def get_date_column(self, params):
+        if self.date_column:
+            return self.date_column
+        if urlparse(params.extracting.url).path.endswith('/sys_audit'):
+            return 'sys_created_on'
+        return 'sys_updated_on'
 
-        try:
-            response_time = round(time() - t1, 3)
+    def __get_cursor_url(self, params, date_column, batch_start_date, batch_end_date, limit, cursor):
+        parsed_url = urlparse(params.extracting.url)
+        query_params = parse_qsl(parsed_url.query, keep_blank_values=True)
+        conditions = [val for key, val in query_params if key == 'sysparm_query' and val]
+        for condition in conditions:
+            if '^NQ' in condition or 'ORDERBY' in condition:
+                raise DipException('Cursor pagination does not support ^NQ and ORDERBY in sysparm_query')
+        query_params = [(key, val) for key, val in query_params
+                        if key not in ('sysparm_query', 'sysparm_offset', 'sysparm_limit')]
+        if not self.all_dates:
+            conditions.append(f'{date_column}>={batch_start_date}^{date_column}<{batch_end_date}')
+
+        query = '^'.join(conditions)
+        if cursor is not None:
+            last_date, last_sys_id = cursor
+            prefix = query + '^' if query else ''
+            # (conditions and date > last) OR (conditions and date = last and sys_id > last)
+            query = f'{prefix}{date_column}>{last_date}^NQ{prefix}{date_column}={last_date}^sys_id>{last_sys_id}'
+        order = f'ORDERBY{date_column}^ORDERBYsys_id'
+        query = f'{query}^{order}' if query else order
+
+        query_params += [('sysparm_query', query), ('sysparm_limit', limit)]
+        return urlunparse(parsed_url._replace(query=urlencode(query_params, safe='^=<>!', quote_via=quote)))
+
+    def handle_api_request(self, params, url, trial_number, progress=None):
+
+        resp, response_time = self.__send_request(params, url)
 
+        try:
             self.offset += params.extracting.batch_size
-            try:
-                resp_body = json.loads(resp.text)
-            except Exception as e:
-                message = f"Failed to load response body using UTF-8. Going to use defults. {e}"
-                self.settings.logger.error(message)
-                click.echo(click.style(message, fg="yellow"))
-                resp_body = resp.json()
-            
+            resp_body = self.__load_response_body(resp)
 
-            self.__process_response(resp, resp_body, params, response_time)
+            self.__process_response(resp, resp_body, params, response_time, progress)
 
         except Exception as error:
             import traceback
@@ -219,7 +454,9 @@ class Extractor:
                 message = f"Error: Failed fetching from API. Trial: {trial_number} . Info: {error}"
                 self.settings.logger.error(message)
                 print(message)
-                self.handle_api_request(params, url, trial_number + 1)
+                # the retry requests the same page again
+                self.offset -= params.extracting.batch_size
+                self.handle_api_request(params, url, trial_number + 1, progress)
 
             if trial_number >= self.maximum_trials_number:
                 message = f"Error: Totally Failed fetching from API. Trial: {trial_number} . Info: {error}"
@@ -228,44 +465,89 @@ class Extractor:
                 self.total_failed += params.extracting.batch_size
                 raise DipException(message)
 
-    def __process_response(self, resp, resp_body, params, response_time):
+    def fetch_page(self, params, url, trial_number=1):
+        """
+        Fetches and validates a single page without processing its results.
+        Safe to call from several threads, used by the pipelined page fetching.
+        :return: response, parsed response body and response time
+        """
+        resp, response_time = self.__send_request(params, url)
+
+        try:
+            resp_body = self.__load_response_body(resp)
+            if resp.status_code != 200 or 'result' not in resp_body or 'error' in resp_body:
+                raise DipException(self.__get_err_message(resp))
+            return resp, resp_body, response_time
+        except Exception as error:
+            if trial_number < self.maximum_trials_number:
+                message = f"Error: Failed fetching from API. Trial: {trial_number} . Info: {error}"
+                self.settings.logger.error(message)
+                print(message)
+                return self.fetch_page(params, url, trial_number + 1)
+
+            message = f"Error: Totally Failed fetching from API. Trial: {trial_number} . Info: {error}"
+            self.settings.logger.error(message)
+            print(message)
+            raise DipException(message)
+
+    def __send_request(self, params, url):
+        t1 = time()
+        if params.extracting.token:
+            resp = self.session.get(url, headers=params.extracting.headers)
+        else:
+            resp = self.session.get(url, headers=params.extracting.headers, auth=params.extracting.auth)
+        if resp.status_code == 401:
+            raise DipAuthException('Authentication failure')
+        return resp, round(time() - t1, 3)
+
+    def __load_response_body(self, resp):
+        try:
+            return json.loads(resp.text)
+        except Exception as e:
+            message = f"Failed to load response body using UTF-8. Going to use defults. {e}"
+            self.settings.logger.error(message)
+            click.echo(click.style(message, fg="yellow"))
+            return resp.json()
+
+    def __process_response(self, resp, resp_body, params, response_time, progress=None):
         if resp.status_code == 200 and resp_body.__contains__('result') and not resp_body.__contains__('error'):
-            results = resp_body['result']
+            self.process_results(resp_body['result'], params, response_time, progress)
+        else:
+            message = self.__get_err_message(resp)
+            raise DipException(message)
 
-            # Validate results as json
-            try:
-                json.dumps(results)
-            except Exception:
-                raise DipException('Corrupted JSON from API')
+    def process_results(self, results, params, response_time, progress=None):
+        """
+        Filters, processes and masks a page of results and writes it to the current output file
+        :param progress: optional (start_date, end_date, window state) of the window after this page
+        """
+        # Validate results as json
+        try:
+            json.dumps(results)
+        except Exception:
+            raise DipException('Corrupted JSON from API')
 
-            res_len = len(results)
-            results = self.filter_by_column(results) if self.filter_by_column is not None else results
-            if self.data_proccessor:
-                self.data_proccessor(results)
+        res_len = len(results)
+        results = self.filter_by_column(results) if self.filter_by_column is not None else results
+        if self.data_proccessor:
+            self.data_proccessor(results)
 
-            results = self.mask_results(results) if self.mask_results is not None else results
+        results = self.mask_results(results) if self.mask_results is not None else results
 
-            filtered_len = res_len - len(results)
-            self.settings.logger.info(f'Filtered out {filtered_len} of {res_len}')
+        filtered_len = res_len - len(results)
+        self.settings.logger.info(f'Filtered out {filtered_len} of {res_len}')
 
-            self.total_results += results
-            self.response_size = len(results)
-            self.total_added += self.response_size
+        self.response_size = len(results)
+        self.total_added += self.response_size
+        if progress is not None:
+            self.track_progress(*progress)
 
-            message = f'Added: {self.response_size}. (Total Added: {self.total_added}, \
+        message = f'Added: {self.response_size}. (Total Added: {self.total_added}, \
 Total Failed Approximated: {self.total_failed}), Response Time: {response_time} s'
-            self.settings.logger.info(message)
-            click.echo(click.style(message, fg="green", underline=True))
+        self.settings.logger.info(message)
+        click.echo(click.style(message, fg="green", underline=True))
 
-            if len(self.total_results) >= params.extracting.file_limit:
-                message = 'File Split'
-                print(message)
-                self.settings.logger.info(message)
-                self.save_data_to_file(self.total_results, params)
-                self.total_results = []
-        else:
-            message = self.__get_err_message(resp)
-            raise DipException(message)
+        self.write_results(results, params)
 
     def __get_err_message(self, resp):
         if resp.json().__contains__('error'):
@@ -290,79 +572,119 @@ Total Failed Approximated: {self.total_failed}), Response Time: {response_time}
         return os.path.join(params.extracting.output_dir,
                             prefix + self.settings.reset_timestamp() + '_' + str(self.thread_id))
 
-    def save_data_to_file(self, results, params):
+    def write_results(self, results, params):
+        """
+        Streams a page of results into the current output file,
+        the file is rotated when it reaches --file_limit records or --file_size_limit MB
+        """
+        if not results:
+            return
         try:
-            print(self.thread_id)
-
-            output_filename = self.get_output_filename(params)
-
-            params.output_filename = output_filename
-
-            # Validate results as json
-            try:
-                json.dumps(results[-1])
-
-            except Exception:
-                deleted = results[-1]
-                results.pop()
-                message = f'Deleted data to maintain JSON format: {deleted}'
-                self.settings.logger.error(message)
-                print(message)
-            
-            if params.extracting.output_format == 'json':
-                self.save_json_file(results, params)
-            if params.extracting.output_format == 'csv':
-                self.save_csv_file(results, params)
-
-            message = f'Writing to file COMPLETED SUCCESSFULLY for file:{output_filename}'
-            self.settings.logger.info(message)
-            print(message)
-
+            if self.writer is not None and not self.writer.accepts(results):
+                self.settings.logger.info('New columns in results, starting a new file')
+                self.close_output()
+            if self.writer is None:
+                self.writer = self.open_output(params)
+            self.writer.write_records(results)
         except Exception as e:
             message = f'Error while saving file. {e}'
             self.settings.logger.exception(message)
             raise DipException(message)
 
-    def save_json_file(self, results, params):
-        try:
-            self.write_to_json_file(results, params, 'utf-8')
-        except Exception as e:
-            print(e.__str__(), "\n", "Trying utf-8-sig encoding...")
-            self.write_to_json_file(results, params, 'utf-8-sig')
-
-    def save_csv_file(self, output_data, params):
-        try:
-            self.write_to_csv_file(output_data, params, 'utf-8')
-        except Exception as e:
-            print(e.__str__(), "\n", "Trying utf-8-sig encoding...")
-            self.write_to_csv_file(output_data, params, 'utf-8-sig')
-
-    def write_to_csv_file(self, results, params, encoding):
-        output_filename = params.output_filename + '.csv'
-        df = pd.DataFrame.from_dict(results)
-        if params.extracting.compress:
-            with gzip.open(output_filename + '.gz', 'wt', encoding=encoding) as file:
-                df.to_csv(file, compression='gzip',index=False)
+        size_limit = params.extracting.file_size_limit * 1024 * 1024
+        if self.writer.records_count >= params.extracting.file_limit or \
+                (size_limit and self.writer.bytes_written >= size_limit):
+            message = 'File Split'
+            print(message)
+            self.settings.logger.info(message)
+            self.close_output()
         else:
-            with open(output_filename, 'w', encoding=encoding) as file:
-                df.to_csv(file, index=False)
-
-    def write_to_json_file(self, results, params, encoding):
+            self.commit_written()
+
+    def open_output(self, params):
+        output_filename = self.get_output_filename(params)
+        output_format = params.extracting.output_format
+        if output_format in COLUMNAR_FORMATS:
+            # columnar files are compressed internally
+            return ColumnarWriter(f'{output_filename}.{output_format}', output_format,
+                                  compression=params.extracting.columnar_compression)
+        compression = Compression.from_params(params.extracting)
+        if output_format == 'csv':
+            return CsvStreamWriter(compressed_filename(output_filename + '.csv', compression), compress=compression)
+        if output_format == 'jsonl':
+            return JsonLinesWriter(compressed_filename(output_filename + '.jsonl', compression), compress=compression)
 
         indent = None
         if params.extracting.pretty_json:
             indent = 4
+        return JsonArrayWriter(compressed_filename(output_filename + '.json', compression), compress=compression,
+                               indent=indent)
 
-        if params.extracting.compress and not params.masking.enabled:
-            with gzip.open(params.output_filename + '.json.gz', 'wt', encoding=encoding) as zipfile:
-                json.dump(results, zipfile, indent=indent, ensure_ascii=False)
-        else:
-            with open(params.output_filename + '.json', 'w', encoding=encoding) as f:
-                json.dump(results, f, indent=indent, ensure_ascii=False)
+    def close_output(self):
+        if self.writer is None:
+            return
+        writer, self.writer = self.writer, None
+        writer.close()
+
+        message = f'Writing to file COMPLETED SUCCESSFULLY for file:{writer.filename}'
+        self.settings.logger.info(message)
+        print(message)
+        self.commit_progress(writer.filename)
+
+
+class WindowPlanner:
+    """
+    Builds extraction windows adapted to the records density of the period.
+    Interval windows holding more than target_size records are split in halves recursively,
+    adjacent windows that fit together into target_size records are merged.
+    """
+    MIN_WINDOW = datetime.timedelta(seconds=2)
 
-            # ZipFile(f'{params.output_filename}.zip', mode='w').write(params.output_filename)
+    def __init__(self, extractor, params, target_size):
+        self.extractor = extractor
+        self.params = params
+        self.target_size = target_size
+        self.probes = 0
 
-        # pass
+    def plan(self, start_date, end_date, interval):
+        """
+        :return: list of (start_date, end_date, records_count) windows covering the whole period,
+            records_count is None when the instance does not report counts
+        """
+        windows = []
+        for batch_start_date, batch_end_date in iterate_date_windows(start_date, end_date, interval):
+            count = self.__count(batch_start_date, batch_end_date)
+            windows += self.__split(batch_start_date, batch_end_date, count)
+        return self.__merge(windows)
+
+    def __count(self, batch_start_date, batch_end_date):
+        self.probes += 1
+        return self.extractor.count_records(self.params, batch_start_date, batch_end_date)
+
+    def __split(self, batch_start_date, batch_end_date, count):
+        if count is None or count <= self.target_size or batch_end_date - batch_start_date < self.MIN_WINDOW:
+            return [(batch_start_date, batch_end_date, count)]
+
+        middle_date = batch_start_date + (batch_end_date - batch_start_date) / 2
+        middle_date = middle_date.replace(microsecond=0)
+        left_count = self.__count(batch_start_date, middle_date)
+        right_count = None if left_count is None else max(count - left_count, 0)
+        if right_count is None:
+            right_count = self.__count(middle_date, batch_end_date)
+
+        return self.__split(batch_start_date, middle_date, left_count) + \
+            self.__split(middle_date, batch_end_date, right_count)
+
+    def __merge(self, windows):
+        merged = []
+        for batch_start_date, batch_end_date, count in windows:
+            if merged and count is not None and merged[-1][2] is not None and \
+                    merged[-1][2] + count <= self.target_size:
+                previous_start_date, _, previous_count = merged[-1]
+                merged[-1] = (previous_start_date, batch_end_date, previous_count + count)
+            else:
+                merged.append((batch_start_date, batch_end_date, count))
+        return merged
 
 
 class CsvFromJson:
@@ -380,9 +702,10 @@ class CsvFromJson:
                 self.proccess_dir(input_source)
 
     def proccess_file(self, file_path):
-        if file_path.strip().endswith('.json'):
+        ext, compression = input_extension(file_path.strip())
+        if ext == 'json':
             try:
-                with open(file_path) as f:
+                with open_input(file_path, compression, 'rt') as f:
                     self.settings.logger.info(f'Going to proccess file: {file_path}')
                     data_list = json.load(f)
                     if not isinstance(data_list, list):
@@ -390,6 +713,13 @@ class CsvFromJson:
                     self.data_proccessor(data_list)
             except Exception as e:
                 self.settings.logger.error(f"Error. Info: {e}")
+        elif ext in JSON_LINES_EXTENSIONS:
+            try:
+                with open_input(file_path, compression, 'rt') as f:
+                    self.settings.logger.info(f'Going to proccess file: {file_path}')
+                    self.data_proccessor([json.loads(line) for line in f if line.strip()])
+            except Exception as e:
+                self.settings.logger.error(f"Error. Info: {e}")
         else:
             self.settings.logger.info(f"{file_path} doesn't have json extension, skipping it")
 
@@ -1,11 +1,12 @@
 import os
-import gzip
-import json
 import click
 import pathlib
 from pandas import read_csv, read_excel, DataFrame
 
 from cli_util import DipException
+from src.compression import INPUT_COMPRESSIONS, Compression, compressed_filename
+from src.writers import COLUMNAR_FORMATS, ROW_GROUP_SIZE, ColumnarWriter, JsonArrayWriter, JsonLinesWriter, \
+    open_output_stream
 
 
 class File:
@@ -17,6 +18,13 @@ class File:
         self.cleaner = None
         self.chunked = False
         self.current_chunk = 0
+        # encoding the input file was read with
+        self.encoding = None
+        # JsonArrayWriter or JsonLinesWriter
+        self.json_writer = None
+        self.columnar_writer: ColumnarWriter = None
+        # compressed csv output, chunks are appended to it
+        self.csv_file = None
         self.dir_name = os.path.dirname(filename)
         
         # This is for file with multiple extensions e.g. filename.users.csv
@@ -25,6 +33,9 @@ class File:
         # Extras
         try:
             splited_filename = os.path.split(filename)[-1].split('.')
+            if len(splited_filename) > 2 and splited_filename[-1].lower() in INPUT_COMPRESSIONS:
+                # compressed input, e.g. filename.csv.gz
+                splited_filename = splited_filename[:-1]
             self.non_extension_part = splited_filename[0]
             
             # If there are more than 2 extensions, then the first one is the extra extension
@@ -63,12 +74,25 @@ class File:
                 params.output_filename = output_filename
                 self.save_json_file(output_data, params)
             
+            if params.output_format == 'jsonl':
+                output_filename = os.path.join(destination_folder, sub_dir,
+                                           self.non_extension_part + '_processed' + self._get_extra_ext() + '.jsonl')
+                params.output_filename = output_filename
+                self.save_json_file(output_data, params)
+
             if params.output_format == 'csv':
                 output_filename = os.path.join(destination_folder, sub_dir,
                                            self.non_extension_part + '_processed' + self._get_extra_ext() + '.csv')
                 params.output_filename = output_filename
                 self.save_csv_file(output_data, params) 
 
+            if params.output_format in COLUMNAR_FORMATS:
+                output_filename = os.path.join(destination_folder, sub_dir,
+                                           self.non_extension_part + '_processed' + self._get_extra_ext() +
+                                           '.' + params.output_format)
+                params.output_filename = output_filename
+                self.write_to_columnar_file(output_data, params)
+
         except Exception as e:
             message = f'Error while saving file to: {output_filename}. {e.__str__()}'
             print(message)
@@ -93,30 +117,52 @@ class File:
         indent = None
         if params.pretty_json:
             indent = 4
-        if params.compress:
-            with gzip.open(params.output_filename + '.gz', 'wt', encoding=encoding) as file:
-                results.to_json(file, force_ascii=False, orient='records', compression='gzip', indent=indent)
-        else:
-            if self.current_chunk == 0:
-                with open(params.output_filename, 'w', encoding=encoding) as file:
-                    results.to_json(file, force_ascii=False, orient='records', indent=indent)
+        if self.json_writer is None:
+            compression = Compression.from_params(params)
+            output_filename = compressed_filename(params.output_filename, compression)
+            if params.output_format == 'jsonl':
+                self.json_writer = JsonLinesWriter(output_filename, compress=compression, encoding=encoding)
             else:
-                with open(params.output_filename, 'r') as file:
-                    jsn = json.load(file)
-                    txt = results.to_json(force_ascii=False,
-                                                      orient='records',
-                                                      indent=indent)
-                    txt = txt.encode(encoding)
-                    new_json = json.loads(txt)
-                    jsn = jsn + new_json
-                with open(params.output_filename, 'w', encoding=encoding) as file:
-                    json.dump(jsn, file, ensure_ascii=False)
+                self.json_writer = JsonArrayWriter(output_filename, compress=compression,
+                                                   encoding=encoding, indent=indent)
+        self.json_writer.write_frame(results)
+        if self.current_chunk > 0:
+            print(f"Saved chunk {self.current_chunk + 1} to {self.json_writer.filename}", end='\r')
+        self.current_chunk += 1
+
+    def write_to_columnar_file(self, results, params):
+        if self.columnar_writer is None:
+            # a row group per masking chunk, text columns as the chunk types can drift
+            self.columnar_writer = ColumnarWriter(params.output_filename, params.output_format,
+                                                  compression=params.columnar_compression,
+                                                  row_group_size=params.csv_chunk_size or ROW_GROUP_SIZE,
+                                                  infer_types=False)
+        self.columnar_writer.write_frame(results)
+        if self.current_chunk > 0:
+            print(f"Saved chunk {self.current_chunk + 1} to {self.columnar_writer.filename}", end='\r')
         self.current_chunk += 1
 
+    def close_output(self):
+        if self.json_writer is not None:
+            self.json_writer.close()
+            self.json_writer = None
+        if self.columnar_writer is not None:
+            self.columnar_writer.close()
+            self.columnar_writer = None
+        if self.csv_file is not None:
+            self.csv_file.close()
+            self.csv_file = None
+
     def write_to_csv_file(self, results, params, encoding):
-        if params.compress and not self.chunked:
-            with gzip.open(params.output_filename + '.gz', 'wt', encoding=encoding) as file:
-                results.to_csv(file, compression='gzip',index=False)
+        compression = Compression.from_params(params)
+        if compression:
+            if self.csv_file is None:
+                self.csv_file = open_output_stream(compressed_filename(params.output_filename, compression),
+                                                   compression, encoding, newline='')
+            self.csv_file.write(results.to_csv(index=False, header=self.current_chunk == 0))
+            if self.current_chunk > 0:
+                print(f"Saved chunk {self.current_chunk + 1} to {self.csv_file.name}", end='\r')
+            self.current_chunk += 1
         else:
             if self.current_chunk == 0:
                 results.to_csv(params.output_filename, index=False)
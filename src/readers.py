@@ -0,0 +1,405 @@
+import codecs
+import io
+import json
+import os
+import re
+from contextlib import contextmanager
+
+from pandas import DataFrame
+
+from cli_util import DipException
+from src.compression import INPUT_COMPRESSIONS, open_input
+from src.writers import SNOW_DATETIME_FORMAT
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # NOSONAR
+    pq = None
+
+# Keys of the json objects wrapping the records array, by precedence
+JSON_RECORDS_KEYS = ('records', 'data', 'result')
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Bytes read from the start of a file to choose its encoding
+ENCODING_SAMPLE_SIZE = 1 << 20
+CARRIAGE_RETURN_MARK = '<#__swish_r>'
+BOMS = ((codecs.BOM_UTF8, 'utf-8-sig'), (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'))
+# Masking input extensions, all but parquet can be gzip or zstd compressed
+TEXT_EXTENSIONS = ('.csv', '.json', '.jsonl', '.ndjson')
+JSON_LINES_EXTENSIONS = ('jsonl', 'ndjson')
+INPUT_EXTENSIONS = ('.parquet',) + tuple(extension + compressed for extension in TEXT_EXTENSIONS
+                                         for compressed in ('', '.gz', '.zst'))
+
+
+def input_extension(filename):
+    """
+    :return: the data extension of an input file and its compression (None for uncompressed files),
+    e.g. ('jsonl', 'gzip') for records.jsonl.gz
+    """
+    parts = os.path.basename(filename).lower().split('.')
+    if len(parts) > 2 and parts[-1] in INPUT_COMPRESSIONS:
+        return parts[-2], INPUT_COMPRESSIONS[parts[-1]]
+    return parts[-1], None
+
+
+def sniff_encoding(filename, encodings, sample_size=ENCODING_SAMPLE_SIZE, compression=None):
+    """
+    Chooses the encoding of a file from a sample of its start: a BOM wins, otherwise the first
+    of the encodings that decodes the sample (a character cut by the end of the sample is fine)
+    :return: the encoding, None if no encoding decodes the sample
+    """
+    with open_input(filename, compression) as f:
+        sample = f.read(sample_size)
+        complete = not f.read(1)
+
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in encodings:
+        try:
+            codecs.getincrementaldecoder(encoding)().decode(sample, final=complete)
+            return encoding
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return None
+
+
+class JsonChunksReader:
+    """
+    Incremental reader of the records of a json file, iterates DataFrames of chunk_size records.
+    The records are a top level array or an array wrapped by one of JSON_RECORDS_KEYS (the keys of a wrapper
+    are read first, its array is the one of the first key by precedence), other json objects are loaded
+    at once like before. Only a block of the file and the current chunk are kept in memory.
+    """
+
+    def __init__(self, filename, encoding='utf-8', chunk_size=10000, block_size=1 << 20, compression=None):
+        self.filename = filename
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.compression = compression
+        self.decoder = json.JSONDecoder()
+        self.file = None
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def probe(self):
+        """
+        Checks that the file starts as json in this encoding
+        :return: False if the file has no data
+        """
+        with open_input(self.filename, self.compression, 'rt', self.encoding) as f:
+            head = f.read(self.block_size).lstrip('\ufeff \t\n\r')
+        if not head:
+            return False
+        if head[0] not in '[{':
+            raise DipException(f'{self.filename} is not a json array or object')
+        return True
+
+    def __iter__(self):
+        with self.__opened() as first:
+            records_key = self.__records_key() if first == '{' else None
+        with self.__opened() as first:
+            if first == '[':
+                yield from self.__iter_array()
+            elif first == '{':
+                yield from self.__iter_object(records_key)
+            elif first is not None:
+                self.__error('expected a json array or object')
+
+    @contextmanager
+    def __opened(self):
+        """
+        Opens the file for a pass over it, yields the first char of the json document
+        """
+        with open_input(self.filename, self.compression, 'rt', self.encoding) as self.file:
+            self.buffer, self.pos, self.eof = '', 0, False
+            self.__fill()
+            if self.buffer.startswith('\ufeff'):
+                self.pos = 1
+            yield self.__next_char()
+
+    def __records_key(self):
+        """
+        Reads the keys of the top level object, skipping their values
+        :return: the first of JSON_RECORDS_KEYS by precedence that holds an array, None for other objects
+        """
+        found = set()
+        for key in self.__iter_keys():
+            if key in JSON_RECORDS_KEYS and self.__next_char() == '[':
+                if key == JSON_RECORDS_KEYS[0]:
+                    return key
+                found.add(key)
+            self.__skip_value()
+        return next((key for key in JSON_RECORDS_KEYS if key in found), None)
+
+    def __iter_keys(self):
+        """
+        Iterates the keys of the top level object, the value of each key is read before the next one
+        """
+        self.pos += 1
+        first = True
+        while True:
+            char = self.__next_char()
+            if char == '}':
+                return
+            if char is None:
+                self.__error('unexpected end of file')
+            if not first:
+                self.__expect(char, ',')
+                self.pos += 1
+                self.__next_char()
+            first = False
+            key = self.__decode()
+            self.__expect(self.__next_char(), ':')
+            self.pos += 1
+            yield key
+
+    def __skip_value(self):
+        if self.__next_char() == '[':
+            # an array is read record by record, not loaded at once
+            for _ in self.__iter_records():
+                pass
+        else:
+            self.__decode()
+
+    def __iter_object(self, records_key):
+        data = {}
+        for key in self.__iter_keys():
+            if records_key is None:
+                data[key] = self.__decode()
+            elif key == records_key and self.__next_char() == '[':
+                # the rest of the object is not needed
+                yield from self.__iter_array()
+                return
+            else:
+                self.__skip_value()
+
+        # not a records wrapper, same as loading the whole file
+        if len(data) == 1:
+            data = next(iter(data.values()))
+        df = DataFrame(data)
+        for start in range(0, len(df), self.chunk_size):
+            yield df.iloc[start:start + self.chunk_size].reset_index(drop=True)
+
+    def __iter_array(self):
+        for records in self.__iter_records():
+            yield DataFrame(records)
+
+    def __iter_records(self):
+        """
+        Iterates the records of the array at the current position in lists of up to chunk_size records
+        """
+        self.pos += 1
+        # the C scanner of the decoder, raw_decode without its per call wrapping
+        scan = self.decoder.scan_once
+        skip = WHITESPACE.match
+        records = []
+        # a record was read, so a ',' or the closing ']' comes next
+        separated = False
+        closed = False
+        while not closed:
+            # tight loop over the buffered block, self.pos is moved only past complete records
+            buffer = self.buffer
+            pos = self.pos
+            try:
+                while True:
+                    pos = skip(buffer, pos).end()
+                    char = buffer[pos]
+                    if char == ']':
+                        self.pos = pos + 1
+                        closed = True
+                        break
+                    if separated:
+                        if char != ',':
+                            self.pos = pos
+                            self.__error("expected ','")
+                        pos = skip(buffer, pos + 1).end()
+                    value, pos = scan(buffer, pos)
+                    if pos == len(buffer) and not self.eof:
+                        # a value ending with the block can continue in the next one (numbers, literals)
+                        self.__fill()
+                        break
+                    records.append(value)
+                    self.pos = pos
+                    separated = True
+                    if len(records) >= self.chunk_size:
+                        break
+            except (IndexError, StopIteration, json.JSONDecodeError) as e:
+                if self.eof:
+                    self.__error('unexpected end of file' if isinstance(e, IndexError) else
+                                 getattr(e, 'msg', 'invalid json value'))
+                self.__fill()
+
+            if len(records) >= self.chunk_size or (closed and records):
+                yield records
+                records = []
+
+    def __decode(self):
+        self.__next_char()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+                # a value ending with the block can continue in the next one (numbers, literals)
+                if end < len(self.buffer) or self.eof:
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError as e:
+                if self.eof:
+                    self.__error(e.msg)
+            self.__fill()
+
+    def __next_char(self):
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self.__fill()
+
+    def __fill(self):
+        block = self.file.read(self.block_size)
+        if not block:
+            self.eof = True
+            return
+        self.buffer = self.buffer[self.pos:] + block
+        self.pos = 0
+
+    def __expect(self, char, expected):
+        if char != expected:
+            self.__error(f"expected '{expected}'")
+
+    def __error(self, message):
+        raise DipException(f'Failed to parse json file {self.filename}: {message} '
+                           f'near "{self.buffer[self.pos:self.pos + 40]}"')
+
+
+class CarriageReturnFixer(io.TextIOBase):
+    """
+    Text stream of a csv file with its carriage returns escaped, the substitution is done
+    on every block as the csv reader consumes the stream, without a fixed copy of the file.
+    Line ends are read in universal newlines mode, like the fixed copies were.
+    """
+
+    def __init__(self, filename, encoding='utf-8', block_size=1 << 20, compression=None):
+        super().__init__()
+        self.name = filename
+        if compression:
+            self.file = open_input(filename, compression, 'rt', encoding)
+        else:
+            self.file = open(filename, 'r', encoding=encoding, buffering=block_size)
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        text = self.file.read(-1 if size is None else size)
+        if not text:
+            # the csv reader does not close the streams it did not open
+            self.close()
+        return text.replace('\r', CARRIAGE_RETURN_MARK)
+
+    def readline(self, size=-1):
+        return self.file.readline(size).replace('\r', CARRIAGE_RETURN_MARK)
+
+    def close(self):
+        self.file.close()
+        super().close()
+
+
+class JsonLinesReader:
+    """
+    Reader of json lines (ndjson) files, optionally compressed, iterates DataFrames of chunk_size records.
+    The file is streamed line by line, so only the current chunk is kept in memory.
+    """
+
+    def __init__(self, filename, encoding='utf-8', chunk_size=10000, compression=None):
+        self.filename = filename
+        self.encoding = encoding
+        self.chunk_size = chunk_size
+        self.compression = compression
+
+    def open(self):
+        return open_input(self.filename, self.compression, 'rt', self.encoding)
+
+    def probe(self, sample_size=ENCODING_SAMPLE_SIZE):
+        """
+        Checks that the file starts with a json object in this encoding
+        :return: False if the file has no data
+        """
+        with self.open() as f:
+            head = f.read(sample_size).lstrip('\ufeff \t\n\r')
+        if not head:
+            return False
+        if head[0] != '{':
+            raise DipException(f'{self.filename} is not a json lines file')
+        return True
+
+    def __iter__(self):
+        loads = json.loads
+        records = []
+        with self.open() as f:
+            for line_number, line in enumerate(f, 1):
+                if line_number == 1:
+                    line = line.lstrip('\ufeff')
+                if not line.strip():
+                    continue
+                try:
+                    records.append(loads(line))
+                except json.JSONDecodeError as e:
+                    raise DipException(f'Failed to parse json lines file {self.filename}: '
+                                       f'{e.msg} at line {line_number}')
+                if len(records) >= self.chunk_size:
+                    yield DataFrame(records)
+                    records = []
+        if records:
+            yield DataFrame(records)
+
+
+def scan_columns(chunks):
+    """
+    Reads all the chunks once, json records can bring new keys in any chunk
+    :return: column to the dtype it first has, in the order the columns first appear
+    """
+    dtypes = {}
+    for chunk in chunks:
+        for column, dtype in chunk.dtypes.items():
+            dtypes.setdefault(column, dtype)
+    return dtypes
+
+
+class ParquetChunksReader:
+    """
+    Reader of parquet files, iterates DataFrames of up to chunk_size records read row group by row group.
+    Dictionary columns are decoded and timestamps are formatted back to ServiceNow date time text.
+    """
+
+    def __init__(self, filename, chunk_size=10000):
+        if pq is None:
+            raise DipException(f'pyarrow package is required for reading {filename}')
+        self.filename = filename
+        self.chunk_size = chunk_size
+
+    def probe(self):
+        """
+        :return: False if the file has no data
+        """
+        try:
+            return pq.ParquetFile(self.filename).metadata.num_rows > 0
+        except pa.ArrowException as e:
+            raise DipException(f'{self.filename} is not a parquet file. {e}')
+
+    def __iter__(self):
+        parquet_file = pq.ParquetFile(self.filename)
+        schema = parquet_file.schema_arrow
+        decoded = pa.schema([field.with_type(field.type.value_type) if pa.types.is_dictionary(field.type) else field
+                             for field in schema])
+        timestamps = [field.name for field in schema if pa.types.is_timestamp(field.type)]
+        for batch in parquet_file.iter_batches(batch_size=self.chunk_size):
+            df = pa.Table.from_batches([batch]).cast(decoded).to_pandas()
+            for column in timestamps:
+                df[column] = df[column].dt.strftime(SNOW_DATETIME_FORMAT)
+            yield df
+
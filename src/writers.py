@@ -0,0 +1,381 @@
+import codecs
+import json
+import re
+
+import pandas as pd
+
+from cli_util import DipException
+from src.compression import as_compression, compress_block, open_compressed_output
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # NOSONAR
+    pa = None
+
+COLUMNAR_FORMATS = ('parquet', 'arrow')
+# The first compression is the default
+COLUMNAR_COMPRESSIONS = {'parquet': ('snappy', 'gzip', 'brotli', 'zstd', 'lz4', 'none'),
+                         'arrow': ('none', 'lz4', 'zstd')}
+ROW_GROUP_SIZE = 10000
+# String columns with less distinct values than this share of their rows are dictionary encoded
+DICTIONARY_RATIO = 0.5
+# ServiceNow date time fields, e.g. sys_created_on
+SNOW_DATETIME_REGEX = re.compile(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}')
+SNOW_DATETIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def open_output_stream(filename, compress=False, encoding='utf-8', newline=None):
+    """
+    :param compress: a Compression, True for the default gzip compression or False
+    """
+    compression = as_compression(compress)
+    if compression:
+        return open_compressed_output(filename, compression, encoding=encoding, newline=newline)
+    return open(filename, 'w', encoding=encoding, newline=newline)
+
+
+class JsonArrayWriter:
+    """
+    Append only writer of a single json array.
+    The opening bracket is written once, every chunk is appended as comma separated records
+    and the array is closed on close(), so each write costs only the size of the written chunk.
+    """
+    # flushed files can be cut after their last flush and finished with closing_bytes()
+    resumable = True
+
+    def __init__(self, filename, compress=False, encoding='utf-8', indent=None):
+        self.filename = filename
+        self.encoding = encoding
+        self.indent = indent
+        self.compression = as_compression(compress)
+        self.records_count = 0
+        self.bytes_written = 0
+        self.separator = ',\n' if indent else ','
+        self.closing = '\n]' if indent else ']'
+        self.file = open_output_stream(filename, self.compression, encoding)
+        self.__write('[\n' if indent else '[')
+
+    def accepts(self, records):
+        return True
+
+    def write_frame(self, df):
+        if df is None or len(df) == 0:
+            return
+        txt = df.to_json(force_ascii=False, orient='records', indent=self.indent)
+        self.__append(txt.strip()[1:-1].strip('\n'), len(df))
+
+    def write_records(self, records):
+        if not records:
+            return
+        txt = json.dumps(records, ensure_ascii=False, indent=self.indent)
+        self.__append(txt[1:-1].strip('\n'), len(records))
+
+    def __append(self, body, count):
+        if not body.strip():
+            return
+        if self.records_count > 0:
+            self.__write(self.separator)
+        self.__write(body)
+        self.records_count += count
+
+    def __write(self, text):
+        self.file.write(text)
+        self.bytes_written += len(text.encode(self.encoding))
+
+    def flush(self):
+        self.file.flush()
+
+    def closing_bytes(self):
+        """
+        :return: the bytes closing the array of a file cut after its flushed records
+        """
+        encoder = codecs.getincrementalencoder(self.encoding)()
+        # a BOM belongs to the opening bracket
+        encoder.encode('[')
+        data = encoder.encode(self.closing)
+        return compress_block(data, self.compression) if self.compression else data
+
+    def close(self):
+        if self.file is None:
+            return
+        self.__write(self.closing)
+        self.file.close()
+        self.file = None
+
+
+class JsonLinesWriter:
+    """
+    Append only json lines writer, every page is appended as one record per line and flushed,
+    so the file can be read while it is written. Compressed pages end with a complete gzip member
+    (or zstd frame), so they are readable once written too.
+    """
+    resumable = True
+
+    def __init__(self, filename, compress=False, encoding='utf-8'):
+        self.filename = filename
+        self.records_count = 0
+        self.bytes_written = 0
+        # a BOM of utf-8-sig is written only once
+        self.encoder = codecs.getincrementalencoder(encoding)()
+        compression = as_compression(compress)
+        self.file = open_compressed_output(filename, compression) if compression else open(filename, 'wb')
+
+    def accepts(self, records):
+        return True
+
+    def write_frame(self, df):
+        if df is None or len(df) == 0:
+            return
+        txt = df.to_json(force_ascii=False, orient='records', lines=True)
+        self.__append(txt if txt.endswith('\n') else txt + '\n', len(df))
+
+    def write_records(self, records):
+        if not records:
+            return
+        self.__append(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in records), len(records))
+
+    def __append(self, txt, count):
+        data = self.encoder.encode(txt)
+        # the limits are for the size before compression, like for the other formats
+        self.bytes_written += len(data)
+        self.file.write(data)
+        self.file.flush()
+        self.records_count += count
+
+    def flush(self):
+        self.file.flush()
+
+    def closing_bytes(self):
+        return b''
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+
+
+class CsvStreamWriter:
+    """
+    Append only csv writer, the header is taken from the first written records.
+    Records with columns missing from the header are not accepted, they go to the next file.
+    """
+    resumable = True
+
+    def __init__(self, filename, compress=False, encoding='utf-8'):
+        self.filename = filename
+        self.encoding = encoding
+        self.columns = None
+        self.records_count = 0
+        self.bytes_written = 0
+        # pandas writes its own line terminators
+        self.file = open_output_stream(filename, compress, encoding, newline='')
+
+    def accepts(self, records):
+        if self.columns is None:
+            return True
+        columns = set(self.columns)
+        return all(key in columns for record in records for key in record)
+
+    def write_records(self, records):
+        if not records:
+            return
+        df = pd.DataFrame.from_records(records, columns=self.columns)
+        txt = df.to_csv(index=False, header=self.columns is None)
+        if self.columns is None:
+            self.columns = list(df.columns)
+        self.file.write(txt)
+        self.bytes_written += len(txt.encode(self.encoding))
+        self.records_count += len(records)
+
+    def flush(self):
+        self.file.flush()
+
+    def closing_bytes(self):
+        return b''
+
+    def close(self):
+        if self.file is None:
+            return
+        self.file.close()
+        self.file = None
+
+
+class ColumnarWriter:
+    """
+    Append only parquet or arrow IPC stream writer.
+    The schema is inferred from the first written rows: ServiceNow date time strings become timestamps,
+    low cardinality strings are dictionary encoded and reference fields (objects) are kept as json text.
+    Rows are buffered and written in row groups (arrow record batches) of row_group_size rows.
+    With infer_types False every column is text, for chunks whose types can change from chunk to chunk.
+    """
+    # buffered rows and the parquet footer are only written on close()
+    resumable = False
+
+    def __init__(self, filename, output_format='parquet', compression='', row_group_size=ROW_GROUP_SIZE,
+                 infer_types=True):
+        if pa is None:
+            raise DipException(f'pyarrow package is required for --output_format {output_format}')
+        compression = (compression or COLUMNAR_COMPRESSIONS[output_format][0]).lower()
+        if compression not in COLUMNAR_COMPRESSIONS[output_format]:
+            raise DipException(f'Unsupported {output_format} compression {compression}. '
+                               f'Only {list(COLUMNAR_COMPRESSIONS[output_format])} supported')
+        self.filename = filename
+        self.output_format = output_format
+        self.compression = compression
+        self.row_group_size = row_group_size
+        self.infer_types = infer_types
+        self.schema = None
+        self.records_count = 0
+        self.bytes_written = 0
+        self.tables = []
+        self.buffered = 0
+        self.writer = None
+        self.file = open(filename, 'wb')
+
+    def accepts(self, records):
+        if self.schema is None:
+            return True
+        fields = {field.name: field.type for field in self.schema}
+        for record in records:
+            for key, value in record.items():
+                if key not in fields:
+                    return False
+                if value is not None and not self.__fits(fields[key], value):
+                    return False
+        return True
+
+    @staticmethod
+    def __fits(field_type, value):
+        if pa.types.is_timestamp(field_type):
+            return isinstance(value, str) and (not value or SNOW_DATETIME_REGEX.fullmatch(value) is not None)
+        if pa.types.is_boolean(field_type):
+            return isinstance(value, bool)
+        if pa.types.is_integer(field_type):
+            return isinstance(value, int) and not isinstance(value, bool)
+        if pa.types.is_floating(field_type):
+            return isinstance(value, (int, float)) and not isinstance(value, bool)
+        return True
+
+    def write_records(self, records):
+        if not records:
+            return
+        self.write_frame(pd.DataFrame.from_records(records))
+
+    def write_frame(self, df):
+        if df is None or len(df) == 0:
+            return
+        if self.schema is None:
+            self.schema = self.infer_schema(df, self.infer_types)
+        extra = [column for column in df.columns if column not in self.schema.names]
+        if extra:
+            raise DipException(f'Columns {extra} are not in the schema of {self.filename}')
+
+        self.tables.append(pa.Table.from_arrays([self.__to_array(df, field) for field in self.schema],
+                                                schema=self.schema))
+        self.buffered += len(df)
+        self.records_count += len(df)
+        if self.buffered >= self.row_group_size:
+            self.__flush()
+
+    @staticmethod
+    def infer_schema(df, infer_types=True):
+        fields = []
+        for column in df.columns:
+            values = df[column]
+            kind = pd.api.types.infer_dtype(values, skipna=True)
+            if not infer_types:
+                field_type = pa.string()
+                if kind == 'string' and values.nunique() <= DICTIONARY_RATIO * values.count():
+                    field_type = pa.dictionary(pa.int32(), pa.string())
+            elif pd.api.types.is_bool_dtype(values.dtype) or kind == 'boolean':
+                field_type = pa.bool_()
+            elif pd.api.types.is_integer_dtype(values.dtype) or kind == 'integer':
+                field_type = pa.int64()
+            elif pd.api.types.is_float_dtype(values.dtype) or kind in ('floating', 'mixed-integer-float'):
+                field_type = pa.float64()
+            elif pd.api.types.is_datetime64_any_dtype(values.dtype):
+                field_type = pa.timestamp('ns')
+            elif kind == 'string' and ColumnarWriter.__is_datetime(values):
+                field_type = pa.timestamp('s')
+            elif kind == 'string' and values.nunique() <= DICTIONARY_RATIO * values.count():
+                field_type = pa.dictionary(pa.int32(), pa.string())
+            else:
+                field_type = pa.string()
+            fields.append(pa.field(str(column), field_type))
+        return pa.schema(fields)
+
+    @staticmethod
+    def __is_datetime(values):
+        texts = values.dropna()
+        texts = texts[texts != '']
+        return len(texts) > 0 and bool(texts.str.fullmatch(SNOW_DATETIME_REGEX).all())
+
+    def __to_array(self, df, field):
+        if field.name not in df:
+            return pa.nulls(len(df), field.type)
+        values = df[field.name]
+        try:
+            if pa.types.is_timestamp(field.type) and not pd.api.types.is_datetime64_any_dtype(values.dtype):
+                values = pd.to_datetime(values.replace('', None), format=SNOW_DATETIME_FORMAT)
+            elif pa.types.is_dictionary(field.type) or pa.types.is_string(field.type):
+                array = pa.array(self.__texts(values), type=pa.string(), from_pandas=True)
+                return array.dictionary_encode() if pa.types.is_dictionary(field.type) else array
+            return pa.array(values, type=field.type, from_pandas=True)
+        except (pa.ArrowException, ValueError, TypeError) as e:
+            raise DipException(f'Column {field.name} does not fit the {field.type} type of {self.filename}, '
+                               f'use --output_format csv or json. {e}')
+
+    @staticmethod
+    def __texts(values):
+        if pd.api.types.infer_dtype(values, skipna=True) in ('string', 'empty'):
+            return values
+        return values.map(lambda x: x if x is None or isinstance(x, str) or (isinstance(x, float) and pd.isna(x))
+                          else json.dumps(x, ensure_ascii=False) if isinstance(x, (dict, list)) else str(x))
+
+    def __flush(self, final=False):
+        if not self.tables:
+            return
+        table = pa.concat_tables(self.tables)
+        rows = len(table) if final else len(table) - len(table) % self.row_group_size
+        self.tables = [table.slice(rows)] if rows < len(table) else []
+        self.buffered = len(table) - rows
+        if rows == 0:
+            return
+        table = table.slice(0, rows)
+
+        if self.writer is None:
+            self.__open_writer()
+        if self.output_format == 'parquet':
+            self.writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            for batch in table.combine_chunks().to_batches(max_chunksize=self.row_group_size):
+                self.writer.write_batch(batch)
+        self.bytes_written = self.file.tell()
+
+    def __open_writer(self):
+        compression = None if self.compression == 'none' else self.compression
+        if self.output_format == 'parquet':
+            dictionary_columns = [field.name for field in self.schema if pa.types.is_dictionary(field.type)]
+            self.writer = pq.ParquetWriter(self.file, self.schema, compression=compression or 'none',
+                                           use_dictionary=dictionary_columns)
+        else:
+            # the stream format, as every batch carries its own dictionaries
+            self.writer = pa.ipc.new_stream(self.file, self.schema,
+                                            options=pa.ipc.IpcWriteOptions(compression=compression))
+
+    def close(self):
+        if self.file is None:
+            return
+        try:
+            self.__flush(final=True)
+            if self.writer is None:
+                # a file without rows is still a readable (empty) table
+                self.schema = self.schema or pa.schema([])
+                self.__open_writer()
+            self.writer.close()
+        finally:
+            self.file.close()
+            self.file = None
+
@@ -352,4 +352,28 @@ class FilteringTestCase(TestCase):
         print(result.output)
         assert result.exit_code == 0
         assert os.path.isfile("tests/data/output_multi_extensions/test_multi_processed.multi.csv")
-        assert os.path.isfile("tests/data/output_multi_extensions/test_multi_2_processed.multi.csv")
\ No newline at end of file
+        assert os.path.isfile("tests/data/output_multi_extensions/test_multi_2_processed.multi.csv")
+
+    def test_file_with_multiple_extensions_mask_parallel_files(self):
+        outputs = []
+        for extra_args in [[], ["--workers", "2", "--parallel_files"], ["--parallel_files"]]:
+            for name in ["test_multi_processed.multi.csv", "test_multi_2_processed.multi.csv"]:
+                if os.path.isfile(f"tests/data/output_multi_extensions/{name}"):
+                    os.remove(f"tests/data/output_multi_extensions/{name}")
+
+            args = ["--mask", "--output_dir", "tests/data/output_multi_extensions",
+                    "--input_dir", "tests/data/input_multi_extensions",
+                    "--config", "default_config.json"] + extra_args
+            runner = CliRunner()
+            result = runner.invoke(cli, args, catch_exceptions=False)
+            print(result.output)
+            assert result.exit_code == 0
+            assert "Masked 2 files in" in result.output
+            # without workers the files are masked one by one
+            assert ("--parallel_files requires --workers > 1" in result.output) == (extra_args == ["--parallel_files"])
+
+            with open("tests/data/output_multi_extensions/test_multi_processed.multi.csv", 'rb') as f1, \
+                    open("tests/data/output_multi_extensions/test_multi_2_processed.multi.csv", 'rb') as f2:
+                outputs.append((f1.read(), f2.read()))
+
+        assert outputs[0] == outputs[1] == outputs[2]
@@ -1,11 +1,48 @@
-from datetime import datetime
-from unittest import TestCase
+import gzip
+import itertools
+import json
+import os
+import queue
+import shutil
+import tempfile
+import requests_mock
+import re
+import threading
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import TestCase, skipIf
+from unittest.mock import patch
+import pandas as pd
 from types import SimpleNamespace
 from urllib import parse
-from src.extractor_resource import CsvFromJson, DefaultDataProccessor, Extractor
+from src.extractor_resource import CsvFromJson, DefaultDataProccessor, Extractor, WindowPlanner, iterate_date_windows
+from src.async_extractor import AsyncExtractor, aiohttp
+from src.checkpoint import ExtractionCheckpoint
+from src.compression import BlockCompressor, Compression, zstandard
+from src.writers import ColumnarWriter, pa
+
+
+OUTPUT_PARAMS = dict(output_format='json', compress=False, pretty_json=False, file_size_limit=0)
 
 
 class TestExtractor(TestCase):
+    def setUp(self):
+        self.output_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.output_dir)
+        self.output_files = itertools.count()
+
+    def stream_output(self, extractor):
+        files = self.output_files
+        extractor.get_output_filename = lambda params: os.path.join(self.output_dir, f'output_{next(files):04d}')
+
+    def read_output(self):
+        records = []
+        for filename in sorted(os.listdir(self.output_dir)):
+            if filename.endswith('.json'):
+                with open(os.path.join(self.output_dir, filename), encoding='utf-8') as f:
+                    records += json.load(f)
+        return records
+
     def test_filter_dates_column_sys_audit(self):
         foo = lambda msg: None
         start_date = datetime.strptime("2021-10-03", "%Y-%m-%d").date()
@@ -111,3 +148,553 @@ class TestExtractor(TestCase):
         parsed = parse.parse_qs(parse.urlsplit(url).query)
         assert 'sys_updated_on' in str(parsed['sysparm_query'])
         assert 'sys_created_on' not in str(parsed['sysparm_query'])
+
+    def test_pipelined_pages(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-03", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo)
+        )
+        extractor = Extractor(start_date, end_date, 0, app_settings)
+        self.stream_output(extractor)
+        url = "https://dev71074.service-now.com/api/now/table/incident"
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=1000, file_limit=1000,
+                                       page_concurrency=3, token='', headers={}, auth=None, **OUTPUT_PARAMS),
+            masking=SimpleNamespace(enabled=False)
+        )
+        total_records = 45
+        requested_offsets = []
+
+        def page(request, context):
+            query = parse.parse_qs(parse.urlsplit(request.url).query)
+            offset = int(query['sysparm_offset'][0])
+            limit = int(query['sysparm_limit'][0])
+            requested_offsets.append(offset)
+            ids = range(offset, min(offset + limit, total_records))
+            return json.dumps({'result': [{'sys_id': str(i)} for i in ids]})
+
+        with requests_mock.Mocker() as mock_session:
+            mock_session.register_uri('GET', requests_mock.ANY, text=page)
+            extractor._Extractor__do_step(params, False, start_date, end_date)
+        extractor.close_output()
+
+        assert [int(r['sys_id']) for r in self.read_output()] == list(range(total_records))
+        assert extractor.total_added == total_records
+        assert max(requested_offsets) < total_records + 3 * params.extracting.batch_size
+
+    def test_pipelined_pages_stop_limit(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-03", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo)
+        )
+        extractor = Extractor(start_date, end_date, 0, app_settings)
+        self.stream_output(extractor)
+        url = "https://dev71074.service-now.com/api/now/table/incident"
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=25, file_limit=1000,
+                                       page_concurrency=12, token='', headers={}, auth=None, **OUTPUT_PARAMS),
+            masking=SimpleNamespace(enabled=False)
+        )
+        requested_offsets = []
+
+        def page(request, context):
+            query = parse.parse_qs(parse.urlsplit(request.url).query)
+            offset = int(query['sysparm_offset'][0])
+            requested_offsets.append(offset)
+            return json.dumps({'result': [{'sys_id': str(i)} for i in range(offset, offset + 10)]})
+
+        with requests_mock.Mocker() as mock_session:
+            mock_session.register_uri('GET', requests_mock.ANY, text=page)
+            extractor._Extractor__do_step(params, False, start_date, end_date)
+        extractor.close_output()
+
+        # no pages are requested beyond the stop_limit
+        assert sorted(requested_offsets) == [0, 10, 20]
+        assert extractor.total_added == 30
+        # a pooled connection for every page in flight
+        assert extractor.session.get_adapter(url)._pool_maxsize == 12
+
+    def test_streamed_files_rotation(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-03", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo)
+        )
+        extractor = Extractor(start_date, end_date, 0, app_settings)
+        self.stream_output(extractor)
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(file_limit=25, file_size_limit=0, output_format='csv', compress=True),
+            masking=SimpleNamespace(enabled=False)
+        )
+        for page in range(5):
+            records = [{'sys_id': str(page * 10 + i), 'number': f'INC{i}'} for i in range(10 if page < 4 else 5)]
+            extractor.process_results(records, params, 0)
+        extractor.close_output()
+
+        files = sorted(os.listdir(self.output_dir))
+        assert files == ['output_0000.csv.gz', 'output_0001.csv.gz']
+        frames = [pd.read_csv(os.path.join(self.output_dir, f), dtype=str) for f in files]
+        assert [len(df) for df in frames] == [30, 15]
+        assert list(frames[0].columns) == list(frames[1].columns) == ['sys_id', 'number']
+        assert list(pd.concat(frames)['sys_id']) == [str(i) for i in range(45)]
+
+    def test_open_file_journaled_by_interval(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-03", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo)
+        )
+        checkpoint = ExtractionCheckpoint(self.output_dir, {'url': 'incident'})
+        saved = []
+        checkpoint.save = lambda: saved.append(dict(checkpoint.state['progress']))
+        extractor = Extractor(start_date, end_date, 0, app_settings, checkpoint=checkpoint)
+        self.stream_output(extractor)
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(file_limit=40000000, **dict(OUTPUT_PARAMS, compress=True)),
+            masking=SimpleNamespace(enabled=False)
+        )
+
+        def write_page(page):
+            records = [{'sys_id': str(page * 10 + i)} for i in range(10)]
+            extractor.process_results(records, params, 0, (start_date, end_date, {'offset': (page + 1) * 10}))
+
+        with patch.object(BlockCompressor, 'flush', autospec=True, side_effect=BlockCompressor.flush) as flush:
+            for page in range(50):
+                write_page(page)
+            # the pages stay in the compressed blocks, they are not flushed and journaled one by one
+            assert flush.call_count == 0 and saved == []
+
+            extractor.checkpoint_interval = 0
+            write_page(50)
+            assert flush.call_count == 1
+        assert saved == [{'2021-10-03 00:00:00|2021-10-04 00:00:00': {'offset': 510}}]
+        filename = os.path.join(self.output_dir, 'output_0000.json.gz')
+        assert checkpoint.state['open_files'][filename]['size'] == os.path.getsize(filename)
+        extractor.close_output()
+
+    def test_block_compressor(self):
+        data = ''.join(f'{i},INC{i:07d},printer {i % 7} not working\n' for i in range(20000)).encode()
+        codecs = ['gzip'] + (['zstd'] if zstandard is not None else [])
+        for codec in codecs:
+            filename = os.path.join(self.output_dir, 'blocks.' + codec)
+            compressor = BlockCompressor(filename, Compression(codec, level=1, workers=3), block_size=64 * 1024)
+            for start in range(0, len(data), 50000):
+                compressor.write(data[start:start + 50000])
+            compressor.close()
+            with open(filename, 'rb') as f:
+                compressed = f.read()
+            if codec == 'gzip':
+                # a gzip member per block
+                assert compressed.count(b'\x1f\x8b\x08') >= len(data) // (64 * 1024)
+                assert gzip.decompress(compressed) == data
+            else:
+                with zstandard.open(filename, 'rb') as f:
+                    assert f.read() == data
+
+    def test_json_lines_output(self):
+        foo = lambda msg: None
+        app_settings = SimpleNamespace(logger=SimpleNamespace(info=foo, error=foo))
+        extractor = Extractor(datetime(2021, 10, 3), datetime(2021, 10, 4), 0, app_settings)
+        self.stream_output(extractor)
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(file_limit=25, file_size_limit=0, output_format='jsonl', compress=True),
+            masking=SimpleNamespace(enabled=True)
+        )
+        for page in range(3):
+            records = [{'sys_id': str(page * 10 + i), 'caller_id': {'value': str(i)}} for i in range(10)]
+            extractor.process_results(records, params, 0)
+            # every page is a complete gzip member, readable while the file is written
+            with gzip.open(os.path.join(self.output_dir, 'output_0000.jsonl.gz'), 'rt', encoding='utf-8') as f:
+                assert len(f.readlines()) == min((page + 1) * 10, 30)
+        extractor.process_results([{'sys_id': '30'}], params, 0)
+        extractor.close_output()
+
+        files = sorted(os.listdir(self.output_dir))
+        assert files == ['output_0000.jsonl.gz', 'output_0001.jsonl.gz']
+        records = []
+        for filename in files:
+            with gzip.open(os.path.join(self.output_dir, filename), 'rt', encoding='utf-8') as f:
+                records += [json.loads(line) for line in f]
+        assert [record['sys_id'] for record in records] == [str(i) for i in range(31)]
+        assert records[1]['caller_id'] == {'value': '1'}
+
+    @skipIf(pa is None, 'pyarrow is not installed')
+    def test_columnar_output(self):
+        import pyarrow.parquet as pq
+        foo = lambda msg: None
+        app_settings = SimpleNamespace(logger=SimpleNamespace(info=foo, error=foo))
+        for output_format in ('parquet', 'arrow'):
+            extractor = Extractor(datetime(2021, 10, 3), datetime(2021, 10, 4), 0, app_settings)
+            self.stream_output(extractor)
+            params = SimpleNamespace(
+                extracting=SimpleNamespace(file_limit=1000, file_size_limit=0, output_format=output_format,
+                                           columnar_compression=''),
+                masking=SimpleNamespace(enabled=False)
+            )
+            records = [{'sys_id': str(i), 'state': str(i % 3), 'priority': i % 5,
+                        'sys_created_on': f'2021-10-03 10:00:{i % 60:02d}',
+                        'caller_id': {'link': 'https://snow/api/sys_user/1', 'value': '1'}} for i in range(30)]
+            extractor.process_results(records[:20], params, 0)
+            # values that do not fit the schema start a new file
+            extractor.process_results([dict(records[20], priority='high')], params, 0)
+            extractor.process_results(records[21:], params, 0)
+            extractor.close_output()
+
+        files = sorted(os.listdir(self.output_dir))
+        assert files == ['output_0000.parquet', 'output_0001.parquet',
+                         'output_0002.arrow', 'output_0003.arrow']
+        table = pq.read_table(os.path.join(self.output_dir, files[0]))
+        assert table.num_rows == 20
+        assert str(table.schema.field('state').type) == 'dictionary<values=string, indices=int32, ordered=0>'
+        assert str(table.schema.field('priority').type) == 'int64'
+        assert str(table.schema.field('sys_created_on').type).startswith('timestamp')
+        assert json.loads(table.column('caller_id')[0].as_py())['value'] == '1'
+        with pa.ipc.open_stream(os.path.join(self.output_dir, files[3])) as reader:
+            table = reader.read_all()
+        assert table.column('sys_id').to_pylist() == [str(i) for i in range(20, 30)]
+        assert table.column('priority').to_pylist()[:2] == ['high', '1']
+
+        # snappy parquet and uncompressed arrow by default
+        assert pq.ParquetFile(os.path.join(self.output_dir, files[0])).metadata.row_group(0).column(0).compression \
+            == 'SNAPPY'
+        written = {}
+        for compression in ('', 'none', 'lz4'):
+            filename = os.path.join(self.output_dir, f'codec_{compression}.arrow')
+            writer = ColumnarWriter(filename, 'arrow', compression=compression)
+            writer.write_records(records)
+            writer.close()
+            with open(filename, 'rb') as f:
+                written[compression] = f.read()
+        assert written[''] == written['none'] != written['lz4']
+
+    def test_adaptive_windows(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-01", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-05", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo)
+        )
+        extractor = Extractor(start_date, end_date, 0, app_settings)
+        url = "https://dev71074.service-now.com/api/now/table/incident"
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(url=url, batch_size=1000, token='', headers={}, auth=None),
+        )
+        # one record per minute except 2021-10-02 that has one record per second
+        dense_start = datetime.strptime("2021-10-02", "%Y-%m-%d")
+        dense_end = datetime.strptime("2021-10-03", "%Y-%m-%d")
+
+        def records_count(window_start, window_end):
+            count = 0
+            for part_start, part_end, step in [(start_date, dense_start, 60), (dense_start, dense_end, 1),
+                                               (dense_end, end_date, 60)]:
+                part_start, part_end = max(part_start, window_start), min(part_end, window_end)
+                if part_start < part_end:
+                    count += int((part_end - part_start).total_seconds()) // step
+            return count
+
+        def count_page(request, context):
+            query = parse.parse_qs(parse.urlsplit(request.url).query)['sysparm_query'][0]
+            window_start, window_end = re.findall(r'\d{4}-\d{2}-\d{2} \d{2}:\d{2}:\d{2}', query)
+            context.headers['X-Total-Count'] = str(records_count(datetime.fromisoformat(window_start),
+                                                                 datetime.fromisoformat(window_end)))
+            return json.dumps({'result': []})
+
+        with requests_mock.Mocker() as mock_session:
+            mock_session.register_uri('GET', requests_mock.ANY, text=count_page)
+            windows = WindowPlanner(extractor, params, 20000).plan(start_date, end_date, 24)
+
+        assert windows[0][0] == start_date and windows[-1][1] == end_date
+        for previous, current in zip(windows, windows[1:]):
+            assert previous[1] == current[0]
+        assert all(count <= 20000 for _, _, count in windows)
+        assert sum(count for _, _, count in windows) == records_count(start_date, end_date)
+        # sparse days are merged together, the dense day is split
+        assert windows[0][1] - windows[0][0] > timedelta(days=1)
+        assert len(windows) > 5
+
+    def test_cursor_pages(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-03", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo)
+        )
+        extractor = Extractor(start_date, end_date, 0, app_settings, cursor_pagination=True)
+        self.stream_output(extractor)
+        url = "https://dev71074.service-now.com/api/now/table/incident?sysparm_query=active=true"
+        params = SimpleNamespace(
+            extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=1000, file_limit=1000,
+                                       page_concurrency=1, token='', headers={}, auth=None, **OUTPUT_PARAMS),
+            masking=SimpleNamespace(enabled=False)
+        )
+        # several records share the same update time, sys_id breaks the ties
+        records = sorted([{'sys_id': f'{i:04d}', 'sys_updated_on': f'2021-10-03 10:00:{i // 4:02d}'}
+                          for i in range(45)], key=lambda r: (r['sys_updated_on'], r['sys_id']))
+        requested_queries = []
+
+        def page(request, context):
+            query = parse.parse_qs(parse.urlsplit(request.url).query)
+            sysparm_query = query['sysparm_query'][0]
+            requested_queries.append(request.url)
+            assert sysparm_query.startswith('active=true^')
+            assert sysparm_query.endswith('^ORDERBYsys_updated_on^ORDERBYsys_id')
+            page_records = records
+            cursor = re.search(r'sys_updated_on=([^^]+)\^sys_id>(\w+)', sysparm_query)
+            if cursor:
+                last = (cursor.group(1), cursor.group(2))
+                page_records = [r for r in records if (r['sys_updated_on'], r['sys_id']) > last]
+            return json.dumps({'result': page_records[:int(query['sysparm_limit'][0])]})
+
+        with requests_mock.Mocker() as mock_session:
+            mock_session.register_uri('GET', requests_mock.ANY, text=page)
+            extractor._Extractor__do_step(params, False, start_date, end_date)
+        extractor.close_output()
+
+        assert self.read_output() == records
+        assert extractor.total_added == len(records)
+        assert len(requested_queries) == 5
+        assert all('sysparm_offset' not in url for url in requested_queries)
+
+    def test_resume_from_checkpoint(self):
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-01", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo, exception=foo),
+            reset_timestamp=lambda: datetime.now().isoformat().replace(".", "").replace(":", "_")
+        )
+        url = "https://dev71074.service-now.com/api/now/table/incident"
+        records_per_window = 25
+        broken_offsets = {10}
+        requested = []
+
+        def page(request, context):
+            query = parse.parse_qs(parse.urlsplit(request.url).query)
+            window = re.findall(r'\d{4}-\d{2}-\d{2}', query['sysparm_query'][0])[0]
+            offset = int(query['sysparm_offset'][0])
+            requested.append((window, offset))
+            if window == '2021-10-02' and offset in broken_offsets:
+                context.status_code = 500
+                return json.dumps({'error': 'server error'})
+            ids = range(offset, min(offset + int(query['sysparm_limit'][0]), records_per_window))
+            return json.dumps({'result': [{'sys_id': f'{window}_{i}'} for i in ids]})
+
+        def extract(windows, resume):
+            params = SimpleNamespace(
+                extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=1000, file_limit=10,
+                                           page_concurrency=1, token='fake_token', password='', **OUTPUT_PARAMS),
+                masking=SimpleNamespace(enabled=False)
+            )
+            checkpoint = ExtractionCheckpoint(self.output_dir, {'url': url})
+            if resume:
+                checkpoint.load()
+                windows = checkpoint.remaining_windows()
+            else:
+                checkpoint.start(windows)
+            work_queue = queue.Queue()
+            for window in windows:
+                work_queue.put(window)
+            extractor = Extractor(start_date, end_date, 0, app_settings, checkpoint=checkpoint)
+            self.stream_output(extractor)
+            with requests_mock.Mocker() as mock_session:
+                mock_session.register_uri('GET', requests_mock.ANY, text=page)
+                extractor.api_extract(params, work_queue)
+            return checkpoint
+
+        windows = list(iterate_date_windows(start_date, end_date, 24))
+        checkpoint = extract(windows, resume=False)
+        assert sorted(checkpoint.state['completed']) == ['2021-10-01 00:00:00|2021-10-02 00:00:00',
+                                                         '2021-10-03 00:00:00|2021-10-04 00:00:00']
+        assert checkpoint.state['progress'] == {'2021-10-02 00:00:00|2021-10-03 00:00:00': {'offset': 10}}
+
+        broken_offsets.clear()
+        requested.clear()
+        checkpoint = extract(windows, resume=True)
+        assert requested == [('2021-10-02', 10), ('2021-10-02', 20)]
+        assert len(checkpoint.state['completed']) == 3
+        assert checkpoint.state['progress'] == {}
+
+        ids = [r['sys_id'] for r in self.read_output()]
+        assert len(ids) == len(set(ids)) == 3 * records_per_window
+
+    def test_resume_killed_extraction(self):
+        class Killed(BaseException):
+            pass
+
+        foo = lambda msg: None
+        start_date = datetime.strptime("2021-10-01", "%Y-%m-%d")
+        end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+        app_settings = SimpleNamespace(
+            logger=SimpleNamespace(info=foo, error=foo, exception=foo),
+            reset_timestamp=lambda: datetime.now().isoformat().replace(".", "").replace(":", "_")
+        )
+        url = "https://dev71074.service-now.com/api/now/table/incident"
+        records_per_window = 25
+        killed_at = [('2021-10-02', 10)]
+        requested = []
+
+        def page(request, context):
+            query = parse.parse_qs(parse.urlsplit(request.url).query)
+            window = re.findall(r'\d{4}-\d{2}-\d{2}', query['sysparm_query'][0])[0]
+            offset = int(query['sysparm_offset'][0])
+            requested.append((window, offset))
+            if (window, offset) in killed_at:
+                raise Killed()
+            ids = range(offset, min(offset + int(query['sysparm_limit'][0]), records_per_window))
+            return json.dumps({'result': [{'sys_id': f'{window}_{i}'} for i in ids]})
+
+        def extract(windows, resume):
+            # the default --file_limit, the file is still written when the run is killed
+            params = SimpleNamespace(
+                extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=1000, file_limit=40000000,
+                                           page_concurrency=1, token='fake_token', password='', **OUTPUT_PARAMS),
+                masking=SimpleNamespace(enabled=False)
+            )
+            checkpoint = ExtractionCheckpoint(self.output_dir, {'url': url})
+            if resume:
+                checkpoint.load()
+                windows = checkpoint.remaining_windows()
+            else:
+                checkpoint.start(windows)
+            work_queue = queue.Queue()
+            for window in windows:
+                work_queue.put(window)
+            extractor = Extractor(start_date, end_date, 0, app_settings, checkpoint=checkpoint)
+            self.stream_output(extractor)
+            # every page is journaled
+            extractor.checkpoint_interval = 0
+            if not resume:
+                # a killed run does not close its file
+                extractor.close_output = lambda: None
+            with requests_mock.Mocker() as mock_session:
+                mock_session.register_uri('GET', requests_mock.ANY, text=page)
+                try:
+                    extractor.api_extract(params, work_queue)
+                except Killed:
+                    pass
+            return checkpoint
+
+        windows = list(iterate_date_windows(start_date, end_date, 24))
+        checkpoint = extract(windows, resume=False)
+        assert checkpoint.state['completed'] == ['2021-10-01 00:00:00|2021-10-02 00:00:00']
+        assert checkpoint.state['progress'] == {'2021-10-02 00:00:00|2021-10-03 00:00:00': {'offset': 10}}
+        assert checkpoint.state['files'] == []
+        assert len(checkpoint.state['open_files']) == 1
+
+        killed_at.clear()
+        requested.clear()
+        checkpoint = extract(windows, resume=True)
+        assert requested == [('2021-10-02', 10), ('2021-10-02', 20), ('2021-10-03', 0), ('2021-10-03', 10),
+                             ('2021-10-03', 20)]
+        assert len(checkpoint.state['completed']) == 3
+        assert checkpoint.state['open_files'] == {}
+        assert len(checkpoint.state['files']) == 2
+
+        ids = [r['sys_id'] for r in self.read_output()]
+        assert len(ids) == len(set(ids)) == 3 * records_per_window
+
+    @skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_engine_stop_limit(self):
+        requested_offsets = []
+
+        class StubServiceNow(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse.parse_qs(parse.urlsplit(self.path).query)
+                offset = int(query['sysparm_offset'][0])
+                requested_offsets.append(offset)
+                body = json.dumps({'result': [{'sys_id': str(i)} for i in range(offset, offset + 10)]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubServiceNow)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            foo = lambda msg: None
+            start_date = datetime.strptime("2021-10-03", "%Y-%m-%d")
+            end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+            app_settings = SimpleNamespace(
+                logger=SimpleNamespace(info=foo, error=foo)
+            )
+            url = f"http://127.0.0.1:{server.server_port}/api/now/table/incident"
+            params = SimpleNamespace(
+                extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=25, file_limit=1000,
+                                           page_concurrency=12, max_connections=12, token='fake_token',
+                                           password='', **OUTPUT_PARAMS),
+                masking=SimpleNamespace(enabled=False)
+            )
+            extractor = AsyncExtractor(start_date, end_date, 0, app_settings)
+            self.stream_output(extractor)
+            extractor.setup_request(params)
+            extractor.extract_windows(params, False, iterate_date_windows(start_date, end_date, 24))
+            extractor.close_output()
+        finally:
+            server.shutdown()
+
+        # no pages are requested beyond the stop_limit
+        assert sorted(requested_offsets) == [0, 10, 20]
+        assert extractor.total_added == 30
+        assert extractor.records_in_flight == 0
+
+    @skipIf(aiohttp is None, 'aiohttp is not installed')
+    def test_async_engine_with_stub_server(self):
+        records_per_window = 45
+
+        class StubServiceNow(BaseHTTPRequestHandler):
+            def do_GET(self):
+                query = parse.parse_qs(parse.urlsplit(self.path).query)
+                window = re.findall(r'\d{4}-\d{2}-\d{2}', query['sysparm_query'][0])[0]
+                offset = int(query['sysparm_offset'][0])
+                limit = int(query['sysparm_limit'][0])
+                ids = range(offset, min(offset + limit, records_per_window))
+                body = json.dumps({'result': [{'sys_id': f'{window}_{i}', 'num': i} for i in ids]}).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), StubServiceNow)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        try:
+            foo = lambda msg: None
+            start_date = datetime.strptime("2021-10-01", "%Y-%m-%d")
+            end_date = datetime.strptime("2021-10-04", "%Y-%m-%d")
+            app_settings = SimpleNamespace(
+                logger=SimpleNamespace(info=foo, error=foo)
+            )
+            url = f"http://127.0.0.1:{server.server_port}/api/now/table/incident"
+            params = SimpleNamespace(
+                extracting=SimpleNamespace(url=url, batch_size=10, stop_limit=1000, file_limit=1000,
+                                           page_concurrency=2, max_connections=4, token='fake_token',
+                                           password='', **OUTPUT_PARAMS),
+                masking=SimpleNamespace(enabled=False)
+            )
+            even_only = lambda items: [item for item in items if item['num'] % 2 == 0]
+            extractor = AsyncExtractor(start_date, end_date, 0, app_settings, filter_by_column=even_only)
+            self.stream_output(extractor)
+            extractor.setup_request(params)
+            extractor.extract_windows(params, False, iterate_date_windows(start_date, end_date, 24))
+            extractor.close_output()
+        finally:
+            server.shutdown()
+
+        expected = {f'{day}_{i}' for day in ['2021-10-01', '2021-10-02', '2021-10-03']
+                    for i in range(0, records_per_window, 2)}
+        assert sorted(r['sys_id'] for r in self.read_output()) == sorted(expected)
+        assert extractor.total_added == len(expected)
+        assert extractor.total_failed == 0
@@ -1,13 +1,29 @@
 import json
-from unittest import TestCase
+from unittest import TestCase, skipIf
+from unittest.mock import patch
 from pandas.io.parsers import read_csv
 import requests_mock
-from run import cli
+from run import cli, cli_file_read, get_all_files
+import hashlib
+import hmac
+from hashlib import sha256
+import pandas as pd
+from pandas import DataFrame
+from types import SimpleNamespace
+from cli_util import DipException
+from src.anonymizer import create_anonymizer
+from src.compression import zstandard
+from src.cleaner import ANONYMIZE, DROP, MASK, Masker, MethodCondition, TextCleaner
+from src.readers import CarriageReturnFixer, JsonChunksReader, JsonLinesReader, input_extension, sniff_encoding
+from src.writers import pa
 from tests.common import SNOW_RESPONSE1, SNOW_RESPONSE_WITH_CUSTOM_ID, UNITEST_OUTPUT_FILE, UNITEST_OUTPUT_FILE_PREFIX, patch_for_tests
 import os
 import os.path
 from click.testing import CliRunner
 import csv
+import gzip
+import io
+import tempfile
 
 patch_for_tests()
 
@@ -37,10 +53,11 @@ class FilteringTestCase(TestCase):
                                   text=mock_data)
         mock_session.start()
 
+        # 4 intervals of 12 hours shared by 2 threads, every interval returns 2 records of listed users
         args = ["--extract", "--url", "https://dev71074.service-now.com/api/now/table/sys_audit?sysparm_query=tablename=incident",
                 "--username", "fake_user", "--password", "fake_pass",  "--batch_size", "10000", "--file_limit", "50000",
-                "--start_date", "2021-07-16", "--end_date", "2021-07-16", "--id_list_path", "tests/data/user_types.csv",
-                "--output_format", "json",
+                "--start_date", "2021-07-16", "--end_date", "2021-07-18", "--id_list_path", "tests/data/user_types.csv",
+                "--output_format", "json", "--interval", "12",
                 "--id_field_name", "user", "--parallel", "2"]
         
         runner = CliRunner()
@@ -48,8 +65,14 @@ class FilteringTestCase(TestCase):
         print(result.output)
         assert result.exit_code == 0
 
-        assert os.path.isfile(UNITEST_OUTPUT_FILE) and os.path.isfile(f'{UNITEST_OUTPUT_FILE_PREFIX}_1.json')
-        
+        assert os.path.isfile(UNITEST_OUTPUT_FILE) or os.path.isfile(f'{UNITEST_OUTPUT_FILE_PREFIX}_1.json')
+        total = 0
+        for output_file in [UNITEST_OUTPUT_FILE, f'{UNITEST_OUTPUT_FILE_PREFIX}_1.json']:
+            if os.path.isfile(output_file):
+                with open(output_file, 'r') as f:
+                    total += len(json.load(f))
+        assert total == 8
+        assert 'Total Added: 8' in result.output
 
     def test_mask(self):
 
@@ -177,6 +200,30 @@ class FilteringTestCase(TestCase):
             assert entry['documentkey'] == '<#CG>'
             assert 'record_checkpoint' not in entry
 
+    def test_csv_mask_with_cunksize_and_workers(self):
+
+        outputs = []
+        for workers in ["1", "3"]:
+            if os.path.isfile("tests/data/output/input_csv_processed.csv"):
+                os.remove("tests/data/output/input_csv_processed.csv")
+
+            args = ["--mask", "--output_dir", "tests/data/output",
+                    "--output_format", "csv", "--csv_chunk_size", "2", "--workers", workers,
+                    "--input_dir", "tests/data/input_csv",
+                    "--mapping_path", "tests/data/mapping_file.csv",
+                    "--custom_token_dir", "tests/data/custom",
+                    "--important_token_file", "tests/data/important_tokens.txt"]
+            runner = CliRunner()
+            result = runner.invoke(cli, args, catch_exceptions=False)
+            print(result.output)
+            assert result.exit_code == 0
+
+            with open("tests/data/output/input_csv_processed.csv", 'r', encoding="UTF-8") as f:
+                outputs.append(f.read())
+
+        assert len(read_csv("tests/data/output/input_csv_processed.csv")) == 84
+        assert outputs[0] == outputs[1]
+
     def test_csv_mask_with_cunksize_and_json_output(self):
 
         if os.path.isfile("tests/data/output/input_csv_processed.json"):
@@ -201,7 +248,251 @@ class FilteringTestCase(TestCase):
             for entry in jsn:
                 assert entry['documentkey'] == '<#CG>'
                 assert 'record_checkpoint' not in entry
-    
+
+    def test_csv_mask_with_cunksize_and_compressed_json_output(self):
+
+        if os.path.isfile("tests/data/output/input_csv_processed.json.gz"):
+            os.remove("tests/data/output/input_csv_processed.json.gz")
+
+        args = ["--mask", "--output_dir", "tests/data/output",
+                "--output_format", "json", "--csv_chunk_size", "5", "--compress", "True",
+                "--input_dir", "tests/data/input_csv",
+                "--mapping_path", "tests/data/mapping_file.csv",
+                "--custom_token_dir", "tests/data/custom",
+                "--pattern", "\\b(\\d+[a-zA-Z]|[a-zA-Z]+\\d)[\\w\\-\\_\\!\\?\\.\\#\\$\\%\\^\\&\\*\\.\\(\\)\\\\\\/]+\\b:<#CG>",
+                "--important_token_file", "tests/data/important_tokens.txt"]
+        runner = CliRunner()
+        result = runner.invoke(cli, args, catch_exceptions=False)
+        print(result.output)
+        assert result.exit_code == 0
+
+        assert os.path.isfile("tests/data/output/input_csv_processed.json.gz")
+        with gzip.open("tests/data/output/input_csv_processed.json.gz", 'rt') as f:
+            jsn = json.load(f)
+            assert len(jsn) == 84
+            for entry in jsn:
+                assert entry['documentkey'] == '<#CG>'
+                assert 'record_checkpoint' not in entry
+
+    def test_csv_mask_with_cunksize_and_compressed_csv_output(self):
+        codecs = {'gzip': ('.gz', gzip.open)}
+        if zstandard is not None:
+            codecs['zstd'] = ('.zst', lambda path, mode: zstandard.open(path, mode))
+        with tempfile.TemporaryDirectory() as tmp:
+            outputs = {}
+            for codec in [None] + list(codecs):
+                args = ["--mask", "--output_dir", os.path.join(tmp, str(codec)),
+                        "--output_format", "csv", "--csv_chunk_size", "5",
+                        "--input_dir", "tests/data/input_csv",
+                        "--mapping_path", "tests/data/mapping_file.csv",
+                        "--custom_token_dir", "tests/data/custom",
+                        "--important_token_file", "tests/data/important_tokens.txt"]
+                if codec:
+                    args += ["--compress", "True", "--compress_codec", codec, "--compress_workers", "3"]
+                result = CliRunner().invoke(cli, args, catch_exceptions=False)
+                print(result.output)
+                assert result.exit_code == 0
+
+                filename = os.path.join(tmp, str(codec), "input_csv_processed.csv")
+                extension, opener = codecs.get(codec, ('', open))
+                with opener(filename + extension, 'rt') as f:
+                    outputs[codec] = f.read()
+            # the chunks are appended to the compressed file, not only the first one
+            assert len(read_csv(os.path.join(tmp, 'None', "input_csv_processed.csv"))) == 84
+            for codec in codecs:
+                assert outputs[codec] == outputs[None]
+
+    @skipIf(pa is None, 'pyarrow is not installed')
+    def test_csv_mask_with_cunksize_and_parquet_output(self):
+        import pyarrow.parquet as pq
+
+        if os.path.isfile("tests/data/output/input_csv_processed.parquet"):
+            os.remove("tests/data/output/input_csv_processed.parquet")
+
+        args = ["--mask", "--output_dir", "tests/data/output",
+                "--output_format", "parquet", "--csv_chunk_size", "20", "--columnar_compression", "zstd",
+                "--input_dir", "tests/data/input_csv",
+                "--mapping_path", "tests/data/mapping_file.csv",
+                "--custom_token_dir", "tests/data/custom",
+                "--pattern", "\\b(\\d+[a-zA-Z]|[a-zA-Z]+\\d)[\\w\\-\\_\\!\\?\\.\\#\\$\\%\\^\\&\\*\\.\\(\\)\\\\\\/]+\\b:<#CG>",
+                "--important_token_file", "tests/data/important_tokens.txt"]
+        runner = CliRunner()
+        result = runner.invoke(cli, args, catch_exceptions=False)
+        print(result.output)
+        assert result.exit_code == 0
+
+        parquet_file = pq.ParquetFile("tests/data/output/input_csv_processed.parquet")
+        # a row group per masking chunk
+        assert [parquet_file.metadata.row_group(i).num_rows
+                for i in range(parquet_file.metadata.num_row_groups)] == [20, 20, 20, 20, 4]
+        assert parquet_file.metadata.row_group(0).column(0).compression == 'ZSTD'
+        df = parquet_file.read().to_pandas()
+        assert len(df) == 84
+        assert (df['documentkey'] == '<#CG>').all()
+        assert 'record_checkpoint' not in df
+
+    def mask_input_dir(self, input_dir, output_dir, output_format='json'):
+        args = ["--mask", "--output_dir", output_dir, "--input_dir", input_dir,
+                "--output_format", output_format, "--csv_chunk_size", "7",
+                "--mapping_path", "tests/data/mapping_file.csv",
+                "--custom_token_dir", "tests/data/custom",
+                "--important_token_file", "tests/data/important_tokens.txt"]
+        result = CliRunner().invoke(cli, args, catch_exceptions=False)
+        print(result.output)
+        assert result.exit_code == 0
+        with open(os.path.join(output_dir, "input_processed." + output_format), 'r') as f:
+            if output_format == 'jsonl':
+                return [json.loads(line) for line in f]
+            return json.load(f)
+
+    def test_mask_to_json_lines(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            expected = self.mask_input_dir("tests/data/input", os.path.join(tmp, 'json_output'))
+            assert self.mask_input_dir("tests/data/input", os.path.join(tmp, 'jsonl_output'), 'jsonl') == expected
+
+    def test_mask_json_lines_and_parquet_input(self):
+        with open("tests/data/input/input.json", 'r') as f:
+            records = json.load(f)
+        with tempfile.TemporaryDirectory() as tmp:
+            expected = self.mask_input_dir("tests/data/input", os.path.join(tmp, 'json_output'))
+
+            inputs = {'jsonl': 'input.jsonl', 'ndjson_gz': 'input.ndjson.gz'}
+            if pa is not None:
+                inputs['parquet'] = 'input.parquet'
+            for name, filename in inputs.items():
+                os.makedirs(os.path.join(tmp, name))
+                path = os.path.join(tmp, name, filename)
+                if name == 'parquet':
+                    pa.parquet.write_table(pa.Table.from_pylist(records), path, row_group_size=10)
+                else:
+                    with (gzip.open(path, 'wt') if path.endswith('.gz') else open(path, 'w')) as f:
+                        f.writelines(json.dumps(record) + '\n' for record in records)
+                assert self.mask_input_dir(os.path.join(tmp, name), os.path.join(tmp, name + '_output')) == expected
+
+    def mask_records_to_csv(self, records, filename, csv_chunk_size):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'input'))
+            with open(os.path.join(tmp, 'input', filename), 'w') as f:
+                if filename.endswith('.json'):
+                    json.dump(records, f)
+                else:
+                    f.writelines(json.dumps(record) + '\n' for record in records)
+            args = ["--mask", "--output_dir", os.path.join(tmp, 'output'),
+                    "--input_dir", os.path.join(tmp, 'input'),
+                    "--output_format", "csv", "--csv_chunk_size", str(csv_chunk_size),
+                    "--mapping_path", "tests/data/mapping_file.csv",
+                    "--custom_token_dir", "tests/data/custom",
+                    "--important_token_file", "tests/data/important_tokens.txt"]
+            result = CliRunner().invoke(cli, args)
+            print(result.output)
+            with open(os.path.join(tmp, 'output', filename.split('.')[0] + '_processed.csv'), 'r') as f:
+                return result.output, f.read()
+
+    def test_chunked_json_to_csv_with_mixed_key_order(self):
+        records = [{"a": "1", "documentkey": "x"}, {"a": "2", "documentkey": "y"},
+                   {"documentkey": "z", "a": "3"}, {"documentkey": "w"},
+                   {"documentkey": "v"}, {"documentkey": "u"}]
+        _, expected = self.mask_records_to_csv(records, 'records.json', 100)
+        assert expected.splitlines()[:5] == ['a,documentkey', '1,x', '2,y', '3,z', 'NULL,w']
+        assert self.mask_records_to_csv(records, 'records.json', 2)[1] == expected
+
+        # a column first found in a later chunk is in the header, like without chunks
+        records.append({"documentkey": "t", "b": "new"})
+        _, expected = self.mask_records_to_csv(records, 'records.json', 100)
+        assert expected.splitlines()[0] == 'a,documentkey,b' and expected.splitlines()[1] == '1,x,NULL'
+        assert self.mask_records_to_csv(records, 'records.json', 2)[1] == expected
+
+    def test_chunked_json_lines_to_csv_with_mixed_key_order(self):
+        records = [{"a": "1", "documentkey": "x"}, {"documentkey": "z", "a": "3"},
+                   {"documentkey": "w"}, {"documentkey": "v", "a": "4"}, {"documentkey": "u"}]
+        _, expected = self.mask_records_to_csv(records, 'records.jsonl', 100)
+        assert expected.splitlines() == ['a,documentkey', '1,x', '3,z', 'NULL,w', '4,v', 'NULL,u']
+        assert self.mask_records_to_csv(records, 'records.jsonl', 1)[1] == expected
+
+        records.append({"b": "new"})
+        _, expected = self.mask_records_to_csv(records, 'records.jsonl', 100)
+        assert expected.splitlines()[-1] == 'NULL,NULL,new'
+        assert self.mask_records_to_csv(records, 'records.jsonl', 2)[1] == expected
+
+    def test_mask_json_without_records(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'input'))
+            for filename, text in [('empty.json', '[]'), ('wrapped.json', '{"records": []}')]:
+                with open(os.path.join(tmp, 'input', filename), 'w') as f:
+                    f.write(text)
+            for output_format in ['json', 'csv'] + (['parquet'] if pa is not None else []):
+                output_dir = os.path.join(tmp, output_format)
+                args = ["--mask", "--output_dir", output_dir, "--input_dir", os.path.join(tmp, 'input'),
+                        "--output_format", output_format,
+                        "--mapping_path", "tests/data/mapping_file.csv",
+                        "--custom_token_dir", "tests/data/custom",
+                        "--important_token_file", "tests/data/important_tokens.txt"]
+                result = CliRunner().invoke(cli, args, catch_exceptions=False)
+                print(result.output)
+                assert result.exit_code == 0 and 'Masking error' not in result.output
+                for name in ['empty', 'wrapped']:
+                    output_filename = os.path.join(output_dir, f'{name}_processed.{output_format}')
+                    if output_format == 'parquet':
+                        import pyarrow.parquet as pq
+                        assert pq.read_table(output_filename).num_rows == 0
+                        continue
+                    with open(output_filename, 'r') as f:
+                        text = f.read()
+                    assert (json.loads(text) == []) if output_format == 'json' else not text.strip()
+
+    def test_masking_input_skips_extraction_checkpoint(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for filename in ['input.json', 'extracting.checkpoint', 'notes.txt']:
+                with open(os.path.join(tmp, filename), 'w') as f:
+                    f.write('[]')
+            files = []
+            get_all_files(SimpleNamespace(input_file=None, input_dir=tmp), files)
+            assert files == [os.path.join(tmp, '', 'input.json')]
+
+    def test_json_lines_reader(self):
+        assert input_extension('a/b.users.jsonl.gz') == ('jsonl', 'gzip')
+        assert input_extension('a/b.ndjson') == ('ndjson', None)
+        assert input_extension('a.b/records.csv.zst') == ('csv', 'zstd')
+        with tempfile.TemporaryDirectory() as tmp:
+            filename = os.path.join(tmp, 'records.jsonl')
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('{"a": 1, "b": "x"}\n\n{"a": 2}\n{"a": 3, "b": {"c": 1}}\n')
+            reader = JsonLinesReader(filename, chunk_size=2)
+            assert reader.probe()
+            chunks = list(reader)
+            assert [len(chunk) for chunk in chunks] == [2, 1]
+            assert chunks[1]['b'][0] == {'c': 1}
+
+            with open(filename, 'a', encoding='utf-8') as f:
+                f.write('{"a": \n')
+            with self.assertRaises(DipException):
+                list(reader)
+
+    @skipIf(pa is None, 'pyarrow is not installed')
+    def test_chunked_parquet_output_with_drifting_types(self):
+        import pyarrow.parquet as pq
+        with tempfile.TemporaryDirectory() as tmp:
+            os.makedirs(os.path.join(tmp, 'input'))
+            with open(os.path.join(tmp, 'input', 'codes.csv'), 'w') as f:
+                f.write('code,documentkey\n1,a\n2,b\nABC,c\n3,d\n')
+            with open(os.path.join(tmp, 'input', 'records.json'), 'w') as f:
+                json.dump([{'code': 1, 'documentkey': 'a'}, {'code': 2, 'documentkey': 'b'},
+                           {'code': 'ABC', 'documentkey': 'c'}, {'code': 2.5, 'documentkey': 'd'}], f)
+            args = ["--mask", "--output_dir", os.path.join(tmp, 'output'),
+                    "--input_dir", os.path.join(tmp, 'input'),
+                    "--output_format", "parquet", "--csv_chunk_size", "2",
+                    "--mapping_path", "tests/data/mapping_file.csv",
+                    "--custom_token_dir", "tests/data/custom",
+                    "--important_token_file", "tests/data/important_tokens.txt"]
+            result = CliRunner().invoke(cli, args, catch_exceptions=False)
+            print(result.output)
+            assert result.exit_code == 0
+
+            table = pq.read_table(os.path.join(tmp, 'output', 'codes_processed.parquet'))
+            assert table.column('code').to_pylist() == ['1', '2', 'ABC', '3']
+            table = pq.read_table(os.path.join(tmp, 'output', 'records_processed.parquet'))
+            assert table.column('code').to_pylist() == ['1', '2', 'ABC', '2.5']
+
     def test_mask_to_csv(self):
 
         if os.path.isfile("tests/data/output/input_processed.csv"):
@@ -353,3 +644,237 @@ class FilteringTestCase(TestCase):
             assert 'לדוד משה היתה חווה' in text
             assert 'Old MacDonald Had a Farm' in text
 
+
+    def test_cleaner_detectors_precedence(self):
+        cleaner = TextCleaner([])
+        samples = {
+            "Please call me at +972 54 123 4567 or mail john.doe@example.com":
+                'Please call me at <#P>or mail  <#M>',
+            "server 10.0.0.12 is down, see www.example.com/status for details":
+                'server  <#I>  is down, see  <#U>  for details',
+            "order 123456 and ref ab123456cd and id 12345": 'order  <#>  and ref ab123456cd and id 12345',
+            "ctrl\x01char inside text and tab\tseparated and (parens:colons) ok":
+                'inside text and tab\tseparated and (parens:colons) ok',
+            "emails a@b, @handle and x@y.z; ip 1.2.3.4:8080": 'emails  <#M>  @handle and  <#M>  ip  <#I> :8080',
+            "ssn 123_45_6789 plain": 'ssn \x01 <#SSN> \x03 plain',
+            "nothing to mask here at all just words": 'nothing to mask here at all just words',
+        }
+        for text, expected in samples.items():
+            assert cleaner.clean_custom_tokens_chunk(text) == expected
+
+        cleaner = TextCleaner([], patterns=[r'\bab\d+cd\b:<#AB>'])
+        assert cleaner.clean_custom_tokens_chunk("ref ab123456cd and 1234567") == 'ref <#AB> and  <#>'
+
+    def test_cleaner_condition_clean(self):
+        cleaner = TextCleaner([])
+        df = DataFrame({'fieldname': ['comments', 'state', 'comments', 'other', None],
+                        'Field Name': [None, None, 'state', 'short_description', 'state'],
+                        'newvalue': ['call 0541234567', 'closed', 'mail a@b.com', 'secret', 'open']})
+        conditions = [MethodCondition(2.0, 'fieldname', 'comments'),
+                      MethodCondition(3.0, 'Field Name', 'state'),
+                      MethodCondition(1.0, 'Field Name', 'short_description'),
+                      MethodCondition(2.0, 'missing', 'state')]
+        assert cleaner.condition_clean(df, conditions, 'newvalue') == \
+            ['call  <#>', 'closed', 'mail  <#M>', sha256('secret'.encode('utf-8')).hexdigest(), None]
+
+    def test_masker_mapping_plan(self):
+        def create_masker():
+            return Masker(TextCleaner([]), SimpleNamespace(white_list=None), cli_file_read("tests/data/mapping_file.csv"),
+                          [], anonymize_value=ANONYMIZE, mask_value=MASK, drop_value=DROP)
+
+        masker = create_masker()
+        assert masker.plan['oldvalue'].conditions == (('fieldname', 'short_description'), ('fieldname', 'fieldname'))
+        assert masker.plan['newvalue'].method == MASK and not masker.plan['newvalue'].conditions
+        assert masker.plan['record_checkpoint'].method == DROP
+        # the plan is compiled once per mapping file
+        assert create_masker().plan is masker.plan
+
+        records = masker([{'fieldname': 'short_description', 'oldvalue': 'id 1234567', 'newvalue': 'mail a@b.com',
+                           'record_checkpoint': 1},
+                          {'fieldname': 'state', 'oldvalue': 'id 1234567', 'newvalue': 'ok',
+                           'record_checkpoint': 2}])
+        assert records == [{'fieldname': 'short_description', 'oldvalue': 'id  <#>', 'newvalue': 'mail  <#M>'},
+                           {'fieldname': 'state', 'oldvalue': 'id 1234567', 'newvalue': 'ok'}]
+
+    def test_masker_white_list_filter(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            mapping_path = os.path.join(temp_dir, 'mapping_file.csv')
+            with open(mapping_path, 'w') as f:
+                f.write('column,method,condition\nstate,4,1 3\nnewvalue,2,\n')
+            masker = Masker(TextCleaner([]), SimpleNamespace(white_list=None), cli_file_read(mapping_path),
+                            [], anonymize_value=ANONYMIZE, mask_value=MASK, drop_value=DROP)
+
+        # the filtered rows are a copy, not a view setting values on a slice
+        with pd.option_context('mode.chained_assignment', 'raise'):
+            records = masker([{'state': '1', 'newvalue': 'id 1234567', 'count': 2.0, 'ratio': 0.5},
+                              {'state': '2', 'newvalue': 'dropped', 'count': 3.0, 'ratio': 1.0},
+                              {'state': '3', 'newvalue': 'kept', 'count': 4.0, 'ratio': 1.0}])
+        assert records == [{'state': '1', 'newvalue': 'id  <#>', 'count': 2, 'ratio': 0.5},
+                           {'state': '3', 'newvalue': 'kept', 'count': 4, 'ratio': 1.0}]
+        assert all(type(record['count']) == int for record in records)
+
+    def test_cleaner_anonymize_distinct_values(self):
+        def anonymized(x):
+            return sha256(str(x).encode('utf-8')).hexdigest()
+
+        cleaner = TextCleaner([])
+        data = ['admin', 'admin', None, '', 'nan', 'john', 'admin']
+        expected = [anonymized('admin'), anonymized('admin'), None, '', 'nan', anonymized('john'), anonymized('admin')]
+        assert cleaner.anonymize(data) == expected
+        assert cleaner.anonymize(data, no_clean=[False, True] * 3 + [False]) == \
+            [expected[0], 'admin', None, '', 'nan', 'john', expected[6]]
+        floats = cleaner.anonymize(DataFrame({'x': [1.5, float('nan'), 2.0]})['x'].values)
+        assert floats[0] == anonymized(1.5) and floats[2] == anonymized(2.0) and floats[1] != floats[1]
+        # values of mixed types are hashed one by one, 1 and 1.0 do not share a hash
+        assert cleaner.anonymize([1, 1.0, 'a']) == [anonymized(1), anonymized(1.0), anonymized('a')]
+
+        stats = cleaner.take_anonymize_stats()
+        assert stats['misses'] == 4 and stats['hits'] == 2 and stats['values'] == 11
+        assert cleaner.anonymize_summary() is None
+
+    def test_cleaner_mask_cache(self):
+        texts = ['call 0541234567', 'closed', 'call 0541234567', 'x' * 5000 + ' 1234567', 7]
+        expected = TextCleaner([]).transform(texts)
+        assert expected == ['call  <#>', 'closed', 'call  <#>', 'x' * 5000 + '  <#>', '7']
+
+        cleaner = TextCleaner([], mask_cache_size=1024 * 1024)
+        assert cleaner.transform(texts) == expected
+        assert cleaner.transform_with_condition(texts, [False, True, True, False, False]) == \
+            ['call  <#>', 'closed', 'call 0541234567', 'x' * 5000 + '  <#>', '7']
+        # the cache is bounded by memory, the oldest texts are dropped first
+        cleaner = TextCleaner([], mask_cache_size=300)
+        assert cleaner.transform([f'mail user{i}@example.com' for i in range(100)]) == ['mail  <#M>'] * 100
+        assert 0 < cleaner._TextCleaner__mask_cache_bytes <= 300
+
+    def test_keyed_anonymizers(self):
+        assert create_anonymizer()('admin') == sha256(b'admin').hexdigest()
+
+        blake2b = create_anonymizer('secret', digest_size=16)
+        assert blake2b('admin') == hashlib.blake2b(b'admin', key=b'secret', digest_size=16).hexdigest()
+        assert blake2b.hash_many(['admin', 'john']) == [blake2b('admin'), blake2b('john')]
+        assert create_anonymizer('other', digest_size=16)('admin') != blake2b('admin')
+
+        hmac_sha256 = create_anonymizer('secret', digest_size=8, use_hmac=True)
+        assert hmac_sha256(42) == hmac.new(b'secret', b'42', 'sha256').hexdigest()[:16]
+        self.assertRaises(DipException, create_anonymizer, 'secret', 40, True)
+
+        cleaner = TextCleaner([], anonymizer=blake2b)
+        assert cleaner.anonymize(['admin', None, 'admin', 'john'], no_clean=[False, False, True, False]) == \
+            [blake2b('admin'), None, 'admin', blake2b('john')]
+        assert cleaner.anonymize([1, 'admin']) == [blake2b(1), blake2b('admin')]
+
+    def test_json_chunks_reader(self):
+        records = [{'sys_id': f'id{i}', 'number': i * 1000, 'ok': i % 2 == 0, 'text': 'a, b ] } "q"' * i}
+                   for i in range(7)]
+        others = [{'sys_id': 'other'}] * 4
+        # records are preferred to data and data to result, wherever they are in the object
+        documents = [records, {'result': records}, {'count': 7, 'meta': {'x': [1]}, 'records': records},
+                     {'table': records}, {'data': others, 'count': 7, 'records': records},
+                     {'result': others, 'data': records, 'meta': {'records': 1}}]
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'input.json')
+            for document in documents:
+                with open(filename, 'w', encoding='utf-8') as f:
+                    f.write('\ufeff' + json.dumps(document, indent=2))
+                reader = JsonChunksReader(filename, chunk_size=3, block_size=7)
+                assert reader.probe()
+                chunks = list(reader)
+                assert [len(chunk) for chunk in chunks] == [3, 3, 1]
+                assert [r for chunk in chunks for r in chunk.to_dict(orient='records')] == records
+
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('[{"a": 1}, {"a": 2')
+            self.assertRaises(DipException, list, JsonChunksReader(filename, chunk_size=3, block_size=4))
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write('  \n')
+            assert not JsonChunksReader(filename).probe()
+
+    def test_sniff_encoding(self):
+        encodings = ['utf-8', 'latin-1', 'utf-8-sig']
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'input.csv')
+            samples = [('a,b\nשלום,1\n'.encode('utf-8'), 'utf-8'),
+                       ('a,b\ncafé,1\n'.encode('latin-1'), 'latin-1'),
+                       ('a,b\ncafé,1\n'.encode('utf-8-sig'), 'utf-8-sig'),
+                       ('a,b\ncafé,1\n'.encode('utf-16'), 'utf-16')]
+            for data, expected in samples:
+                with open(filename, 'wb') as f:
+                    f.write(data)
+                assert sniff_encoding(filename, encodings) == expected
+                input_file = cli_file_read(filename, 'utf-8', csv_chunk=None)
+                assert input_file.encoding == expected
+                assert input_file.data.iloc[0, 0] in ('שלום', 'café')
+
+            # a character cut by the end of the sample does not fail the sample
+            with open(filename, 'wb') as f:
+                f.write(samples[0][0])
+            assert sniff_encoding(filename, encodings, sample_size=5) == 'utf-8'
+
+    def test_fix_data_without_temp_copy(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            filename = os.path.join(temp_dir, 'input.csv')
+            with open(filename, 'w', encoding='latin-1', newline='') as f:
+                f.write('a,b\r\ncafé,"x\ry"\r\n1,2\r\n')
+            for csv_chunk in [None, 1]:
+                input_file = cli_file_read(filename, 'utf-8', csv_chunk=csv_chunk, fix_data=True)
+                data = input_file.data if csv_chunk is None else pd.concat(list(input_file.data))
+                assert data.astype(str).values.tolist() == [['café', 'x\ny'], ['1', '2']]
+                assert input_file.encoding == 'latin-1'
+            assert os.listdir(temp_dir) == ['input.csv']
+
+            stream = CarriageReturnFixer(filename, encoding='latin-1', block_size=4)
+            assert stream.read() == 'a,b\ncafé,"x\ny"\n1,2\n'
+            assert stream.read() == '' and stream.closed
+
+    @skipIf(zstandard is None, 'zstandard is not installed')
+    def test_zstd_csv_input(self):
+        with open("tests/data/input/input.json", 'r') as f:
+            csv_data = pd.DataFrame(json.load(f)).to_csv(index=False)
+        with tempfile.TemporaryDirectory() as tmp:
+            for extension in ['csv', 'csv.zst']:
+                os.makedirs(os.path.join(tmp, extension))
+            with open(os.path.join(tmp, 'csv', 'input.csv'), 'w', encoding='utf-8') as f:
+                f.write(csv_data)
+            with open(os.path.join(tmp, 'csv.zst', 'input.csv.zst'), 'wb') as f:
+                f.write(zstandard.ZstdCompressor().compress(csv_data.encode('utf-8')))
+
+            def read_csv_without_zstd(filepath_or_buffer, **kwargs):
+                # pandas versions before 1.4 do not infer zstd from the file name
+                return read_csv(filepath_or_buffer, compression=None, **kwargs)
+
+            with patch('run.read_csv', read_csv_without_zstd):
+                input_file = cli_file_read(os.path.join(tmp, 'csv.zst', 'input.csv.zst'), csv_chunk=7,
+                                           set_dtype=True)
+            data = pd.concat(list(input_file.data))
+            assert data.equals(read_csv(io.StringIO(csv_data), dtype='unicode'))
+            expected = self.mask_input_dir(os.path.join(tmp, 'csv'), os.path.join(tmp, 'csv_output'))
+            assert self.mask_input_dir(os.path.join(tmp, 'csv.zst'), os.path.join(tmp, 'zst_output')) == expected
+
+    def test_compressed_input(self):
+        codecs = {'gz': gzip.compress}
+        if zstandard is not None:
+            codecs['zst'] = zstandard.ZstdCompressor().compress
+        with open("tests/data/input/input.json", 'rb') as f:
+            json_data = f.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            expected = self.mask_input_dir("tests/data/input", os.path.join(tmp, 'json_output'))
+            for extension, compress in codecs.items():
+                csv_filename = os.path.join(tmp, 'input.csv.' + extension)
+                with open(csv_filename, 'wb') as f:
+                    f.write(compress('a,b\r\ncafé,"x\ry"\r\n1,2\r\n'.encode('latin-1')))
+                for csv_chunk in [None, 1]:
+                    input_file = cli_file_read(csv_filename, 'utf-8', csv_chunk=csv_chunk, fix_data=True)
+                    data = input_file.data if csv_chunk is None else pd.concat(list(input_file.data))
+                    assert data.astype(str).values.tolist() == [['café', 'x\ny'], ['1', '2']]
+                    # sniffed from the decompressed sample
+                    assert input_file.encoding == 'latin-1'
+
+                input_dir = os.path.join(tmp, extension)
+                os.makedirs(input_dir)
+                # written as concatenated members like the --compress output
+                with open(os.path.join(input_dir, 'input.json.' + extension), 'wb') as f:
+                    f.write(compress(json_data[:1000]) + compress(json_data[1000:]))
+                input_file = cli_file_read(os.path.join(input_dir, 'input.json.' + extension))
+                assert input_file.non_extension_part == 'input' and input_file.extra_ext is None
+                assert len(input_file.data) == len(json.loads(json_data))
+                assert self.mask_input_dir(input_dir, os.path.join(tmp, extension + '_output')) == expected